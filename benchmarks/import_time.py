@@ -0,0 +1,71 @@
+#!/usr/bin/env python3
+"""
+startup benchmark: import time of the app entrypoints and cli commands by `python -X importtime`.
+
+usage: `python benchmarks/import_time.py [--runs 5] [--check]`.
+with `--check` it exits with 1, if the median time of any case is over its budget.
+"""
+
+import argparse
+import statistics
+import subprocess  # noqa: S404
+import sys
+from typing import Dict, List, Tuple
+
+# case: (python args, budget in ms). budgets exclude the interpreter startup.
+# commands are run against local addresses, they fail fast and send nothing outside
+CASES: Dict[str, Tuple[List[str], float]] = {
+    'wol.cli': (['-c', 'import wol.cli'], 300),
+    'wol.wsgi': (['-c', 'import wol.wsgi'], 500),
+    'cli wake': (['-m', 'wol.cli', 'wake', '00:00:00:00:00:00', '--host', '127.0.0.1'], 300),
+    'cli check': (['-m', 'wol.cli', 'check', '127.0.0.1', '--method', 'tcp', '--port', '9',
+                   '--timeout', '0.1'], 350),
+    'cli stats': (['-m', 'wol.cli', 'stats', '127.0.0.1', '--port', '9'], 500),
+    'cli scan': (['-m', 'wol.cli', 'scan', '--net', '127.0.0.1/32'], 1000),
+}
+
+
+def measure(args: List[str]) -> Tuple[float, List[Tuple[float, str]]]:
+    """total import time in ms and cumulative times of imports of the first two levels."""
+    proc = subprocess.run([sys.executable, '-X', 'importtime', *args],  # noqa: S603
+                          stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True)
+    total = 0
+    top = []
+    for line in proc.stderr.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        self_us, cumulative_us, name = line[len('import time:'):].split('|')
+        total += int(self_us)
+        depth = (len(name) - len(name.lstrip()) - 1) // 2
+        # the entrypoint itself is not interesting
+        if depth <= 1 and f'import {name.strip()}' not in args:
+            top.append((int(cumulative_us) / 1000, name.strip()))
+    return total / 1000, top
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--runs', type=int, default=5, help="runs of each case, the median is taken")
+    parser.add_argument('--check', action='store_true', help="fail, if any case is over its budget")
+    parser.add_argument('--top', type=int, default=5, help="count of the slowest top level imports to show")
+    args = parser.parse_args()
+
+    baseline = statistics.median(measure(['-c', 'pass'])[0] for _ in range(args.runs))
+    over_budget = []
+    for name, (case_args, budget) in CASES.items():
+        runs = [measure(case_args) for _ in range(args.runs)]
+        median = statistics.median(total for total, _ in runs) - baseline
+        status = 'ok' if median <= budget else 'OVER BUDGET'
+        print(f'{name:<12} {median:8.1f} ms  (budget {budget:.0f} ms)  {status}')
+        for cumulative, module in sorted(runs[-1][1], reverse=True)[:args.top]:
+            print(f'    {cumulative:8.1f} ms  {module}')
+        if median > budget:
+            over_budget.append(name)
+
+    if args.check and over_budget:
+        print(f'over budget: {", ".join(over_budget)}')
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
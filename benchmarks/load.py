@@ -0,0 +1,220 @@
+#!/usr/bin/env python3
+"""
+load of many concurrent clients on the http api, served by gunicorn sync workers (the wsgi app)
+and by uvicorn (the asgi app). servers run in subprocesses with a seeded sqlite database,
+hosts are local stand-ins:
+
+- `crud` - `GET /api/targets/<id>/` of random targets;
+- `ssh` - `POST /api/cpu_stat/` to a sshd, which answers in `--ssh-delay` seconds;
+- `probe` - `POST /api/check_host/batch/` of a hanging host by the banner of sshd, it waits for the timeout.
+
+usage: `python benchmarks/load.py [--concurrency 200] [--seconds 5] [--scenario ssh] [--server asgi]`.
+servers, which are not installed, are skipped.
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import socket
+import statistics
+import subprocess
+import sys
+import time
+from importlib.util import find_spec
+from typing import (
+    Callable,
+    Dict,
+    List,
+    Optional,
+    Tuple,
+)
+
+from standins import Tarpit, seeded_app, ssh_server_process
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SERVER_MODULES = {'wsgi': 'gunicorn', 'asgi': 'uvicorn'}
+
+Request = Tuple[str, str, Optional[dict]]
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def server_command(server: str, port: int, workers: int, threads: int) -> List[str]:
+    if server == 'wsgi':
+        return [sys.executable, '-m', 'gunicorn', '-b', f'127.0.0.1:{port}', '-w', str(workers),
+                '--threads', str(threads), '--backlog', '4096', '--log-level', 'warning', 'wol.wsgi:create_app()']
+    return [sys.executable, '-m', 'uvicorn', '--factory', 'wol.asgi:create_asgi_app', '--port', str(port),
+            '--log-level', 'warning', '--no-access-log', '--backlog', '4096']
+
+
+class Server:
+    """the server in a subprocess, ready to accept requests."""
+
+    def __init__(self, server: str, workers: int, threads: int):
+        self.port = free_port()
+        env = {
+            **os.environ,
+            'PYTHONPATH': os.pathsep.join(filter(None, [ROOT, os.environ.get('PYTHONPATH')])),
+            'WOL_LOG_LEVEL': 'WARNING',
+            'WOL_SSH_MAX_PER_HOST': '256',
+        }
+        self._process = subprocess.Popen(server_command(server, self.port, workers, threads), env=env)
+
+    def __enter__(self) -> 'Server':
+        deadline = time.monotonic() + 30
+        while time.monotonic() < deadline:
+            if self._process.poll() is not None:
+                raise RuntimeError(f'the server has exited with {self._process.returncode}')
+            try:
+                socket.create_connection(('127.0.0.1', self.port), timeout=1).close()
+                return self
+            except OSError:
+                time.sleep(0.1)
+        self.__exit__()
+        raise RuntimeError('the server is not started in 30 seconds')
+
+    def __exit__(self, *exc_info) -> None:
+        self._process.terminate()
+        try:
+            self._process.wait(10)
+        except subprocess.TimeoutExpired:
+            self._process.kill()
+            self._process.wait()
+
+
+class Connection:
+    """http/1.1 connection with keep-alive. it's reopened, if the server closes it."""
+
+    def __init__(self, port: int):
+        self.port = port
+        self._reader: Optional[asyncio.StreamReader] = None
+        self._writer: Optional[asyncio.StreamWriter] = None
+
+    async def request(self, method: str, path: str, body: Optional[dict]) -> int:
+        if self._writer is None:
+            self._reader, self._writer = await asyncio.open_connection('127.0.0.1', self.port)
+        data = json.dumps(body).encode() if body is not None else b''
+        self._writer.write(f'{method} {path} HTTP/1.1\r\nHost: localhost\r\nContent-Type: application/json\r\n'
+                           f'Content-Length: {len(data)}\r\n\r\n'.encode() + data)
+        await self._writer.drain()
+
+        status_line = await self._reader.readline()
+        if not status_line:
+            raise ConnectionError('the connection is closed')
+        headers = {}
+        while True:
+            line = await self._reader.readline()
+            if line in (b'\r\n', b''):
+                break
+            name, _, value = line.decode('latin-1').partition(':')
+            headers[name.strip().lower()] = value.strip()
+        if 'content-length' in headers:
+            await self._reader.readexactly(int(headers['content-length']))
+        elif headers.get('transfer-encoding') == 'chunked':
+            while True:
+                size = int((await self._reader.readline()).split(b';')[0], 16)
+                await self._reader.readexactly(size + 2)
+                if not size:
+                    break
+        if headers.get('connection', '').lower() == 'close':
+            self.close()
+        return int(status_line.split()[1])
+
+    def close(self) -> None:
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
+
+
+async def run_load(port: int, requests: Callable[[], Request], concurrency: int, seconds: float) -> dict:
+    """requests per second, percentiles of latency in ms and count of errors (failed and not 2xx requests)."""
+    latencies: List[float] = []
+    errors = 0
+    deadline = time.perf_counter() + seconds
+
+    async def client():
+        nonlocal errors
+        connection = Connection(port)
+        while time.perf_counter() < deadline:
+            started = time.perf_counter()
+            try:
+                status = await connection.request(*requests())
+            except (OSError, asyncio.IncompleteReadError, ValueError):
+                connection.close()
+                status = None
+            latencies.append(time.perf_counter() - started)
+            if status is None or status >= 300:
+                errors += 1
+        connection.close()
+
+    started = time.perf_counter()
+    await asyncio.gather(*(client() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - started
+    latencies.sort()
+
+    def percentile(share: float) -> float:
+        return round(latencies[min(int(len(latencies) * share), len(latencies) - 1)] * 1000, 1)
+
+    return {
+        'rps': round(len(latencies) / elapsed, 1),
+        'p50_ms': round(statistics.median(latencies) * 1000, 1),
+        'p95_ms': percentile(0.95),
+        'p99_ms': percentile(0.99),
+        'errors': errors,
+    }
+
+
+def scenarios(args: argparse.Namespace, ssh_port: int, tarpit_port: int) -> Dict[str, Callable[[], Request]]:
+    return {
+        'crud': lambda: ('GET', f'/api/targets/{random.randint(1, args.targets)}/', None),
+        'ssh': lambda: ('POST', '/api/cpu_stat/', {'host': '127.0.0.1', 'port': ssh_port,
+                                                   'login': 'bench', 'password': 'bench'}),
+        'probe': lambda: ('POST', '/api/check_host/batch/', {'hosts': ['127.0.0.1'], 'port': tarpit_port,
+                                                             'method': 'ssh', 'timeout': args.probe_timeout}),
+    }
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--concurrency', type=int, default=200, help="concurrent clients")
+    parser.add_argument('--seconds', type=float, default=5, help="duration of each scenario")
+    parser.add_argument('--scenario', action='append', choices=['crud', 'ssh', 'probe'],
+                        help="scenarios to run. default - all")
+    parser.add_argument('--server', action='append', choices=list(SERVER_MODULES),
+                        help="servers to compare. default - all installed")
+    parser.add_argument('--workers', type=int, default=4, help="gunicorn workers")
+    parser.add_argument('--threads', type=int, default=1, help="threads of each gunicorn worker")
+    parser.add_argument('--targets', type=int, default=10000, help="targets in the database")
+    parser.add_argument('--ssh-delay', type=float, default=0.5, help="seconds of each ssh command")
+    parser.add_argument('--probe-timeout', type=float, default=0.5, help="timeout of checks of the hanging host")
+    return parser.parse_args()
+
+
+def main() -> None:
+    args = parse_args()
+    servers = []
+    for server in args.server or list(SERVER_MODULES):
+        if find_spec(SERVER_MODULES[server]) is None:
+            print(f'{server}: {SERVER_MODULES[server]} is not installed, skipped', file=sys.stderr)
+        else:
+            servers.append(server)
+
+    print(f'{"server":<6} {"scenario":<8} {"req/s":>9} {"p50 ms":>9} {"p95 ms":>9} {"p99 ms":>9} {"errors":>7}')
+    with seeded_app(args.targets), ssh_server_process(args.ssh_delay) as ssh_port, Tarpit() as tarpit:
+        requests = scenarios(args, ssh_port, tarpit.port)
+        for server in servers:
+            with Server(server, args.workers, args.threads) as running:
+                for scenario in args.scenario or list(requests):
+                    result = asyncio.run(run_load(running.port, requests[scenario], args.concurrency, args.seconds))
+                    print(f'{server:<6} {scenario:<8} {result["rps"]:9.1f} {result["p50_ms"]:9.1f} '
+                          f'{result["p95_ms"]:9.1f} {result["p99_ms"]:9.1f} {result["errors"]:7}')
+
+
+if __name__ == '__main__':
+    main()
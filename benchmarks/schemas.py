@@ -0,0 +1,92 @@
+#!/usr/bin/env python3
+"""
+schemas benchmark: marshmallow against compiled schemas, by loads/dumps per second
+and by requests per second through a flask test client.
+
+usage: `python benchmarks/schemas.py [--seconds 1] [--targets 1000]`.
+"""
+
+import argparse
+import time
+from functools import partial
+from types import SimpleNamespace
+from typing import Callable
+
+from flask import Flask, request
+
+from wol.compiled_schema import compile_schema
+from wol.decorators import parse_body
+from wol.logic.crud import CredentialsSchema, TargetSchema
+from wol.views.core import SshActionSchema, WakeupSchema
+
+LOAD_CASES = {
+    'WakeupSchema': (WakeupSchema, {'mac': 'aa:bb:cc:dd:ee:ff', 'host': '192.168.1.255', 'port': 9}),
+    'SshActionSchema': (SshActionSchema, {'host': '192.168.1.10', 'port': 22, 'login': 'root', 'password': 'x'}),
+    'TargetSchema': (TargetSchema, {'name': 'pc', 'host': '192.168.1.10', 'mac': 'aa:bb:cc:dd:ee:ff',
+                                    'wol_port': 9, 'credentials': {'username': 'root', 'password': 'x'}}),
+    'CredentialsSchema': (CredentialsSchema, {'username': 'root', 'password': 'x'}),
+}
+
+
+def rate(func: Callable[[], None], seconds: float) -> float:
+    """calls per second."""
+    count = 0
+    started = time.perf_counter()
+    deadline = started + seconds
+    while time.perf_counter() < deadline:
+        for _ in range(100):
+            func()
+        count += 100
+    return count / (time.perf_counter() - started)
+
+
+def report(name: str, before: float, after: float, unit: str) -> None:
+    print(f'{name:<26} {before:12.0f} {after:12.0f} {unit:<8} x{after / before:.1f}')
+
+
+def make_app() -> Flask:
+    app = Flask(__name__)
+    schema = WakeupSchema()
+
+    @app.route('/marshmallow/', methods=['POST'])
+    def marshmallow_view():
+        schema.load(request.get_json())
+        return '', 204
+
+    @app.route('/compiled/', methods=['POST'])
+    @parse_body(schema)
+    def compiled_view(body: dict):
+        return '', 204
+
+    return app
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--seconds', type=float, default=1, help="duration of each measure")
+    parser.add_argument('--targets', type=int, default=1000, help="count of targets in the dumped list")
+    args = parser.parse_args()
+
+    print(f'{"case":<26} {"marshmallow":>12} {"compiled":>12}')
+    for name, (schema_class, data) in LOAD_CASES.items():
+        schema = schema_class()
+        compiled = compile_schema(schema)
+        report(f'load {name}', rate(partial(schema.load, data), args.seconds),
+               rate(partial(compiled.load, data), args.seconds), 'ops/s')
+
+    credentials = SimpleNamespace(id=1, username='root', password='x', pkey=None)
+    targets = [SimpleNamespace(id=i, name=f'pc{i}', host='192.168.1.10', mac='aa:bb:cc:dd:ee:ff', wol_port=9,
+                               credentials=credentials) for i in range(args.targets)]
+    schema = TargetSchema(many=True)
+    compiled = compile_schema(TargetSchema())
+    report(f'dump {args.targets} targets', rate(lambda: schema.dump(targets), args.seconds),
+           rate(lambda: compiled.dump_many(targets), args.seconds), 'lists/s')
+
+    client = make_app().test_client()
+    data = LOAD_CASES['WakeupSchema'][1]
+    report('POST with WakeupSchema', rate(lambda: client.post('/marshmallow/', json=data), args.seconds),
+           rate(lambda: client.post('/compiled/', json=data), args.seconds), 'req/s')
+
+
+if __name__ == '__main__':
+    main()
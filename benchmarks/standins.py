@@ -0,0 +1,318 @@
+"""
+local stand-ins of hosts for benchmarks: sshd, udp sink of magic packets, ping binary,
+arp responder and a seeded database. nothing is sent outside the localhost.
+"""
+
+import os
+import socket
+import stat
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+from types import SimpleNamespace
+from typing import (
+    Callable,
+    Dict,
+    Iterator,
+    List,
+    Optional,
+)
+
+__all__ = ['SshServer', 'ssh_server_process', 'UdpSink', 'Tarpit', 'fake_ping', 'fake_arp', 'seeded_app']
+
+PROC_STAT_LINE = 'cpu  {user} 0 {system} {idle} 10 0 5 0 0 0\n'
+
+
+class SshServer:
+    """in-process sshd on a random localhost port. any login and password are accepted.
+
+    `head -1 /proc/stat` commands are answered with growing fake counters without sleeping,
+    other commands succeed with empty output.
+
+    :param delay: seconds of each command, e.g. the sleep between reads of /proc/stat.
+    """
+
+    def __init__(self, delay: float = 0):
+        import paramiko
+
+        self._paramiko = paramiko
+        self._handler = _ssh_handler_class()
+        self._key = paramiko.RSAKey.generate(2048)
+        self._socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self._socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self._socket.bind(('127.0.0.1', 0))
+        self._socket.listen(128)
+        self.port = self._socket.getsockname()[1]
+        self.delay = delay
+        self.connections = 0
+        self.commands = 0
+        self._ticks = 0
+        self._lock = threading.Lock()
+        self._transports: List = []
+        self._stopped = threading.Event()
+
+    def __enter__(self) -> 'SshServer':
+        threading.Thread(target=self._accept, name='bench-sshd', daemon=True).start()
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self._stopped.set()
+        self._socket.close()
+        for transport in self._transports:
+            transport.close()
+
+    def _accept(self) -> None:
+        while not self._stopped.is_set():
+            try:
+                conn, _ = self._socket.accept()
+            except OSError:
+                return
+            # small replies must not wait for delayed acks
+            conn.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            transport = self._paramiko.Transport(conn)
+            transport.add_server_key(self._key)
+            handler = self._handler(self)
+            transport._send_user_message = _acknowledging(transport._send_user_message, handler.acks)
+            transport.start_server(server=handler)
+            self._transports.append(transport)
+            with self._lock:
+                self.connections += 1
+            threading.Thread(target=self._drain, args=(transport,), daemon=True).start()
+
+    def _drain(self, transport) -> None:
+        # channels are served by callbacks. a dropped channel is closed by the garbage collector,
+        # so accepted ones are kept until they are closed
+        channels = []
+        while transport.is_active() and not self._stopped.is_set():
+            channel = transport.accept(1)
+            channels = [c for c in channels if not c.closed]
+            if channel is not None:
+                channels.append(channel)
+
+    def exec_command(self, channel, command: str) -> None:
+        with self._lock:
+            self.commands += 1
+            self._ticks += 100
+            ticks = self._ticks
+        if self.delay:
+            time.sleep(self.delay)
+        if '/proc/stat' in command:
+            channel.sendall(PROC_STAT_LINE.format(user=ticks, system=ticks // 2, idle=ticks * 4)
+                            + PROC_STAT_LINE.format(user=ticks + 30, system=ticks // 2 + 10, idle=ticks * 4 + 60))
+        channel.send_exit_status(0)
+        channel.close()
+
+
+def _ssh_handler_class():
+    import paramiko
+
+    class Handler(paramiko.ServerInterface):
+        def __init__(self, server: SshServer):
+            self.server = server
+            # remote channel id: the exec request is confirmed
+            self.acks: Dict[int, threading.Event] = {}
+
+        def get_allowed_auths(self, username: str) -> str:
+            return 'password'
+
+        def check_auth_password(self, username: str, password: str) -> int:
+            return paramiko.AUTH_SUCCESSFUL
+
+        def check_channel_request(self, kind: str, chanid: int) -> int:
+            if kind == 'session':
+                return paramiko.OPEN_SUCCEEDED
+            return paramiko.OPEN_FAILED_ADMINISTRATIVELY_PROHIBITED
+
+        def check_channel_exec_request(self, channel, command: bytes) -> bool:
+            acked = self.acks[channel.remote_chanid] = threading.Event()
+            threading.Thread(target=self._exec, args=(channel, command.decode(), acked), daemon=True).start()
+            return True
+
+        def _exec(self, channel, command: str, acked: threading.Event) -> None:
+            # paramiko confirms the request after this callback, an earlier reply closes the channel for a client
+            acked.wait(5)
+            self.acks.pop(channel.remote_chanid, None)
+            self.server.exec_command(channel, command)
+
+    return Handler
+
+
+def _acknowledging(send: Callable, acks: Dict[int, threading.Event]) -> Callable:
+    """wrapper of sending by the server transport, setting events of confirmed channel requests."""
+    import paramiko.common
+
+    def send_user_message(message):
+        send(message)
+        data = message.asbytes()
+        if data[:1] == paramiko.common.cMSG_CHANNEL_SUCCESS:
+            acked = acks.get(int.from_bytes(data[1:5], 'big'))
+            if acked:
+                acked.set()
+
+    return send_user_message
+
+
+def _serve_ssh(delay: float, conn) -> None:
+    with SshServer(delay) as server:
+        conn.send(server.port)
+        # until the parent is gone
+        conn.recv()
+
+
+@contextmanager
+def ssh_server_process(delay: float = 0) -> Iterator[int]:
+    """`SshServer` in a child process, so its crypto doesn't share the gil with the benchmark.
+
+    :return: port of the server.
+    """
+    import multiprocessing
+
+    parent_conn, child_conn = multiprocessing.Pipe()
+    process = multiprocessing.Process(target=_serve_ssh, args=(delay, child_conn), daemon=True)
+    process.start()
+    try:
+        yield parent_conn.recv()
+    finally:
+        process.terminate()
+        process.join()
+
+
+class Tarpit:
+    """tcp port on the localhost, which never answers - like a hanging host.
+
+    connections are not accepted: the kernel completes them, while the backlog has place, and drops them after.
+    """
+
+    def __init__(self):
+        self._socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self._socket.bind(('127.0.0.1', 0))
+        self._socket.listen(1024)
+        self.port = self._socket.getsockname()[1]
+
+    def __enter__(self) -> 'Tarpit':
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self._socket.close()
+
+
+class UdpSink:
+    """udp socket on a random localhost port, counting received magic packets."""
+
+    def __init__(self):
+        self._socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self._socket.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 4 * 2**20)
+        self._socket.bind(('127.0.0.1', 0))
+        self._socket.settimeout(0.2)
+        self.port = self._socket.getsockname()[1]
+        self.packets = 0
+        self.invalid = 0
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._receive, name='bench-udp-sink', daemon=True)
+
+    def __enter__(self) -> 'UdpSink':
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self._stopped.set()
+        self._thread.join()
+        self._socket.close()
+
+    def settle(self, expected: int, timeout: float = 1) -> int:
+        """wait, until the expected count of packets is received or the timeout is over."""
+        deadline = time.monotonic() + timeout
+        while self.packets < expected and time.monotonic() < deadline:
+            time.sleep(0.01)
+        return self.packets
+
+    def _receive(self) -> None:
+        while not self._stopped.is_set():
+            try:
+                data = self._socket.recv(256)
+            except socket.timeout:
+                continue
+            # 6 bytes of 0xff and 16 repeats of the mac, optionally with a password
+            if data[:6] == b'\xff' * 6 and len(data) in (102, 106, 108):
+                self.packets += 1
+            else:
+                self.invalid += 1
+
+
+@contextmanager
+def fake_ping(exit_code: int = 0) -> Iterator[str]:
+    """`ping` binary, found first in the `PATH`, which exits immediately with the code.
+
+    :return: path of the binary.
+    """
+    with tempfile.TemporaryDirectory(prefix='wol-bench-') as directory:
+        path = os.path.join(directory, 'ping')
+        with open(path, 'w') as f:
+            f.write(f'#!/bin/sh\nexit {exit_code}\n')
+        os.chmod(path, os.stat(path).st_mode | stat.S_IXUSR)
+        old_path = os.environ.get('PATH', '')
+        os.environ['PATH'] = directory + os.pathsep + old_path
+        try:
+            yield path
+        finally:
+            os.environ['PATH'] = old_path
+
+
+@contextmanager
+def fake_arp(answer_ratio: float = 0.25, delay: float = 0.01) -> Iterator[SimpleNamespace]:
+    """arp responder instead of scapy, so scans don't need root and a real net.
+
+    each chunk is answered after `delay` seconds (scapy waits for its timeout) by a part of addresses.
+
+    :return: stats - `requests` is count of requested addresses.
+    """
+    from wol.logic import core
+
+    stats = SimpleNamespace(requests=0)
+    lock = threading.Lock()
+
+    def arping(addresses: List[str], timeout: float = 2, verbose: int = 0, iface: Optional[str] = None):
+        time.sleep(delay)
+        with lock:
+            stats.requests += len(addresses)
+        step = max(int(1 / answer_ratio), 1)
+        answers = [(None, SimpleNamespace(psrc=address, hwsrc=f'02:00:00:00:{i // 256 % 256:02x}:{i % 256:02x}',
+                                          sniffed_on=iface or 'bench0'))
+                   for i, address in enumerate(addresses) if i % step == 0]
+        return SimpleNamespace(res=answers), None
+
+    load_scapy, can_use_scapy = core._load_scapy, core._can_use_scapy
+    core._load_scapy = lambda: SimpleNamespace(arping=arping)
+    core._can_use_scapy = lambda: True
+    try:
+        yield stats
+    finally:
+        core._load_scapy, core._can_use_scapy = load_scapy, can_use_scapy
+
+
+@contextmanager
+def seeded_app(targets: int = 10000) -> Iterator:
+    """flask app with a temporary sqlite database of targets, a tenth of them with credentials.
+
+    background threads of the app are not started. the url of the database is set to `WOL_DATABASE_URL`
+    of the environment, so started servers use it too.
+    """
+    with tempfile.TemporaryDirectory(prefix='wol-bench-') as directory:
+        os.environ['WOL_DATABASE_URL'] = f'sqlite:///{os.path.join(directory, "wol.db")}'
+        from wol import models
+        from wol.wsgi import create_app
+
+        app = create_app(background=False)
+        with models.db.database.connection_context():
+            models.init_db()
+            with models.db.database.atomic():
+                credentials = [models.Credentials.create(username=f'user{i}', password='x') for i in range(10)]
+                rows = [{'name': f'pc{i}', 'host': f'10.{i // 65536}.{i // 256 % 256}.{i % 256}',
+                         'mac': f'02:00:00:{i // 65536:02x}:{i // 256 % 256:02x}:{i % 256:02x}', 'wol_port': 9,
+                         'credentials': credentials[i // 10 % 10].id if i % 10 == 0 else None}
+                        for i in range(targets)]
+                for i in range(0, len(rows), 500):
+                    models.Target.insert_many(rows[i:i + 500]).execute()
+        yield app
+        models.db.database.close()
@@ -0,0 +1,222 @@
+#!/usr/bin/env python3
+"""
+benchmarks of the real code paths against local stand-ins: magic packets to a udp sink,
+checks by a fake ping binary, cpu stats through an in-process sshd, scans by a fake arp responder,
+crud endpoints of a sqlite database with 10k targets and validation of request bodies.
+
+throughput and latency of each case are compared with the stored baselines.
+
+usage: `python benchmarks/suite.py [--seconds 1] [--only crud] [--check] [--save]`.
+with `--check` it exits with 1, if throughput of any case is lower than the baseline by more than `--tolerance`.
+baselines depend on the machine, so save them on the machine of comparisons.
+"""
+
+import argparse
+import json
+import os
+import statistics
+import sys
+import time
+from typing import (
+    Callable,
+    Dict,
+    List,
+    Optional,
+    Tuple,
+)
+
+from standins import (
+    SshServer,
+    UdpSink,
+    fake_arp,
+    fake_ping,
+    seeded_app,
+)
+
+from wol.logic.core import (
+    SshCredentials,
+    WakeupTarget,
+    check_host_ping,
+    get_cpu_stat,
+    scan_local_net,
+    ssh_pool,
+    wakeup_host,
+    wakeup_hosts,
+)
+
+BASELINES = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'baselines.json')
+
+Case = Callable[[], None]
+
+
+def measure(func: Case, seconds: float, min_calls: int = 5) -> dict:
+    """calls per second and percentiles of latency in ms. the first call is a warmup."""
+    func()
+    latencies = []
+    started = time.perf_counter()
+    deadline = started + seconds
+    while time.perf_counter() < deadline or len(latencies) < min_calls:
+        call_started = time.perf_counter()
+        func()
+        latencies.append(time.perf_counter() - call_started)
+    elapsed = time.perf_counter() - started
+    latencies.sort()
+    return {
+        'ops': round(len(latencies) / elapsed, 1),
+        'p50_ms': round(statistics.median(latencies) * 1000, 3),
+        'p95_ms': round(latencies[min(int(len(latencies) * 0.95), len(latencies) - 1)] * 1000, 3),
+    }
+
+
+def run_wakeup(seconds: float) -> Dict[str, dict]:
+    with UdpSink() as sink:
+        sent = 0
+
+        def wake():
+            nonlocal sent
+            wakeup_host('02:00:00:00:00:01', '127.0.0.1', sink.port)
+            sent += 1
+
+        batch = [WakeupTarget(f'02:00:00:00:{i // 256:02x}:{i % 256:02x}', '127.0.0.1', sink.port)
+                 for i in range(256)]
+
+        def wake_batch():
+            nonlocal sent
+            wakeup_hosts(batch)
+            sent += len(batch)
+
+        results = {'wakeup_host': measure(wake, seconds), 'wakeup_hosts 256': measure(wake_batch, seconds)}
+        received = sink.settle(sent)
+    if received != sent or sink.invalid:
+        print(f'warning: {sent} magic packets sent, {received} received, {sink.invalid} invalid', file=sys.stderr)
+    return results
+
+
+def run_ping(seconds: float) -> Dict[str, dict]:
+    with fake_ping():
+        return {'check_host_ping': measure(lambda: check_host_ping('127.0.0.1'), seconds)}
+
+
+def run_ssh(seconds: float) -> Dict[str, dict]:
+    with SshServer() as server:
+        creds = SshCredentials('127.0.0.1', 'bench', 'bench', server.port)
+
+        def new_connection():
+            ssh_pool.clear()
+            get_cpu_stat(creds)
+
+        results = {
+            'get_cpu_stat': measure(lambda: get_cpu_stat(creds), seconds),
+            'get_cpu_stat new connection': measure(new_connection, seconds),
+        }
+        ssh_pool.clear()
+    return results
+
+
+def run_scan(seconds: float) -> Dict[str, dict]:
+    with fake_arp():
+        return {'scan_local_net /22': measure(lambda: scan_local_net('10.0.0.0/22'), seconds)}
+
+
+def run_crud(seconds: float) -> Dict[str, dict]:
+    with seeded_app() as app, UdpSink() as sink:
+        client = app.test_client()
+        created = 0
+
+        def request(method: str, url: str, status: int, **kwargs) -> Case:
+            def call():
+                response = client.open(url, method=method, **kwargs)
+                body = response.get_data()
+                if response.status_code != status:
+                    raise RuntimeError(f'{method} {url}: {response.status_code} {body[:200]}')
+            return call
+
+        def create():
+            nonlocal created
+            created += 1
+            request('POST', '/api/targets/', 201, json={'name': f'bench{created}', 'host': '10.200.0.1'})()
+
+        wake_body = {'mac': '02:00:00:00:00:01', 'host': '127.0.0.1', 'port': sink.port}
+        return {
+            'GET /targets/?limit=100': measure(request('GET', '/api/targets/?limit=100&after=5000', 200), seconds),
+            'GET /targets/ all 10k': measure(request('GET', '/api/targets/', 200), seconds),
+            'GET /targets/?name=': measure(request('GET', '/api/targets/?name=pc7777', 200), seconds),
+            'GET /targets/<id>/': measure(request('GET', '/api/targets/4321/', 200), seconds),
+            'POST /targets/': measure(create, seconds),
+            'PATCH /targets/<id>/': measure(request('PATCH', '/api/targets/4321/', 204, json={'wol_port': 7}),
+                                            seconds),
+            'POST /wake/ valid': measure(request('POST', '/api/wake/', 204, json=wake_body), seconds),
+            'POST /wake/ invalid': measure(request('POST', '/api/wake/', 400, json={**wake_body, 'mac': 'x'}),
+                                           seconds),
+        }
+
+
+GROUPS: Dict[str, Callable[[float], Dict[str, dict]]] = {
+    'wakeup': run_wakeup,
+    'ping': run_ping,
+    'ssh': run_ssh,
+    'scan': run_scan,
+    'crud': run_crud,
+}
+
+
+def compare(results: Dict[str, dict], baselines: Dict[str, dict], tolerance: float) -> List[str]:
+    """print results with changes of throughput. :return: names of regressed cases."""
+    regressed = []
+    print(f'{"case":<30} {"ops/s":>10} {"p50 ms":>9} {"p95 ms":>9} {"baseline":>10} {"change":>8}')
+    for name, result in results.items():
+        baseline: Optional[dict] = baselines.get(name)
+        line = f'{name:<30} {result["ops"]:10.1f} {result["p50_ms"]:9.3f} {result["p95_ms"]:9.3f}'
+        if baseline:
+            change = result['ops'] / baseline['ops'] - 1
+            status = ''
+            if change < -tolerance:
+                regressed.append(name)
+                status = '  REGRESSED'
+            line += f' {baseline["ops"]:10.1f} {change:+8.0%}{status}'
+        print(line)
+    return regressed
+
+
+def load_baselines(path: str) -> Dict[str, dict]:
+    if not os.path.exists(path):
+        return {}
+    with open(path) as f:
+        return json.load(f)
+
+
+def save_baselines(path: str, baselines: Dict[str, dict], results: Dict[str, dict]) -> None:
+    with open(path, 'w') as f:
+        json.dump({**baselines, **results}, f, indent=2, sort_keys=True)
+        f.write('\n')
+
+
+def parse_args() -> Tuple[argparse.Namespace, List[str]]:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--seconds', type=float, default=1, help="duration of each case")
+    parser.add_argument('--only', action='append', choices=GROUPS, help="groups of cases to run. default - all")
+    parser.add_argument('--baselines', default=BASELINES, help="json file of baselines")
+    parser.add_argument('--tolerance', type=float, default=0.3, help="allowed share of throughput loss")
+    parser.add_argument('--check', action='store_true', help="fail, if any case is slower than its baseline")
+    parser.add_argument('--save', action='store_true', help="save results as baselines")
+    args = parser.parse_args()
+    return args, args.only or list(GROUPS)
+
+
+def main() -> None:
+    args, groups = parse_args()
+    results = {}
+    for group in groups:
+        results.update(GROUPS[group](args.seconds))
+
+    baselines = load_baselines(args.baselines)
+    regressed = compare(results, baselines, args.tolerance)
+    if args.save:
+        save_baselines(args.baselines, baselines, results)
+    if args.check and regressed:
+        print(f'regressed: {", ".join(regressed)}')
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,46 @@
+import heapq
+import time
+
+import pytest
+
+from wol.logic.cron import parse_cron
+from wol.logic.scheduler import WakeupScheduler, _Firing
+
+
+class _Scheduler(WakeupScheduler):
+    """fires without the database."""
+
+    def __init__(self):
+        super().__init__()
+        self.dispatched = []
+
+    def _dispatch(self, ids, fired_at):
+        self.dispatched += ids
+
+
+def _fire(jitter: int, misfire_grace: int, due_ago: float, fire_ago: float) -> _Scheduler:
+    scheduler = _Scheduler()
+    now = time.time()
+    firing = _Firing(1, parse_cron('* * * * *'), jitter, misfire_grace, now - due_ago, now - fire_ago)
+    scheduler._firings[1] = firing
+    heapq.heappush(scheduler._heap, (firing.fire_at, 1))
+    scheduler.fire_due()
+    return scheduler
+
+
+@pytest.mark.parametrize('jitter, misfire_grace, due_ago, fire_ago', [
+    # the jitter is greater than the grace
+    (600, 300, 500, 0.5),
+    # no grace, the loop wakes up a bit late
+    (0, 0, 0.2, 0.2),
+])
+def test_late_by_jitter_or_loop_is_fired(jitter, misfire_grace, due_ago, fire_ago):
+    scheduler = _fire(jitter, misfire_grace, due_ago, fire_ago)
+    assert scheduler.dispatched == [1]
+    assert scheduler.misfired == 0
+
+
+def test_missed_after_grace_is_skipped():
+    scheduler = _fire(600, 300, 900, 400)
+    assert scheduler.dispatched == []
+    assert scheduler.misfired == 1
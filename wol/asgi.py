@@ -0,0 +1,150 @@
+"""
+entrypoint of the asgi app - `uvicorn --factory wol.asgi:create_asgi_app`.
+
+core and crud api are served by async views: probes run in the event loop, ssh commands and queries -
+in bounded thread pools, so a slow host holds a thread, not a whole worker. other routes (jobs, pages,
+metrics) are served by the flask app through threads. the app is configured by the same variables,
+as the wsgi one.
+"""
+
+import asyncio
+import io
+import sys
+from contextlib import asynccontextmanager
+from typing import (
+    AsyncIterator,
+    Callable,
+    Iterable,
+    List,
+    Tuple,
+)
+
+from environs import Env
+from flask import Flask
+from starlette.applications import Starlette
+from starlette.routing import Mount
+
+from .views.async_core import core
+from .views.async_utils import (
+    POOL_DB,
+    POOL_IO,
+    POOL_SSH,
+    app_error_handlers,
+    thread_pools,
+)
+from .wsgi import create_app
+
+try:
+    from . import models
+except ImportError:
+    models = None
+else:
+    from playhouse.pool import MaxConnectionsExceeded
+
+    from .views.async_crud import crud
+
+__all__ = ['create_asgi_app', 'WsgiFallback']
+
+
+class WsgiFallback:
+    """asgi app, calling the wsgi app in the thread pool. responses are sent at once, so it's not for streams."""
+
+    def __init__(self, app: Callable, pool: str = POOL_IO):
+        self.app = app
+        self.pool = pool
+
+    async def __call__(self, scope: dict, receive: Callable, send: Callable) -> None:
+        if scope['type'] != 'http':
+            return
+        body = b''
+        more_body = True
+        while more_body:
+            message = await receive()
+            body += message.get('body', b'')
+            more_body = message.get('more_body', False)
+
+        # the flask app opens database connections by itself
+        loop = asyncio.get_running_loop()
+        status, headers, content = await loop.run_in_executor(thread_pools.executor(self.pool), self._call,
+                                                              self._environ(scope, body))
+        await send({'type': 'http.response.start', 'status': status, 'headers': headers})
+        await send({'type': 'http.response.body', 'body': content})
+
+    def _call(self, environ: dict) -> Tuple[int, List[Tuple[bytes, bytes]], bytes]:
+        started = {}
+
+        def start_response(status: str, headers: List[Tuple[str, str]], exc_info=None):
+            started.update(status=int(status.split(' ', 1)[0]),
+                           headers=[(name.lower().encode('latin-1'), value.encode('latin-1'))
+                                    for name, value in headers])
+
+        chunks: Iterable[bytes] = self.app(environ, start_response)
+        try:
+            content = b''.join(chunks)
+        finally:
+            if hasattr(chunks, 'close'):
+                chunks.close()
+        return started['status'], started['headers'], content
+
+    @staticmethod
+    def _environ(scope: dict, body: bytes) -> dict:
+        server = scope.get('server') or ('localhost', 80)
+        client = scope.get('client') or ('', 0)
+        environ = {
+            'REQUEST_METHOD': scope['method'],
+            'SCRIPT_NAME': scope.get('root_path', ''),
+            'PATH_INFO': scope['path'],
+            'QUERY_STRING': scope['query_string'].decode('latin-1'),
+            'SERVER_NAME': server[0],
+            'SERVER_PORT': str(server[1]),
+            'SERVER_PROTOCOL': f'HTTP/{scope["http_version"]}',
+            'REMOTE_ADDR': client[0],
+            'CONTENT_LENGTH': str(len(body)),
+            'wsgi.version': (1, 0),
+            'wsgi.url_scheme': scope.get('scheme', 'http'),
+            'wsgi.input': io.BytesIO(body),
+            'wsgi.errors': sys.stderr,
+            'wsgi.multithread': True,
+            'wsgi.multiprocess': True,
+            'wsgi.run_once': False,
+        }
+        for name, value in scope['headers']:
+            key = name.decode('latin-1').upper().replace('-', '_')
+            if key not in ('CONTENT_TYPE', 'CONTENT_LENGTH'):
+                key = f'HTTP_{key}'
+            value = value.decode('latin-1')
+            environ[key] = f'{environ[key]},{value}' if key in environ and key.startswith('HTTP_') else value
+        return environ
+
+
+def create_asgi_app(no_db: bool = False, background: bool = True) -> Starlette:
+    """the asgi app. see `create_app` for parameters."""
+    app: Flask = create_app(no_db=no_db, background=background)
+
+    env = Env()
+    with env.prefixed('WOL_'):
+        thread_pools.sizes.update({
+            POOL_DB: env.int('ASGI_DB_THREADS', env.int('DB_MAX_CONNECTIONS', 20)),
+            POOL_SSH: env.int('ASGI_SSH_THREADS', 64),
+            POOL_IO: env.int('ASGI_IO_THREADS', 32),
+        })
+    thread_pools.app = app
+
+    routes = core.routes('/api')
+    if models and 'DATABASE' in app.config:
+        thread_pools.database = models.db.database
+        routes += crud.routes('/api')
+        app_error_handlers[MaxConnectionsExceeded] = _handle_pool_exhausted
+    routes.append(Mount('/', app=WsgiFallback(app.wsgi_app)))
+
+    return Starlette(routes=routes, lifespan=_lifespan)
+
+
+def _handle_pool_exhausted(_error: Exception):
+    return {'error': 'too many database connections'}, 503, {'Retry-After': '1'}
+
+
+@asynccontextmanager
+async def _lifespan(_app: Starlette) -> AsyncIterator[None]:
+    yield
+    await asyncio.get_running_loop().run_in_executor(None, thread_pools.shutdown)
@@ -4,21 +4,23 @@ entrypoint for launching command line interface.
 """
 
 import json
+import os
+import tempfile
 from collections import OrderedDict
 from contextlib import contextmanager
 from inspect import Parameter, signature
-from typing import Callable, Optional
+from typing import Callable, List, Optional
 
 import typer
 from marshmallow import ValidationError
-from pygments import highlight
-from pygments.formatters import TerminalFormatter
-from pygments.lexers import JsonLexer
 
 from .fields import validate_host as _validate_host
 from .fields import validate_mac as _validate_mac
 from .logic import core
-from .logic.core import SshCredentials
+from .logic.boot import WAIT_METHODS, BootTarget
+from .logic.core import SshCredentials, WakeupTarget
+from .logic.probe import METHODS
+from .profiling import MODES, Profile
 
 app = typer.Typer(help="Wake On Lan and some useful stuff")
 global_opts = {
@@ -47,6 +49,28 @@ def validate_mac(ctx: typer.Context, mac: str) -> Optional[str]:
     return validate(ctx, _validate_mac, mac)
 
 
+def validate_hosts(ctx: typer.Context, hosts: List[str]) -> Optional[List[str]]:
+    for host in hosts or []:
+        validate(ctx, _validate_host, host)
+    return hosts
+
+
+def validate_macs(ctx: typer.Context, macs: List[str]) -> Optional[List[str]]:
+    for mac in macs or []:
+        validate(ctx, _validate_mac, mac)
+    return macs
+
+
+def highlight_json(data: any) -> str:
+    """colored json for terminal"""
+    # commands are imported at every launch, so heavy deps are imported by the first use
+    from pygments import highlight
+    from pygments.formatters import TerminalFormatter
+    from pygments.lexers import JsonLexer
+
+    return highlight(json.dumps(data, indent=4), JsonLexer(), TerminalFormatter())
+
+
 @contextmanager
 def catch_remote_error(verbose: bool) -> None:
     """unified display ssh errors"""
@@ -60,14 +84,16 @@ def catch_remote_error(verbose: bool) -> None:
         err = typer.style("can't exec command host: ", fg=typer.colors.RED)
         err += e.reason
         if verbose and e.details:
-            fmt = highlight(json.dumps(e.details, indent=4), JsonLexer(), TerminalFormatter())
-            err += '\n' + fmt
+            err += '\n' + highlight_json(e.details)
         typer.echo(err, err=True)
         raise typer.Exit(code=1)
 
 
 def replace_ssh_args(func) -> Callable:
-    """add ssh parameters to command and pass it to the target function as dataclass"""
+    """add ssh parameters to command and pass it to the target function as dataclass.
+
+    if the target function takes `List[SshCredentials]`, the command takes many hosts.
+    """
     def decorated(
             # TODO: path to ssh config and disabling it
             host: str = typer.Argument(..., callback=validate_host,
@@ -84,76 +110,234 @@ def replace_ssh_args(func) -> Callable:
         kwargs[param_name] = SshCredentials(host=host, port=port, login=login, password=password)
         return func(**kwargs)
 
-    param_name = [k for k, v in func.__annotations__.items() if v is SshCredentials][0]
+    def decorated_many(
+            hosts: List[str] = typer.Argument(..., callback=validate_hosts,
+                                              help="remote hosts. it can be ip, hostname"
+                                                   " and alias from ssh config"),
+            login: Optional[str] = typer.Option(None, help="ssh username. default - current user"
+                                                           " or from ssh config"),
+            password: Optional[str] = typer.Option(None, help="ssh password. default - "
+                                                              "none or from ssh config"),
+            port: Optional[int] = typer.Option(None, '--port', '-p', min=1, max=2**16 - 1,
+                                               help="ssh port. default - 22 or from ssh config"),
+            **kwargs,
+    ):
+        kwargs[param_name] = [SshCredentials(host=host, port=port, login=login, password=password)
+                              for host in hosts]
+        return func(**kwargs)
+
+    param_name, param_type = [(k, v) for k, v in func.__annotations__.items()
+                              if v in (SshCredentials, List[SshCredentials])][0]
+    wrapper = decorated if param_type is SshCredentials else decorated_many
     fsig = signature(func)
     fparams = OrderedDict(**fsig.parameters)
     fparams.pop(param_name)
-    dparams = signature(decorated).parameters
+    dparams = signature(wrapper).parameters
     dparams = OrderedDict(**{k: v for k, v in dparams.items() if v.kind != Parameter.VAR_KEYWORD})
     fsig._parameters = OrderedDict(**dparams, **fparams)
-    decorated.__signature__ = fsig
-    decorated.__annotations__.update(**{k: v for k, v in func.__annotations__.items()
-                                        if k != param_name})
+    wrapper.__signature__ = fsig
+    wrapper.__annotations__.update(**{k: v for k, v in func.__annotations__.items()
+                                      if k != param_name})
     # functools.wraps loses the annotations
-    decorated.__name__ = func.__name__
-    decorated.__doc__ = func.__doc__
-    return decorated
+    wrapper.__name__ = func.__name__
+    wrapper.__doc__ = func.__doc__
+    return wrapper
+
+
+def run_fleet_action(fleet_action: Callable, creds_list: List[SshCredentials], done_message: str, **kwargs) -> None:
+    """run the fleet action and display result of each host"""
+    verbose = global_opts['verbose']
+    try:
+        results = fleet_action(creds_list, **kwargs)
+    except NotImplementedError:
+        err = typer.style("can't use remote execution", fg=typer.colors.RED)
+        typer.echo(err + "\nfabric is installed?", err=True)
+        raise typer.Exit(code=1)
+
+    for result in results:
+        prefix = f'{result["host"]} \t| '
+        if not result['done']:
+            error = result['error']
+            message = error['reason']
+            if verbose and error.get('details'):
+                message += ' ' + json.dumps(error['details'])
+            typer.secho(prefix + message, fg=typer.colors.RED, err=True)
+        elif result.get('reached_state') is False:
+            typer.secho(prefix + done_message + ", but the host hasn't reached the state", fg=typer.colors.YELLOW)
+        else:
+            typer.secho(prefix + done_message, fg=typer.colors.GREEN)
+    if not all(result['done'] and result.get('reached_state') is not False for result in results):
+        raise typer.Exit(code=1)
 
 
 @app.callback()
 def global_callback(
+        ctx: typer.Context,
         verbose: bool = typer.Option(False, '--verbose', '-v', help="more detailed output"),
+        profile: bool = typer.Option(False, '--profile', help="profile the command, files are printed to stderr"),
+        profile_mode: str = typer.Option('sample', help=f"one of: {', '.join(MODES)}"),
+        profile_dir: str = typer.Option(os.path.join(tempfile.gettempdir(), 'wol-profiles'),
+                                        help="directory for profiles"),
+        ssh_backend: str = typer.Option('fabric', envvar='WOL_SSH_BACKEND',
+                                        help=f"ssh library, one of: {', '.join(core.SSH_BACKENDS)}"),
 ) -> None:
     global_opts['verbose'] = verbose
+    if ssh_backend not in core.SSH_BACKENDS:
+        raise typer.BadParameter(f"one of: {', '.join(core.SSH_BACKENDS)}", param_hint='--ssh-backend')
+    core.ssh_options.backend = ssh_backend
+    if not profile or ctx.resilient_parsing:
+        return
+    if profile_mode not in MODES:
+        raise typer.BadParameter(f"one of: {', '.join(MODES)}", param_hint='--profile-mode')
+
+    command_profile = Profile(ctx.invoked_subcommand or 'root', profile_mode)
+    command_profile.start()
+
+    def save_profile():
+        command_profile.stop()
+        for path in command_profile.save(profile_dir):
+            typer.echo(f'profile: {path}', err=True)
+
+    ctx.call_on_close(save_profile)
 
 
 @app.command()
 def check(
-        host: str = typer.Argument(..., callback=validate_host, help="remote host. ip or hostname"),
+        hosts: List[str] = typer.Argument(..., callback=validate_hosts, help="remote hosts. ip or hostname"),
+        port: int = typer.Option(80, '--port', '-p', min=1, max=2**16 - 1, help="port for tcp, scapy and ssh methods"),
+        method: str = typer.Option('auto', help=f"one of: {', '.join(METHODS)}. auto - SYN/ACK to the port"
+                                                " if root, otherwise ping"),
+        timeout: float = typer.Option(2, min=0, help="seconds to wait for each host"),
+        concurrency: int = typer.Option(100, min=1, help="max count of hosts checked at the same time"),
 ) -> None:
-    """check if host is online (SYN/ACK to 80 port or ping)"""
-    result = core.check_host(host)
-    if result:
-        typer.secho("reached", fg=typer.colors.GREEN)
-    else:
-        typer.secho("not reached", fg=typer.colors.RED)
+    """check if hosts are online (SYN/ACK to 80 port or ping)"""
+    if method not in METHODS:
+        raise typer.BadParameter(f"one of: {', '.join(METHODS)}", param_hint='--method')
+    try:
+        from .logic.probe import check_hosts
+        results = check_hosts(hosts, port=port, method=method, timeout=timeout, concurrency=concurrency)
+    except NotImplementedError:
+        err = typer.style(f"can't use {method} method", fg=typer.colors.RED)
+        typer.echo(err + "\nit is installed and user is root?", err=True)
+        raise typer.Exit(code=1)
+
+    for host, reached in results.items():
+        prefix = f'{host} \t| ' if len(results) > 1 else ''
+        if reached:
+            typer.secho(prefix + "reached", fg=typer.colors.GREEN)
+        else:
+            typer.secho(prefix + "not reached", fg=typer.colors.RED)
+    if not all(results.values()):
         raise typer.Exit(code=1)
 
 
 @app.command()
 def wake(
-        mac: str = typer.Argument(..., callback=validate_mac, help="MAC address of a remote host"),
+        macs: List[str] = typer.Argument(..., callback=validate_macs, help="MAC addresses of remote hosts"),
         host: str = typer.Option('255.255.255.255', '--host', '-h',
                                  callback=validate_host, help="ip addr for packet destination"),
         port: int = typer.Option(9, '--port', '-p', min=1, max=2**16 - 1, help="WOL port"),
+        iface: Optional[str] = typer.Option(None, '--iface', '-i', help="send packets through the interface"),
+        password: Optional[str] = typer.Option(None, help="SecureOn password, 4 or 6 bytes in hex"),
+        repeat: int = typer.Option(1, min=1, max=100, help="how many times to send every packet"),
+        interval: float = typer.Option(0, min=0, help="seconds between repeats"),
+        rate: Optional[float] = typer.Option(None, min=0, help="max packets per second. default - unlimited"),
+        wait: bool = typer.Option(False, help="wait until hosts are reachable. requires --address"),
+        address: Optional[List[str]] = typer.Option(None, '--address', '-a', callback=validate_hosts,
+                                                    help="ip or hostname of each host for checks, in the order"
+                                                         " of MAC addresses"),
+        wait_method: str = typer.Option('tcp', help=f"one of: {', '.join(WAIT_METHODS)}. tcp - the port is open"
+                                                    " or closed, ssh - sshd is ready"),
+        wait_port: int = typer.Option(22, min=1, max=2**16 - 1, help="port for tcp and ssh methods"),
+        wait_timeout: float = typer.Option(120, min=0, help="seconds to wait for hosts"),
+        retransmit: float = typer.Option(30, min=1, help="seconds between packets to a not reachable host"),
 ) -> None:
-    """wake up the host"""
-    core.wakeup_host(mac, host, port)
-    typer.echo("✨ Magic ✨ packet sent")
+    """wake up hosts"""
+    targets = [WakeupTarget(mac, host, port, iface, password) for mac in macs]
+    if wait:
+        if len(address or ()) != len(macs):
+            raise typer.BadParameter("one address for each MAC address is required", param_hint='--address')
+        if wait_method not in WAIT_METHODS:
+            raise typer.BadParameter(f"one of: {', '.join(WAIT_METHODS)}", param_hint='--wait-method')
+        wait_booting([BootTarget(target, host) for target, host in zip(targets, address)], method=wait_method,
+                     port=wait_port, timeout=wait_timeout, retransmit=retransmit, repeat=repeat, rate=rate)
+        return
+
+    results = core.wakeup_hosts(targets, repeat=repeat, rate=rate, interval=interval)
+    failed = [result for result in results if not result['sent']]
+    for result in failed:
+        typer.secho(f'{result["mac"]} \t| {result["error"]}', fg=typer.colors.RED, err=True)
+    if len(failed) == len(results):
+        raise typer.Exit(code=1)
+    typer.echo(f"✨ Magic ✨ packets sent: {len(results) - len(failed)}")
+
+
+def wait_booting(targets: List[BootTarget], **kwargs) -> None:
+    """wake up hosts and display each one, when it's reachable"""
+    from .logic.boot import iter_wake_and_wait
+    try:
+        for event in iter_wake_and_wait(targets, **kwargs):
+            if event['event'] == 'up':
+                typer.secho(f'{event["mac"]} \t| {event["host"]} is up in {event["boot_time"]:.1f}s',
+                            fg=typer.colors.GREEN)
+            elif event['event'] == 'retransmit' and global_opts['verbose']:
+                typer.echo(f"packets sent again: {', '.join(event['macs'])}")
+    except NotImplementedError:
+        err = typer.style(f"can't use {kwargs['method']} method", fg=typer.colors.RED)
+        typer.echo(err + "\nuser is root?", err=True)
+        raise typer.Exit(code=1)
+
+    failed = [result for result in event['results'] if not result['up']]
+    for result in failed:
+        typer.secho(f'{result["mac"]} \t| {result["host"]} \t| {result["error"]}', fg=typer.colors.RED, err=True)
+    if failed:
+        raise typer.Exit(code=1)
 
 
 @app.command()
 @replace_ssh_args
 def reboot(
-        creds: SshCredentials,
+        creds_list: List[SshCredentials],
+        parallel: int = typer.Option(10, min=1, help="max count of hosts processed at the same time"),
+        wave_percent: float = typer.Option(100, min=1, max=100, help="size of a wave in percent of all hosts"),
+        max_failures: Optional[int] = typer.Option(None, min=0, help="skip the remaining waves, when count"
+                                                                     " of failed hosts is exceeded"),
+        wait: bool = typer.Option(False, help="wait until hosts of a wave are back up before the next wave"),
+        wait_timeout: float = typer.Option(300, min=0, help="seconds to wait for hosts of a wave"),
 ) -> None:
-    """reboot a remote host (ssh)"""
-    with catch_remote_error(global_opts['verbose']):
-        core.reboot_host(creds)
+    """reboot remote hosts (ssh)"""
+    if len(creds_list) == 1 and not wait:
+        with catch_remote_error(global_opts['verbose']):
+            core.reboot_host(creds_list[0])
+        typer.secho("reboot started", fg=typer.colors.GREEN)
+        return
 
-    typer.secho("reboot started", fg=typer.colors.GREEN)
+    from .logic.fleet import reboot_fleet
+    run_fleet_action(reboot_fleet, creds_list, "reboot started", parallelism=parallel,
+                     wave_percent=wave_percent, max_failures=max_failures, wait=wait, wait_timeout=wait_timeout)
 
 
 @app.command()
 @replace_ssh_args
 def shutdown(
-        creds: SshCredentials,
+        creds_list: List[SshCredentials],
+        parallel: int = typer.Option(10, min=1, help="max count of hosts processed at the same time"),
+        wave_percent: float = typer.Option(100, min=1, max=100, help="size of a wave in percent of all hosts"),
+        max_failures: Optional[int] = typer.Option(None, min=0, help="skip the remaining waves, when count"
+                                                                     " of failed hosts is exceeded"),
+        wait: bool = typer.Option(False, help="wait until hosts of a wave are down before the next wave"),
+        wait_timeout: float = typer.Option(300, min=0, help="seconds to wait for hosts of a wave"),
 ) -> None:
-    """immediately shutdown a remote host (ssh)"""
-    with catch_remote_error(global_opts['verbose']):
-        core.shutdown_host(creds)
+    """immediately shutdown remote hosts (ssh)"""
+    if len(creds_list) == 1 and not wait:
+        with catch_remote_error(global_opts['verbose']):
+            core.shutdown_host(creds_list[0])
+        typer.secho("shutdown success", fg=typer.colors.GREEN)
+        return
 
-    typer.secho("shutdown success", fg=typer.colors.GREEN)
+    from .logic.fleet import shutdown_fleet
+    run_fleet_action(shutdown_fleet, creds_list, "shutdown success", parallelism=parallel,
+                     wave_percent=wave_percent, max_failures=max_failures, wait=wait, wait_timeout=wait_timeout)
 
 
 @app.command()
@@ -161,28 +345,46 @@ def shutdown(
 def stats(
         creds: SshCredentials,
         precision: Optional[int] = typer.Option(None, help="count of digits after point"),
+        watch: bool = typer.Option(False, '--watch', '-w', help="print cpu, memory and load every interval"),
+        interval: float = typer.Option(1, min=0.1, help="seconds between samples in watch mode"),
 ) -> None:
     """get CPU stats of a remote host (ssh)"""
+    if watch:
+        from .logic.sampler import HostSampler
+        sampler = HostSampler(creds, interval)
+        sampler.start()
+        with catch_remote_error(global_opts['verbose']):
+            for sample in sampler.stream():
+                typer.echo(highlight_json(sample.as_dict(precision)))
+        return
+
     with catch_remote_error(global_opts['verbose']):
         result = core.get_cpu_stat(creds, precision)
 
-    fmt = json.dumps(result._asdict(), indent=4)
-    fmt = highlight(fmt, JsonLexer(), TerminalFormatter())
-    typer.echo(fmt)
+    typer.echo(highlight_json(result._asdict()))
 
 
 @app.command()
-def scan() -> None:
-    """scan local net by ARP protocol"""
+def scan(
+        iface: Optional[List[str]] = typer.Option(None, '--iface', '-i',
+                                                  help="name or prefix of a network interface."
+                                                       " default - all, except docker ones"),
+        net: Optional[str] = typer.Option(None, help="net with mask, e.g. 192.168.1.0/24. default - nets of"
+                                                     " interfaces"),
+) -> None:
+    """scan local nets by ARP protocol"""
     try:
-        results = core.scan_local_net()
+        results = core.scan_local_net(net, iface)
     except NotImplementedError:
         err = typer.style("can't use scapy", fg=typer.colors.RED)
         typer.echo(err + "\nit is installed and user is root?", err=True)
         raise typer.Exit(code=1)
+    except ValueError as e:
+        raise typer.BadParameter(str(e), param_hint='--net')
 
     if results:
-        typer.echo("results:\n" + '\n'.join(f'{pair["ip"]} \t| {pair["mac"]}' for pair in results))
+        lines = [f'{pair["ip"]} \t| {pair["mac"]} \t| {pair["iface"]}' for pair in results]
+        typer.echo("results:\n" + '\n'.join(lines))
     else:
         typer.echo("no results")
 
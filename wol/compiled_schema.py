@@ -0,0 +1,251 @@
+"""
+compiled load and dump of marshmallow schemas for hot endpoints.
+
+fields of a schema are turned into a plan once. valid data goes through the plan
+without the marshmallow machinery. anything unusual - invalid values, unknown keys,
+unsupported fields and hooks - falls back to the schema itself,
+so results and error messages are the same.
+"""
+
+import math
+from typing import (
+    Any,
+    Callable,
+    Iterable,
+    List,
+    Optional,
+    Tuple,
+)
+
+from marshmallow import (
+    EXCLUDE,
+    Schema,
+    ValidationError,
+    fields,
+    missing,
+)
+
+from .fields import MacField
+from .profiling import span
+
+__all__ = ['CompiledSchema', 'compile_schema']
+
+# methods, which must not be overridden by a field for compiling
+FIELD_METHODS = ('serialize', 'deserialize', '_serialize', '_deserialize', '_validate', '_validate_missing',
+                 'get_value')
+
+LoadStep = Tuple[str, str, Callable[[Any], Any], list, bool, Any, bool]
+DumpStep = Tuple[str, str, Callable[[Any], Any], Any]
+
+
+class _Fallback(Exception):
+    """the data must be processed by the schema itself."""
+
+
+def _load_str(value: Any) -> str:
+    if type(value) is not str:
+        raise _Fallback
+    return value
+
+
+def _load_mac(value: Any) -> str:
+    return _load_str(value).lower()
+
+
+def _load_int(value: Any) -> int:
+    if type(value) is not int:
+        raise _Fallback
+    return value
+
+
+def _load_float(value: Any) -> float:
+    if type(value) not in (int, float) or not math.isfinite(value):
+        raise _Fallback
+    return float(value)
+
+
+def _load_bool(value: Any) -> bool:
+    if value is not True and value is not False:
+        raise _Fallback
+    return value
+
+
+def _dump_str(value: Any) -> str:
+    if type(value) is not str:
+        raise _Fallback
+    return value
+
+
+def _dump_int(value: Any) -> int:
+    return int(value)
+
+
+def _dump_float(value: Any) -> float:
+    return float(value)
+
+
+def _dump_bool(value: Any) -> bool:
+    if value is not True and value is not False:
+        raise _Fallback
+    return value
+
+
+# field class: (load, dump) of not empty values
+CONVERTERS = {
+    MacField: (_load_mac, _dump_str),
+    fields.String: (_load_str, _dump_str),
+    fields.Integer: (_load_int, _dump_int),
+    fields.Float: (_load_float, _dump_float),
+    fields.Boolean: (_load_bool, _dump_bool),
+}
+
+
+class CompiledSchema:
+    """load and dump by the plan of the schema fields.
+
+    :param schema: schema for the plan and the fallback.
+    """
+
+    def __init__(self, schema: Schema):
+        self.schema = schema
+        self._load_plan: Optional[List[LoadStep]] = None
+        self._dump_plan: Optional[List[DumpStep]] = None
+        self._load_keys = frozenset()
+        self._exclude_unknown = schema.unknown == EXCLUDE
+        if _is_compilable(schema):
+            self._load_plan = _plan_load(schema)
+            self._dump_plan = _plan_dump(schema)
+            self._load_keys = frozenset(step[0] for step in self._load_plan or ())
+
+    def load(self, data: Any) -> dict:
+        """the same as `Schema.load`."""
+        if self._load_plan is not None and isinstance(data, dict):
+            try:
+                return self._load(data)
+            except _Fallback:
+                pass
+        return self.schema.load(data)
+
+    def dump(self, obj: Any) -> dict:
+        """the same as `Schema.dump`."""
+        if self._dump_plan is not None:
+            try:
+                return self._dump(obj)
+            except _Fallback:
+                pass
+        return self.schema.dump(obj)
+
+    def dump_many(self, objs: Iterable[Any]) -> List[dict]:
+        """the same as `Schema.dump` with `many=True`."""
+        with span('schema.dump'):
+            return [self.dump(obj) for obj in objs]
+
+    def _load(self, data: dict) -> dict:
+        if not self._exclude_unknown and not data.keys() <= self._load_keys:
+            raise _Fallback
+        result = {}
+        for key, attr, convert, validators, required, default, allow_none in self._load_plan:
+            value = data.get(key, missing)
+            if value is missing:
+                if required:
+                    raise _Fallback
+                if default is not missing:
+                    result[attr] = default() if callable(default) else default
+                continue
+            if value is None:
+                if not allow_none:
+                    raise _Fallback
+                result[attr] = None
+                continue
+            value = convert(value)
+            for validator in validators:
+                try:
+                    valid = validator(value)
+                except ValidationError:
+                    raise _Fallback
+                if valid is False:
+                    raise _Fallback
+            result[attr] = value
+        return result
+
+    def _dump(self, obj: Any) -> dict:
+        if isinstance(obj, dict):
+            get = obj.get
+        elif hasattr(obj, '__getitem__'):
+            raise _Fallback
+        else:
+            def get(attr, default):
+                return getattr(obj, attr, default)
+
+        result = {}
+        for key, attr, convert, default in self._dump_plan:
+            value = get(attr, missing)
+            if value is missing:
+                if default is missing:
+                    continue
+                value = default() if callable(default) else default
+            result[key] = None if value is None else convert(value)
+        return result
+
+
+def compile_schema(schema: Schema) -> CompiledSchema:
+    """plan of the schema. it's built once, so schemas should be compiled on import."""
+    return CompiledSchema(schema)
+
+
+def _is_compilable(schema: Schema) -> bool:
+    return not schema.many and not schema.partial and not any(schema._hooks.values())
+
+
+def _plan_load(schema: Schema) -> Optional[List[LoadStep]]:
+    plan = []
+    for name, field in schema.load_fields.items():
+        convert = _converter(field, load=True)
+        attr = field.attribute or name
+        if convert is None or '.' in attr:
+            return None
+        default = field.load_default if hasattr(field, 'load_default') else field.missing
+        plan.append((field.data_key or name, attr, convert, list(field.validators), field.required,
+                     default, field.allow_none))
+    return plan
+
+
+def _plan_dump(schema: Schema) -> Optional[List[DumpStep]]:
+    plan = []
+    for name, field in schema.dump_fields.items():
+        convert = _converter(field, load=False)
+        attr = field.attribute or name
+        if convert is None or '.' in attr:
+            return None
+        default = field.dump_default if hasattr(field, 'dump_default') else field.default
+        plan.append((field.data_key or name, attr, convert, default))
+    return plan
+
+
+def _converter(field: fields.Field, load: bool) -> Optional[Callable[[Any], Any]]:
+    """load or dump of a not empty value of the field. None, if the field can't be compiled."""
+    if isinstance(field, fields.Nested):
+        if not _has_base_methods(field, fields.Nested) or field.many or field.unknown \
+                or not isinstance(field.schema, Schema):
+            return None
+        nested = CompiledSchema(field.schema)
+        if load and nested._load_plan is not None:
+            def load_nested(value: Any) -> dict:
+                if not isinstance(value, dict):
+                    raise _Fallback
+                return nested._load(value)
+            return load_nested
+        if not load and nested._dump_plan is not None:
+            return nested._dump
+        return None
+
+    for base in type(field).__mro__:
+        if base in CONVERTERS:
+            if not _has_base_methods(field, base) or getattr(field, 'as_string', False):
+                return None
+            return CONVERTERS[base][0 if load else 1]
+    return None
+
+
+def _has_base_methods(field: fields.Field, base: type) -> bool:
+    return all(getattr(type(field), method) is getattr(base, method) for method in FIELD_METHODS)
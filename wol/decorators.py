@@ -1,20 +1,27 @@
 from functools import wraps
 from typing import Callable
 
-from flask import request
-from marshmallow import Schema
+from flask import request, url_for
+from marshmallow import Schema, fields
 
-__all__ = ['parse_body', 'parse_query']
+from .compiled_schema import compile_schema
+from .logic.jobs import JobError, JobQueueFull, job_queue
+from .profiling import span
+
+__all__ = ['parse_body', 'parse_query', 'as_job']
 
 DECORATOR_TYPE = Callable[[Callable], Callable]
 
 
 def parse_body(schema: Schema) -> DECORATOR_TYPE:
     """parse the request json body according to the specified scheme."""
+    compiled = compile_schema(schema)
+
     def decorator(func: Callable) -> Callable:
         @wraps(func)
         def wrapped(*args, **kwargs):
-            data = schema.load(request.get_json())
+            with span('schema.load'):
+                data = compiled.load(request.get_json())
             return func(*args, **kwargs, body=data)
         return wrapped
     return decorator
@@ -25,7 +32,37 @@ def parse_query(schema: Schema) -> DECORATOR_TYPE:
     def decorator(func: Callable) -> Callable:
         @wraps(func)
         def wrapped(*args, **kwargs):
-            data = schema.load(request.args)
+            with span('schema.load'):
+                data = schema.load(request.args)
             return func(*args, **kwargs, query=data)
         return wrapped
     return decorator
+
+
+def as_job(name: str) -> DECORATOR_TYPE:
+    """run the view in background, if the `async` query parameter is set.
+
+    the response is the queued job with 202 status, or 503, if the queue is full.
+    the view must not use the request - it's already gone, when the job is running.
+    """
+    def decorator(func: Callable) -> Callable:
+        @wraps(func)
+        def wrapped(*args, **kwargs):
+            if not fields.Bool().deserialize(request.args.get('async', False)):
+                return func(*args, **kwargs)
+            try:
+                job = job_queue.submit(name, _view_result, func, *args, **kwargs)
+            except JobQueueFull:
+                return {'error': 'too many jobs'}, 503, {'Retry-After': '5'}
+            return job.as_dict(), 202, {'Location': url_for('jobs.get_job', id_=job.id)}
+        return wrapped
+    return decorator
+
+
+def _view_result(func: Callable, *args, **kwargs) -> dict:
+    result = func(*args, **kwargs)
+    if isinstance(result, tuple):
+        result, status = result[:2]
+        if status >= 400:
+            raise JobError(result)
+    return result
@@ -2,18 +2,21 @@
 Custom fields with validation for marshallow
 """
 
+import os
+import threading
+import time
+from fnmatch import fnmatchcase
+from functools import lru_cache
+from importlib.util import find_spec
 from typing import (
     Callable,
+    FrozenSet,
     List,
     Optional,
+    Tuple,
     Type,
 )
 
-try:
-    from fabric.config import Config
-except ImportError:
-    Config = None
-
 from marshmallow import ValidationError, fields, validate
 from validators import (
     domain,
@@ -25,35 +28,135 @@ from validators import (
 from .doc_utils import exclude_parent_attrs
 
 __all__ = ['IpAddressField', 'HostField', 'PortField', 'MacField',
-           'validate_ip', 'validate_host', 'validate_mac']
+           'validate_ip', 'validate_host', 'validate_mac', 'SshConfigHosts', 'ssh_config_hosts']
+
+# the same paths are read by fabric
+SSH_CONFIG_PATHS = ('~/.ssh/config', '/etc/ssh/ssh_config')
+# validation results of this count of values are kept
+VALIDATION_CACHE_SIZE = 4096
+
+
+class SshConfigHosts:
+    """host aliases and patterns of ssh config files. the files are parsed again, when they are changed.
+
+    a host is known, if it matches a pattern of any `Host` line and no negated pattern of this line.
+    catch-all patterns (e.g. `*`) are ignored, otherwise any string would be a valid host.
+    `available` is false, if none of the files exists.
+
+    :param paths: ssh config files.
+    :param check_interval: seconds between checks of files modification time.
+    """
+
+    def __init__(self, paths: Tuple[str, ...] = SSH_CONFIG_PATHS, check_interval: float = 1):
+        self.paths = [os.path.expanduser(path) for path in paths]
+        self.check_interval = check_interval
+        self._mtimes: Optional[List[Optional[float]]] = None
+        self._checked_at = 0
+        self._names: FrozenSet[str] = frozenset()
+        self._patterns: List[Tuple[List[str], List[str]]] = []
+        self._lock = threading.Lock()
+
+    @property
+    def available(self) -> bool:
+        self._refresh()
+        return any(mtime is not None for mtime in self._mtimes)
+
+    def __contains__(self, host: str) -> bool:
+        self._refresh()
+        host = host.lower()
+        if host in self._names:
+            return True
+        return any(any(fnmatchcase(host, pattern) for pattern in positive)
+                   and not any(fnmatchcase(host, pattern) for pattern in negative)
+                   for positive, negative in self._patterns)
+
+    def _refresh(self) -> None:
+        now = time.monotonic()
+        if now - self._checked_at < self.check_interval:
+            return
+        with self._lock:
+            self._checked_at = now
+            mtimes = [_mtime(path) for path in self.paths]
+            if mtimes == self._mtimes:
+                return
+            names, patterns = set(), []
+            for path in self.paths:
+                for hosts in _read_host_lines(path):
+                    negative = [host[1:] for host in hosts if host.startswith('!')]
+                    positive = [host for host in hosts if not host.startswith('!') and host.strip('*?')]
+                    if negative or any('*' in host or '?' in host for host in positive):
+                        patterns.append((positive, negative))
+                    else:
+                        names.update(positive)
+            self._names, self._patterns, self._mtimes = frozenset(names), patterns, mtimes
+
+
+def _mtime(path: str) -> Optional[float]:
+    try:
+        return os.stat(path).st_mtime
+    except OSError:
+        return None
+
+
+def _read_host_lines(path: str) -> List[List[str]]:
+    """lowercase patterns of each `Host` line of the ssh config file."""
+    try:
+        with open(path) as f:
+            lines = f.readlines()
+    except (OSError, UnicodeDecodeError):
+        return []
+
+    host_lines = []
+    for line in lines:
+        parts = line.strip().replace('=', ' ', 1).split(None, 1)
+        if len(parts) == 2 and parts[0].lower() == 'host':
+            host_lines.append([host.strip('"').lower() for host in parts[1].split()])
+    return host_lines
+
+
+ssh_config_hosts = SshConfigHosts()
+"""hosts of the user and system ssh configs."""
+
+
+@lru_cache(maxsize=VALIDATION_CACHE_SIZE)
+def _is_ip(value: str) -> bool:
+    return ipv4(value) is True or ipv6(value) is True
+
+
+@lru_cache(maxsize=VALIDATION_CACHE_SIZE)
+def _is_domain(value: str) -> bool:
+    return domain(value) is True
+
+
+@lru_cache(maxsize=VALIDATION_CACHE_SIZE)
+def _is_mac(value: str) -> bool:
+    return mac_address(value) is True
+
+
+@lru_cache(maxsize=None)
+def _has_fabric() -> bool:
+    """ssh aliases are used by fabric only. it's not imported, that is slow."""
+    return find_spec('fabric') is not None
 
 
 def validate_ip(ip: str) -> None:
-    for validator in [ipv4, ipv6]:
-        if validator(ip) is True:
-            break
-    else:
+    if not _is_ip(ip):
         raise ValidationError(f'"{ip}" is not a valid ip address')
 
 
 def validate_host(host: str) -> None:
-    for validator in [ipv4, ipv6, domain]:
-        if validator(host) is True:
-            break
-    else:
-        if not Config:
-            return
-
-        patterns = Config().base_ssh_config.get_hostnames()
-        # TODO: more complex filter
-        known_hosts = [p for p in patterns if '*' not in p]
-        known_hosts += ['localhost']
-        if host not in known_hosts:
-            raise ValidationError(f'"{host}" is not a valid host')
+    """ip, domain, localhost or a host of the ssh config. any host is valid without fabric or an ssh config."""
+    if _is_ip(host) or _is_domain(host) or host == 'localhost':
+        return
+    if not _has_fabric() or not ssh_config_hosts.available:
+        return
+    # aliases from ssh config aren't cached - the config can be changed
+    if host not in ssh_config_hosts:
+        raise ValidationError(f'"{host}" is not a valid host')
 
 
 def validate_mac(mac: str) -> None:
-    if mac_address(mac) is not True:
+    if not _is_mac(mac):
         raise ValidationError(f'"{mac}" is not a valid mac')
 
 
@@ -77,7 +180,7 @@ def add_validators(
             _validate = [_validate]
         _validate.extend(validators)
         kwargs['validate'] = _validate
-        super(base, self).__init__(**kwargs)  # noqa  # TODO: what's wrong?
+        base.__init__(self, **kwargs)
     attrs = {'__init__': __init__}
     if doc_string:
         attrs['__doc__'] = doc_string
@@ -90,8 +193,14 @@ HostField = add_validators('HostField', fields.String, [validate_host],
                            'validates IPv4, IPv6 and domain names')
 PortField = add_validators('PortField', fields.Integer, [validate.Range(min=0, max=2**16 - 1)],
                            'validates web port')
-MacField = add_validators('MacField', fields.String, [validate_mac],
-                          'validates MAC address')
+
+
+class MacField(add_validators('_MacField', fields.String, [validate_mac])):
+    """validates MAC address. it's loaded in lower case, so the same address is stored the same way"""
+
+    def _deserialize(self, value, attr, data, **kwargs) -> str:
+        return super()._deserialize(value, attr, data, **kwargs).lower()
+
 
 for field in (IpAddressField, HostField, PortField, MacField):
     exclude_parent_attrs(field)
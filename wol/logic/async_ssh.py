@@ -0,0 +1,265 @@
+"""
+ssh backend on asyncssh. sessions of all hosts are multiplexed by one event loop in a background thread,
+so a slow host holds a channel, not a thread.
+
+commands of the same host and credentials share one connection by separate channels.
+the backend is selected by `ssh_options.backend`, remote operations of `wol.logic.core` use it by themselves.
+"""
+
+import asyncio
+import atexit
+import threading
+import time
+from contextlib import AsyncExitStack, asynccontextmanager
+from typing import (
+    Any,
+    AsyncIterator,
+    Awaitable,
+    Dict,
+    Hashable,
+    Iterator,
+    Optional,
+)
+
+from .core import (
+    ERROR_EXEC,
+    ERROR_NOT_CONNECTED,
+    ERROR_SSH,
+    RemoteExecResult,
+    SshCredentials,
+    _load_asyncssh,
+    _ssh_error,
+    _ssh_pool_key,
+    ssh_options,
+)
+from .pool import PoolStats
+
+__all__ = ['AsyncSshClient', 'async_ssh_client']
+
+
+class _HostConnection:
+    """connection of a host, shared by commands. the connecting task is awaited by all of them."""
+
+    def __init__(self, channels: int):
+        self.connecting: Optional[asyncio.Future] = None
+        self.channels = asyncio.Semaphore(channels)
+        self.in_use = 0
+        self.released_at = time.monotonic()
+        self.closed = False
+
+
+class AsyncSshClient:
+    """ssh sessions of many hosts in one event loop. methods are called from any thread, except the loop one.
+
+    errors are raised as `RemoteExecError` with the same codes, as the fabric backend.
+
+    :param idle_timeout: seconds, after which an unused connection is closed.
+    :param max_per_key: max count of running commands (channels) per host and credentials.
+    :param acquire_timeout: seconds to wait for a free channel, if the limit is reached.
+    """
+
+    def __init__(self, idle_timeout: float = 60, max_per_key: int = 4, acquire_timeout: float = 10):
+        self.idle_timeout = idle_timeout
+        self.max_per_key = max_per_key
+        self.acquire_timeout = acquire_timeout
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._lock = threading.Lock()
+        self._connections: Dict[Hashable, _HostConnection] = {}
+        self._stats = PoolStats()
+
+    def run(self, creds: SshCredentials, command: str, sudo: bool = False,
+            timeout: Optional[float] = None) -> RemoteExecResult:
+        """run the command. it fails with a not zero exit code.
+
+        :param timeout: seconds to run the command. default - `ssh_options.command_timeout`.
+        """
+        return self._call(self._run(creds, command, sudo, timeout or ssh_options.command_timeout))
+
+    def iter_lines(self, creds: SshCredentials, command: str, timeout: float) -> Iterator[str]:
+        """output lines of the long command, while they are read. the command is stopped with the iterator.
+
+        :param timeout: max seconds between lines.
+        """
+        asyncssh = self._asyncssh()
+        stack = AsyncExitStack()
+        process = self._call(self._start(stack, creds, command))
+        try:
+            while True:
+                try:
+                    line = self._call(asyncio.wait_for(process.stdout.readline(), timeout))
+                except asyncio.TimeoutError:
+                    raise _ssh_error(ERROR_EXEC, "command timed out", {'timeout': timeout})
+                except asyncssh.Error as e:
+                    raise _ssh_error(ERROR_SSH, "ssh exception", vars(e))
+                if not line:
+                    return
+                yield line
+        finally:
+            self._call(stack.aclose())
+
+    def stats(self) -> PoolStats:
+        if self._loop is None:
+            return PoolStats()
+        return self._call(self._collect_stats())
+
+    def clear(self) -> None:
+        """close unused connections."""
+        if self._loop is not None:
+            self._call(self._close_idle(0))
+
+    def _call(self, coro: Awaitable) -> Any:
+        return asyncio.run_coroutine_threadsafe(coro, self._running_loop()).result()
+
+    def _running_loop(self) -> asyncio.AbstractEventLoop:
+        with self._lock:
+            if self._loop is None:
+                loop = asyncio.new_event_loop()
+                threading.Thread(target=loop.run_forever, name='async-ssh', daemon=True).start()
+                self._loop = loop
+            return self._loop
+
+    @staticmethod
+    def _asyncssh():
+        asyncssh = _load_asyncssh()
+        if not asyncssh:
+            raise NotImplementedError
+        return asyncssh
+
+    async def _run(self, creds: SshCredentials, command: str, sudo: bool, timeout: float) -> RemoteExecResult:
+        asyncssh = self._asyncssh()
+        stdin = None
+        if sudo:
+            # the password is read from stdin without a prompt, like fabric does
+            command = f"sudo -S -p '' {command}"
+            stdin = f'{creds.password or ""}\n'
+        try:
+            async with self._channel(creds) as conn:
+                process = await conn.create_process(command)
+                try:
+                    if stdin:
+                        self._write_stdin(process, stdin)
+                    res = await asyncio.wait_for(process.wait(), timeout)
+                finally:
+                    process.close()
+        except asyncio.TimeoutError:
+            raise _ssh_error(ERROR_EXEC, "command timed out", {'timeout': timeout})
+        except asyncssh.Error as e:
+            raise _ssh_error(ERROR_SSH, "ssh exception", vars(e))
+        if res.exit_status != 0:
+            raise _ssh_error(ERROR_EXEC, "can't exec command", {'out': res.stdout, 'err': res.stderr})
+        return RemoteExecResult(stdout=res.stdout, stderr=res.stderr, exit_code=res.exit_status)
+
+    @staticmethod
+    def _write_stdin(process, data: str) -> None:
+        try:
+            process.stdin.write(data)
+            process.stdin.write_eof()
+        except BrokenPipeError:
+            # the command is done without reading it
+            pass
+
+    async def _start(self, stack: AsyncExitStack, creds: SshCredentials, command: str):
+        """the process of the command, which holds the channel until the stack is closed."""
+        asyncssh = self._asyncssh()
+        try:
+            conn = await stack.enter_async_context(self._channel(creds))
+            process = await conn.create_process(command)
+        except asyncssh.Error as e:
+            await stack.aclose()
+            raise _ssh_error(ERROR_SSH, "ssh exception", vars(e))
+        except BaseException:
+            await stack.aclose()
+            raise
+        stack.callback(process.close)
+        return process
+
+    @asynccontextmanager
+    async def _channel(self, creds: SshCredentials) -> AsyncIterator[Any]:
+        """the connection of the host with a free channel. it's opened by the first command."""
+        await self._close_idle(self.idle_timeout)
+        key = _ssh_pool_key(creds)
+        host = self._connections.get(key)
+        if host is None or host.closed:
+            host = _HostConnection(self.max_per_key)
+            host.connecting = asyncio.ensure_future(self._connect(host, creds))
+            self._connections[key] = host
+            self._stats.misses += 1
+        else:
+            self._stats.hits += 1
+
+        try:
+            await asyncio.wait_for(host.channels.acquire(), self.acquire_timeout)
+        except asyncio.TimeoutError:
+            raise _ssh_error(ERROR_NOT_CONNECTED, "too many connections to host")
+        host.in_use += 1
+        try:
+            try:
+                # a failed connecting is raised to all waiting commands
+                conn = await asyncio.shield(host.connecting)
+            except Exception:
+                self._discard(key, host)
+                raise
+            yield conn
+        finally:
+            host.in_use -= 1
+            host.released_at = time.monotonic()
+            host.channels.release()
+
+    async def _connect(self, host: _HostConnection, creds: SshCredentials):
+        asyncssh = self._asyncssh()
+        options = {'username': creds.login, 'password': creds.password, 'known_hosts': None}
+        try:
+            if creds.pkey:
+                options['client_keys'] = [asyncssh.import_private_key(creds.pkey)]
+            conn = await asyncio.wait_for(asyncssh.connect(creds.host, creds.port or 22, **options),
+                                          ssh_options.connect_timeout)
+        except (OSError, asyncio.TimeoutError):
+            raise _ssh_error(ERROR_NOT_CONNECTED, "can't connect to host")
+        except asyncssh.Error as e:
+            raise _ssh_error(ERROR_SSH, "ssh exception", vars(e))
+        except asyncssh.KeyImportError as e:
+            raise _ssh_error(ERROR_SSH, "ssh exception", {'error': str(e)})
+
+        # a connection, closed by the host or by an error, is replaced by the next command
+        def closed(_future: asyncio.Future) -> None:
+            if not host.closed:
+                host.closed = True
+                self._stats.discards += 1
+
+        asyncio.ensure_future(conn.wait_closed()).add_done_callback(closed)
+        return conn
+
+    def _discard(self, key: Hashable, host: _HostConnection) -> None:
+        if not host.closed:
+            host.closed = True
+            self._stats.discards += 1
+        if self._connections.get(key) is host:
+            del self._connections[key]
+        self._close(host)
+
+    async def _close_idle(self, idle_timeout: float) -> None:
+        border = time.monotonic() - idle_timeout
+        for key, host in list(self._connections.items()):
+            if not host.in_use and host.released_at <= border:
+                self._stats.evictions += 1
+                host.closed = True
+                del self._connections[key]
+                self._close(host)
+
+    @staticmethod
+    def _close(host: _HostConnection) -> None:
+        if host.connecting.done() and not host.connecting.cancelled() and not host.connecting.exception():
+            host.connecting.result().close()
+        else:
+            host.connecting.cancel()
+
+    async def _collect_stats(self) -> PoolStats:
+        hosts = [host for host in self._connections.values() if not host.closed]
+        return PoolStats(hits=self._stats.hits, misses=self._stats.misses, evictions=self._stats.evictions,
+                         discards=self._stats.discards, idle=sum(not host.in_use for host in hosts),
+                         in_use=sum(host.in_use for host in hosts))
+
+
+async_ssh_client = AsyncSshClient()
+"""sessions of the asyncssh backend, shared by all remote operations."""
+atexit.register(async_ssh_client.clear)
@@ -0,0 +1,118 @@
+"""
+wakeup of hosts with waiting until they are reachable.
+"""
+
+import time
+from dataclasses import dataclass, field
+from typing import (
+    Iterator,
+    List,
+    Optional,
+    Sequence,
+)
+
+from .core import WakeupTarget, wakeup_hosts
+from .probe import (
+    METHOD_ICMP,
+    METHOD_PING,
+    METHOD_SSH,
+    METHOD_TCP,
+    check_hosts,
+)
+
+__all__ = ['BootTarget', 'iter_wake_and_wait', 'wake_and_wait', 'WAIT_METHODS']
+
+WAIT_METHODS = (METHOD_TCP, METHOD_SSH, METHOD_ICMP, METHOD_PING)
+# multiplier of the delay between checks
+BACKOFF = 2
+
+
+@dataclass
+class BootTarget:
+    """host to wake up and to wait for."""
+    packet: WakeupTarget
+    # ip or hostname for checks
+    host: str
+    # added to the result and events of the host, e.g. id of the target
+    extra: dict = field(default_factory=dict)
+
+
+def iter_wake_and_wait(
+        targets: Sequence[BootTarget],
+        method: str = METHOD_TCP,
+        port: int = 22,
+        timeout: float = 120,
+        retransmit: float = 30,
+        min_delay: float = 1,
+        max_delay: float = 10,
+        check_timeout: float = 2,
+        repeat: int = 1,
+        rate: Optional[float] = None,
+) -> Iterator[dict]:
+    """send magic packets and check hosts with exponential backoff, until they are reachable.
+
+    pending hosts are checked concurrently each round. packets are sent again to hosts,
+    which aren't reachable for `retransmit` seconds - the first packet could be lost.
+
+    :param targets: hosts.
+    :param method: `tcp` - the port is open or closed, `ssh` - sshd on the port is ready, `icmp`, `ping`.
+    :param port: tcp port for `tcp` and `ssh` methods.
+    :param timeout: seconds to wait for hosts.
+    :param retransmit: seconds between packets to a not reachable host.
+    :param min_delay: seconds between the first checks.
+    :param max_delay: max seconds between checks.
+    :param check_timeout: seconds to wait for a response of each check.
+    :param repeat: how many times to send every packet.
+    :param rate: max count of packets per second. unlimited, if not set.
+    :return: events - `sent`, `retransmit`, `up`, `waiting` and `done` with results in the order of targets.
+        `boot_time` of a result is seconds from the first packet till the host is reachable.
+    """
+    started = time.monotonic()
+    deadline = started + timeout
+    results = [{**target.extra, 'mac': target.packet.mac, 'host': target.host, 'sent': False, 'up': False,
+                'boot_time': None, 'retransmits': 0} for target in targets]
+    sent = wakeup_hosts([target.packet for target in targets], repeat=repeat, rate=rate)
+    pending = []
+    for i, result in enumerate(sent):
+        results[i]['sent'] = result['sent']
+        if result['sent']:
+            pending.append(i)
+        else:
+            results[i]['error'] = result.get('error')
+    yield {'event': 'sent', 'sent': len(pending), 'failed': len(targets) - len(pending)}
+
+    last_sent = dict.fromkeys(pending, started)
+    delay = min_delay
+    while pending and time.monotonic() < deadline:
+        reachable = check_hosts([targets[i].host for i in pending], port=port, method=method,
+                                timeout=min(check_timeout, max(deadline - time.monotonic(), 0.1)))
+        now = time.monotonic()
+        for i in pending:
+            if reachable[targets[i].host]:
+                results[i].update(up=True, boot_time=round(now - started, 3))
+                yield {'event': 'up', **targets[i].extra, 'mac': targets[i].packet.mac, 'host': targets[i].host,
+                       'boot_time': results[i]['boot_time']}
+        pending = [i for i in pending if not results[i]['up']]
+
+        resend = [i for i in pending if now - last_sent[i] >= retransmit]
+        if resend:
+            wakeup_hosts([targets[i].packet for i in resend], repeat=repeat, rate=rate)
+            for i in resend:
+                last_sent[i] = now
+                results[i]['retransmits'] += 1
+            yield {'event': 'retransmit', 'macs': [targets[i].packet.mac for i in resend]}
+
+        if pending:
+            yield {'event': 'waiting', 'pending': len(pending), 'elapsed': round(now - started, 3)}
+            time.sleep(max(min(delay, deadline - time.monotonic()), 0))
+            delay = min(delay * BACKOFF, max_delay)
+
+    for i in pending:
+        results[i]['error'] = 'timeout'
+    yield {'event': 'done', 'results': results}
+
+
+def wake_and_wait(targets: Sequence[BootTarget], **kwargs) -> List[dict]:
+    """the same as `iter_wake_and_wait`, but only results are returned."""
+    *_, done = iter_wake_and_wait(targets, **kwargs)
+    return done['results']
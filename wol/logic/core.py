@@ -1,52 +1,106 @@
+import atexit
+import hashlib
+import io
+import ipaddress
 import operator
 import os
+import socket
 import subprocess  # noqa: S404
-from dataclasses import dataclass
+from array import array
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from functools import lru_cache, partial
 from numbers import Number
+from types import ModuleType, SimpleNamespace
 from typing import (
     Callable,
     Dict,
     Iterable,
+    Iterator,
     List,
     NamedTuple,
     Optional,
+    Sequence,
+    Union,
 )
 
-from wakeonlan import send_magic_packet
-
 try:
     from functools import singledispatchmethod
 except ImportError:
     from singledispatchmethod import singledispatchmethod
 
-try:
-    import scapy
-    import scapy.config
-    import scapy.route
-    import scapy.utils
-    from scapy.layers.inet import IP, TCP
-    from scapy.layers.l2 import arping
-    from scapy.sendrecv import sr1
-except Exception:
-    scapy = None
-else:
-    scapy.config.conf.verb = 0
-
-try:
-    import fabric
-except ImportError:
-    fabric = None
-else:
-    from paramiko.ssh_exception import NoValidConnectionsError, SSHException
-
 from ..doc_utils import exclude_parent_attrs
+from ..profiling import span
+from ..telemetry import instrumented, ssh_errors
+from .magic import WakeupTarget, magic_sender
+from .pool import ConnectionPool, PoolExhausted, PoolStats
 
 __all__ = ['CpuStat', 'SshCredentials', 'check_host', 'reboot_host', 'get_cpu_stat', 'wakeup_host', 'RemoteExecError',
-           'scan_local_net', 'shutdown_host']
+           'scan_local_net', 'shutdown_host', 'ssh_pool', 'WakeupTarget', 'wakeup_hosts', 'CpuStatBatch',
+           'get_cpu_stats', 'arping_addresses', 'LocalNet', 'get_nets', 'ssh_options', 'get_ssh_pool_stats',
+           'SSH_BACKENDS']
 
 ERROR_NOT_CONNECTED = 0
 ERROR_SSH = 1
 ERROR_EXEC = 2
+ERROR_NAMES = {ERROR_NOT_CONNECTED: 'not_connected', ERROR_SSH: 'ssh', ERROR_EXEC: 'exec'}
+
+SSH_BACKEND_FABRIC = 'fabric'
+SSH_BACKEND_ASYNCSSH = 'asyncssh'
+SSH_BACKENDS = (SSH_BACKEND_FABRIC, SSH_BACKEND_ASYNCSSH)
+
+
+# heavy optional backends are loaded by the first use, so commands and workers,
+# which don't need them, start fast
+
+@lru_cache(maxsize=None)
+def _load_numpy() -> Optional[ModuleType]:
+    try:
+        import numpy
+    except ImportError:
+        return None
+    return numpy
+
+
+@lru_cache(maxsize=None)
+def _load_scapy() -> Optional[SimpleNamespace]:
+    """scapy loads all layers and reads routes at import."""
+    try:
+        import scapy.config
+        import scapy.route
+        import scapy.utils
+        from scapy.layers.inet import IP, TCP
+        from scapy.layers.l2 import arping
+        from scapy.sendrecv import sr, sr1
+    except Exception:
+        return None
+    scapy.config.conf.verb = 0
+    return SimpleNamespace(conf=scapy.config.conf, utils=scapy.utils, IP=IP, TCP=TCP, arping=arping, sr=sr, sr1=sr1)
+
+
+@lru_cache(maxsize=None)
+def _load_fabric() -> Optional[SimpleNamespace]:
+    try:
+        import fabric
+        import paramiko
+        from invoke.exceptions import CommandTimedOut
+        from paramiko.ssh_exception import NoValidConnectionsError, SSHException
+    except ImportError:
+        return None
+    key_classes = [getattr(paramiko, name) for name in ('Ed25519Key', 'ECDSAKey', 'RSAKey', 'DSSKey')
+                   if hasattr(paramiko, name)]
+    return SimpleNamespace(Connection=fabric.Connection, NoValidConnectionsError=NoValidConnectionsError,
+                           SSHException=SSHException, CommandTimedOut=CommandTimedOut, key_classes=key_classes)
+
+
+@lru_cache(maxsize=None)
+def _load_asyncssh() -> Optional[ModuleType]:
+    try:
+        import asyncssh
+    except ImportError:
+        return None
+    return asyncssh
 
 
 class OperableNamedTuple(NamedTuple):
@@ -115,12 +169,89 @@ class CpuStat(CpuStatBase, OperableNamedTuple):
     pass
 
 
+class CpuStatBatch:
+    """many `CpuStat` as columns - one per field, for computing all hosts at once.
+
+    numpy arrays are used, if numpy is installed, otherwise `array.array`.
+    """
+
+    def __init__(self, columns: Sequence[Sequence[float]]):
+        numpy = _load_numpy()
+        if numpy is not None:
+            self._columns = numpy.asarray(columns, dtype=float).reshape(len(CpuStat._fields), -1)
+        else:
+            self._columns = [array('d', column) for column in columns]
+
+    @classmethod
+    def from_rows(cls, rows: Iterable[Sequence[float]]) -> 'CpuStatBatch':
+        rows = list(rows)
+        if not rows:
+            return cls([[] for _ in CpuStat._fields])
+        return cls(list(zip(*rows)))
+
+    @classmethod
+    def from_lines(cls, lines: Iterable[str]) -> 'CpuStatBatch':
+        """parse `cpu` lines of `/proc/stat`."""
+        return cls.from_rows(_parse_cpu_line(line) for line in lines)
+
+    def __len__(self) -> int:
+        return len(self._columns[0])
+
+    def __getitem__(self, index: int) -> CpuStat:
+        return CpuStat._make(float(column[index]) for column in self._columns)
+
+    def __iter__(self) -> Iterator[CpuStat]:
+        return (self[i] for i in range(len(self)))
+
+    def column(self, field: str) -> Sequence[float]:
+        return self._columns[CpuStat._fields.index(field)]
+
+    def percent_delta(self, newer: 'CpuStatBatch') -> 'CpuStatBatch':
+        """percent of time spent in each state between measures of this and the newer batch."""
+        numpy = _load_numpy()
+        if numpy is not None:
+            diff = newer._columns - self._columns
+            full = diff.sum(axis=0)
+            percent = numpy.divide(diff * 100, full, out=numpy.zeros_like(diff), where=full != 0)
+            return CpuStatBatch(percent)
+
+        diff = [array('d', map(operator.sub, new, old)) for old, new in zip(self._columns, newer._columns)]
+        full = [sum(values) for values in zip(*diff)]
+        return CpuStatBatch([[value * 100 / total if total else 0 for value, total in zip(column, full)]
+                             for column in diff])
+
+    def round(self, precision: int) -> 'CpuStatBatch':  # noqa: A003
+        numpy = _load_numpy()
+        if numpy is not None:
+            return CpuStatBatch(numpy.round(self._columns, precision))
+        return CpuStatBatch([[round(value, precision) for value in column] for column in self._columns])
+
+
 @dataclass
 class SshCredentials:
     host: str
     login: Optional[str]
     password: Optional[str]
     port: Optional[int] = 22
+    # private key in the openssh or pem format
+    pkey: Optional[str] = field(default=None, repr=False)
+
+
+@dataclass
+class SshOptions:
+    """options of all remote operations.
+
+    :param backend: `fabric` - blocking sessions of paramiko, pooled by `ssh_pool`,
+        `asyncssh` - sessions of all hosts in one event loop, see `wol.logic.async_ssh`.
+    :param connect_timeout: seconds to connect and authenticate.
+    :param command_timeout: seconds to run a command.
+    """
+    backend: str = SSH_BACKEND_FABRIC
+    connect_timeout: float = 10
+    command_timeout: float = 60
+
+
+ssh_options = SshOptions()
 
 
 class RemoteExecError(Exception):
@@ -146,32 +277,104 @@ class RemoteExecResult:
     exit_code: int
 
 
-if fabric:
-    def _remote_exec_command(creds: SshCredentials, command: str, sudo: bool = False) -> RemoteExecResult:
+def _ssh_pool_key(creds: SshCredentials) -> tuple:
+    # secrets are not kept in the key, but different secrets must not share a session
+    fingerprint = hashlib.sha256(f'{creds.password or ""}\0{creds.pkey or ""}'.encode()).hexdigest()
+    return creds.host, creds.port, creds.login, fingerprint
+
+
+ssh_pool = ConnectionPool(close=lambda c: c.close(), is_alive=lambda c: c.is_connected)
+"""ssh sessions, shared by all remote operations."""
+atexit.register(ssh_pool.clear)
+
+
+def get_ssh_pool_stats() -> PoolStats:
+    """usage counters of ssh connections of the selected backend."""
+    if ssh_options.backend == SSH_BACKEND_ASYNCSSH:
+        return _async_ssh_client().stats()
+    return ssh_pool.stats()
+
+
+def _async_ssh_client():
+    # the module imports this one
+    from .async_ssh import async_ssh_client
+    return async_ssh_client
+
+
+def _open_ssh_connection(creds: SshCredentials):
+    connect_kwargs = {'password': creds.password}
+    if creds.pkey:
+        connect_kwargs['pkey'] = _load_paramiko_key(creds.pkey)
+    conn = _load_fabric().Connection(creds.host, creds.login, creds.port, connect_kwargs=connect_kwargs,
+                                     connect_timeout=ssh_options.connect_timeout)
+    with span('ssh.connect'):
         try:
-            with fabric.Connection(creds.host, creds.login, creds.port,
-                                   connect_kwargs={'password': creds.password}) as c:
-                if sudo:
-                    res = c.sudo(command, warn=True, hide=True, password=creds.password)
-                else:
-                    res = c.run(command, warn=True, hide=True)
-        except NoValidConnectionsError:
-            raise RemoteExecError(ERROR_NOT_CONNECTED, "can't connect to host")
-        except SSHException as e:
-            raise RemoteExecError(ERROR_SSH, "ssh exception", vars(e))
-        if res.exited:
-            raise RemoteExecError(ERROR_EXEC, "can't exec command",
-                                  {'out': res.stdout, 'err': res.stderr})
-        return RemoteExecResult(stdout=res.stdout, stderr=res.stderr, exit_code=res.exited)
-else:
-    def _remote_exec_command(*args, **kwargs):
-        raise NotImplementedError
+            conn.open()
+        except socket.timeout:
+            raise _ssh_error(ERROR_NOT_CONNECTED, "can't connect to host")
+    return conn
+
+
+def _load_paramiko_key(pkey: str):
+    """private key of any type, supported by paramiko."""
+    fabric = _load_fabric()
+    for key_class in fabric.key_classes:
+        try:
+            return key_class.from_private_key(io.StringIO(pkey))
+        except fabric.SSHException:
+            continue
+    raise fabric.SSHException('unsupported private key')
+
+
+def _ssh_error(code: int, reason: str, details: Optional[any] = None) -> RemoteExecError:
+    """error of the remote operation, counted by the code."""
+    ssh_errors.inc(code=ERROR_NAMES[code])
+    return RemoteExecError(code, reason, details)
 
 
+@contextmanager
+def _ssh_connection(creds: SshCredentials) -> Iterator[any]:
+    """pooled connection. ssh errors are raised as `RemoteExecError`."""
+    fabric = _load_fabric()
+    if not fabric:
+        raise NotImplementedError
+    try:
+        with ssh_pool.connection(_ssh_pool_key(creds), partial(_open_ssh_connection, creds)) as c:
+            yield c
+    except PoolExhausted:
+        raise _ssh_error(ERROR_NOT_CONNECTED, "too many connections to host")
+    except fabric.NoValidConnectionsError:
+        raise _ssh_error(ERROR_NOT_CONNECTED, "can't connect to host")
+    except fabric.SSHException as e:
+        raise _ssh_error(ERROR_SSH, "ssh exception", vars(e))
+    except fabric.CommandTimedOut as e:
+        raise _ssh_error(ERROR_EXEC, "command timed out", {'timeout': e.timeout})
+
+
+@instrumented('remote_exec')
+def _remote_exec_command(creds: SshCredentials, command: str, sudo: bool = False) -> RemoteExecResult:
+    """run the command by the selected backend. failed commands are raised as `RemoteExecError`."""
+    if ssh_options.backend == SSH_BACKEND_ASYNCSSH:
+        return _async_ssh_client().run(creds, command, sudo)
+    timeout = ssh_options.command_timeout
+    with _ssh_connection(creds) as c:
+        if sudo:
+            res = c.sudo(command, warn=True, hide=True, password=creds.password, timeout=timeout)
+        else:
+            res = c.run(command, warn=True, hide=True, timeout=timeout)
+    if res.exited:
+        raise _ssh_error(ERROR_EXEC, "can't exec command",
+                         {'out': res.stdout, 'err': res.stderr})
+    return RemoteExecResult(stdout=res.stdout, stderr=res.stderr, exit_code=res.exited)
+
+
+CPU_STAT_COMMAND = 'head -1 /proc/stat && sleep 1 > /dev/null && head -1 /proc/stat'
+
+
+@instrumented('get_cpu_stat')
 def get_cpu_stat(creds: SshCredentials, precision: Optional[int] = None) -> CpuStat:
     # TODO: add memory information
-    cmd = 'head -1 /proc/stat && sleep 1 > /dev/null && head -1 /proc/stat'
-    res = _remote_exec_command(creds, cmd)
+    res = _remote_exec_command(creds, CPU_STAT_COMMAND)
     l1, l2, *_ = res.stdout.split('\n')
     stat = _get_delta_from_str(l1, l2)
     if precision:
@@ -180,17 +383,55 @@ def get_cpu_stat(creds: SshCredentials, precision: Optional[int] = None) -> CpuS
 
 
 def _get_delta_from_str(s1: str, s2: str) -> CpuStat:
-    measure1 = CpuStat(*map(int, s1.split()[1:]))
-    measure2 = CpuStat(*map(int, s2.split()[1:]))
-    diff = measure2 - measure1
-    full = sum(measure2) - sum(measure1)
-    return diff / full * 100
+    return _get_delta(_parse_cpu_line(s1), _parse_cpu_line(s2))
+
+
+def _parse_cpu_line(line: str) -> CpuStat:
+    """parse the `cpu` line of `/proc/stat`. values are in USER_HZ since boot."""
+    return CpuStat(*map(int, line.split()[1:]))
+
+
+def _get_delta(measure1: CpuStat, measure2: CpuStat) -> CpuStat:
+    """percent of time spent in each state between two measures."""
+    diff = [new - old for old, new in zip(measure1, measure2)]
+    full = sum(diff)
+    return CpuStat._make([value * 100 / full for value in diff])
+
+
+def get_cpu_stats(
+        creds_list: Sequence[SshCredentials],
+        precision: Optional[int] = None,
+        parallelism: int = 16,
+) -> List[Union[CpuStat, RemoteExecError]]:
+    """cpu load of many hosts. hosts are measured in parallel, deltas are computed at once.
+
+    :return: stat or error for each host in the same order.
+    """
+    def measure(creds: SshCredentials) -> Union[RemoteExecResult, RemoteExecError]:
+        try:
+            return _remote_exec_command(creds, CPU_STAT_COMMAND)
+        except RemoteExecError as e:
+            return e
+
+    with ThreadPoolExecutor(max_workers=max(min(parallelism, len(creds_list)), 1)) as executor:
+        results = list(executor.map(measure, creds_list))
+
+    measured = [i for i, res in enumerate(results) if isinstance(res, RemoteExecResult)]
+    lines = [results[i].stdout.split('\n')[:2] for i in measured]
+    stats = CpuStatBatch.from_lines(line[0] for line in lines).percent_delta(
+        CpuStatBatch.from_lines(line[1] for line in lines))
+    if precision:
+        stats = stats.round(precision)
+    for i, stat in zip(measured, stats):
+        results[i] = stat
+    return results
 
 
 def _can_use_scapy() -> bool:
-    return os.geteuid() == 0 and scapy is not None
+    return os.geteuid() == 0 and _load_scapy() is not None
 
 
+@instrumented('check_host')
 def check_host(host: str, port: Optional[int] = 80) -> bool:
     if _can_use_scapy():
         return check_host_scapy(host, port=port)
@@ -199,8 +440,9 @@ def check_host(host: str, port: Optional[int] = 80) -> bool:
 
 def check_host_scapy(host: str, port: Optional[int] = 80) -> bool:
     """check by SYN/ACK to specified port."""
-    packet = IP(dst=host) / TCP(dport=port or 80)
-    response = sr1(packet, timeout=15)
+    scapy = _load_scapy()
+    packet = scapy.IP(dst=host) / scapy.TCP(dport=port or 80)
+    response = scapy.sr1(packet, timeout=15)
     return response is not None
 
 
@@ -211,15 +453,25 @@ def check_host_ping(host: str) -> bool:
     return proc.returncode == 0
 
 
-def wakeup_host(mac: str, host: str = '255.255.255.255', port: int = 9) -> None:
-    # scapy:
-    #     from scapy.sendrecv import send
-    #     from scapy.layers.inet import IP, UDP
-    #     magic = bytes.fromhex(mac.replace(':', '')
-    #     start = bytes.fromhex('FF')*6
-    #     packet = IP(dst=host) / UDP(dport=port) / (start + magic*16)
-    #     send(packet)
-    send_magic_packet(mac, ip_address=host, port=port)
+def wakeup_host(
+        mac: str,
+        host: str = '255.255.255.255',
+        port: int = 9,
+        iface: Optional[str] = None,
+        password: Optional[str] = None,
+) -> None:
+    """send a magic packet. see `MagicSender.send`."""
+    magic_sender.send(mac, host, port, iface, password)
+
+
+def wakeup_hosts(
+        targets: Iterable[WakeupTarget],
+        repeat: int = 1,
+        rate: Optional[float] = None,
+        interval: float = 0,
+) -> List[dict]:
+    """wakeup many hosts at once. see `MagicSender.send_many`."""
+    return magic_sender.send_many(targets, repeat=repeat, interval=interval, rate=rate)
 
 
 def reboot_host(creds: SshCredentials, sudo: bool = True) -> None:
@@ -230,39 +482,111 @@ def shutdown_host(creds: SshCredentials, sudo: bool = True) -> None:
     _remote_exec_command(creds, 'shutdown now', sudo)
 
 
-def scan_local_net(net: Optional[str] = None) -> List[Dict[str, str]]:
-    """get hosts (ip, mac) from local net by ARP protocol."""
-    # TODO: select network interface w/o mask - get mask from adapter
-    # TODO: select network interface by unique prefix
-    # TODO: error, if net is not provided and multiple interfaces found
+class LocalNet(NamedTuple):
+    """net with mask, available through the interface."""
+    iface: Optional[str]
+    net: str
+
+
+@instrumented('scan_local_net')
+def scan_local_net(
+        net: Optional[str] = None,
+        ifaces: Optional[Sequence[str]] = None,
+        chunk_size: int = 256,
+        parallelism: int = 8,
+) -> List[Dict[str, str]]:
+    """get hosts (ip, mac, iface) from local nets by ARP protocol.
+
+    nets of all interfaces (or the selected ones) are scanned concurrently.
+    large nets are split into chunks of `chunk_size` addresses, scanned in parallel.
+
+    :param net: net with mask. only the first of `ifaces` is used with it.
+    :param ifaces: names or prefixes of interfaces. default - all, except docker ones.
+    """
+    if not _can_use_scapy():
+        raise NotImplementedError
+
+    if net:
+        nets = [LocalNet(ifaces[0] if ifaces else None, net)]
+    else:
+        nets = get_nets(ifaces)
+
+    def scan(local_net: LocalNet) -> List[Dict[str, str]]:
+        addresses = [str(address) for address in ipaddress.ip_network(local_net.net, strict=False).hosts()]
+        return arping_addresses(addresses, chunk_size, parallelism, iface=local_net.iface)
+
+    if not nets:
+        return []
+    with ThreadPoolExecutor(max_workers=len(nets)) as executor:
+        return [host for hosts in executor.map(scan, nets) for host in hosts]
+
+
+def arping_addresses(
+        addresses: Sequence[str],
+        chunk_size: int = 256,
+        parallelism: int = 8,
+        timeout: float = 2,
+        iface: Optional[str] = None,
+) -> List[Dict[str, str]]:
+    """get hosts (ip, mac, iface), which answer ARP requests, from the addresses."""
     if not _can_use_scapy():
         raise NotImplementedError
 
-    if not net:
-        net = get_net()
-    ans, _ = arping(net)
-    hosts = [{'ip': r.psrc, 'mac': r.hwsrc} for _, r in ans.res]
-    return hosts
+    scapy = _load_scapy()
+    chunks = [list(addresses[i:i + chunk_size]) for i in range(0, len(addresses), chunk_size)]
+    if not chunks:
+        return []
 
+    def scan(chunk: List[str]) -> List[Dict[str, str]]:
+        kwargs = {'iface': iface} if iface else {}
+        ans, _ = scapy.arping(chunk, timeout=timeout, verbose=0, **kwargs)
+        return [{'ip': r.psrc, 'mac': r.hwsrc, 'iface': iface or r.sniffed_on} for _, r in ans.res]
 
-def get_net() -> str:
-    """find network interface/mask, that has access to the Internet."""
-    # TODO: need rework
-    #  can find multiple interfaces
-    for network, netmask, _, interface, address, _ in scapy.config.conf.route.routes:
+    with ThreadPoolExecutor(max_workers=min(parallelism, len(chunks))) as executor:
+        return [host for hosts in executor.map(scan, chunks) for host in hosts]
+
+
+def get_nets(ifaces: Optional[Sequence[str]] = None) -> List[LocalNet]:
+    """find nets of network interfaces.
+
+    :param ifaces: names or prefixes of interfaces. an interface is selected by the exact name,
+        otherwise by the prefix. default - all, except docker ones.
+    """
+    scapy = _load_scapy()
+    if not scapy:
+        return []
+    nets = []
+    for network, netmask, _, interface, address, _ in scapy.conf.route.routes:
         if network == 0 or interface == 'lo' or address in ('127.0.0.1', '0.0.0.0'):  # noqa: S104
             continue
         if netmask <= 0 or netmask == 0xFFFFFFFF:
             continue
-        if interface.startswith('docker') or interface.startswith('br-'):
+        if not ifaces and (interface.startswith('docker') or interface.startswith('br-')):
             continue
         addr_num = scapy.utils.atol(address)
         if addr_num & netmask != network:
             continue
         net = scapy.utils.ltoa(network)
         mask = bin(netmask).count('1')
-        return f'{net}/{mask}'
+        local_net = LocalNet(interface, f'{net}/{mask}')
+        if local_net not in nets:
+            nets.append(local_net)
+
+    if ifaces:
+        names = {local_net.iface for local_net in nets}
+        selected = set()
+        for iface in ifaces:
+            selected.update([iface] if iface in names else [name for name in names if name.startswith(iface)])
+        nets = [local_net for local_net in nets if local_net.iface in selected]
+    return nets
+
+
+def get_net() -> Optional[str]:
+    """find network interface/mask, that has access to the Internet."""
+    nets = get_nets()
+    return nets[0].net if nets else None
 
 
 exclude_parent_attrs(CpuStat)
+exclude_parent_attrs(LocalNet)
 exclude_parent_attrs(RemoteExecError)
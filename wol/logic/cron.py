@@ -0,0 +1,116 @@
+"""
+cron rules: `minute hour day-of-month month day-of-week`.
+"""
+
+from datetime import datetime, timedelta
+from functools import lru_cache
+from typing import FrozenSet, Optional, Tuple
+
+__all__ = ['CronRule', 'parse_cron']
+
+MACROS = {
+    '@yearly': '0 0 1 1 *',
+    '@annually': '0 0 1 1 *',
+    '@monthly': '0 0 1 * *',
+    '@weekly': '0 0 * * 0',
+    '@daily': '0 0 * * *',
+    '@midnight': '0 0 * * *',
+    '@hourly': '0 * * * *',
+}
+MONTHS = ('jan', 'feb', 'mar', 'apr', 'may', 'jun', 'jul', 'aug', 'sep', 'oct', 'nov', 'dec')
+DAYS = ('sun', 'mon', 'tue', 'wed', 'thu', 'fri', 'sat')
+# (min, max, names from min) of each field
+FIELDS = (
+    (0, 59, ()),
+    (0, 23, ()),
+    (1, 31, ()),
+    (1, 12, MONTHS),
+    (0, 7, DAYS),
+)
+# a rule without any time in this count of years never fires, e.g. `0 0 30 2 *`
+MAX_YEARS = 5
+
+
+class CronRule:
+    """parsed cron rule. names of months and days, ranges, steps, lists and macros (`@daily`) are supported.
+
+    if both day of month and day of week are restricted, a day matching any of them fits, like in cron.
+    """
+
+    def __init__(self, expression: str):
+        self.expression = expression
+        parts = MACROS.get(expression.strip().lower(), expression).split()
+        if len(parts) != 5:
+            raise ValueError(f'"{expression}" must have 5 fields')
+        minutes, hours, days, months, weekdays = (_parse_field(part, *field) for part, field in zip(parts, FIELDS))
+        self.minutes = minutes
+        self.hours = hours
+        self.days = days
+        self.months = months
+        # 7 is sunday too
+        self.weekdays = frozenset(day % 7 for day in weekdays)
+        self._any_day = parts[2] == '*'
+        self._any_weekday = parts[4] == '*'
+
+    def __repr__(self) -> str:
+        return f'CronRule({self.expression!r})'
+
+    def next_after(self, moment: datetime) -> Optional[datetime]:
+        """the first matching minute after the moment. None, if the rule never fires."""
+        moment = moment.replace(second=0, microsecond=0) + timedelta(minutes=1)
+        deadline = moment + timedelta(days=366 * MAX_YEARS)
+        while moment < deadline:
+            if moment.month not in self.months:
+                # the first day of the next month
+                moment = (moment.replace(day=1, hour=0, minute=0) + timedelta(days=32)).replace(day=1)
+            elif not self._day_fits(moment):
+                moment = moment.replace(hour=0, minute=0) + timedelta(days=1)
+            elif moment.hour not in self.hours:
+                moment = moment.replace(minute=0) + timedelta(hours=1)
+            elif moment.minute not in self.minutes:
+                moment += timedelta(minutes=1)
+            else:
+                return moment
+        return None
+
+    def _day_fits(self, moment: datetime) -> bool:
+        day_fits = moment.day in self.days
+        # monday is 0 for python, 1 for cron
+        weekday_fits = (moment.weekday() + 1) % 7 in self.weekdays
+        if self._any_day or self._any_weekday:
+            return day_fits and weekday_fits
+        return day_fits or weekday_fits
+
+
+def _parse_field(value: str, min_: int, max_: int, names: Tuple[str, ...]) -> FrozenSet[int]:
+    numbers = set()
+    for part in value.lower().split(','):
+        range_, _, step = part.partition('/')
+        if range_ == '*':
+            start, end = min_, max_
+        else:
+            start_name, _, end_name = range_.partition('-')
+            start = _parse_number(start_name, min_, max_, names)
+            end = _parse_number(end_name, min_, max_, names) if end_name else (max_ if step else start)
+        step = _parse_number(step, 1, max_, ()) if step else 1
+        if start > end:
+            raise ValueError(f'bad range "{part}"')
+        numbers.update(range(start, end + 1, step))
+    return frozenset(numbers)
+
+
+def _parse_number(value: str, min_: int, max_: int, names: Tuple[str, ...]) -> int:
+    if value in names:
+        return names.index(value) + min_
+    if not value.isdigit() or not min_ <= int(value) <= max_:
+        raise ValueError(f'"{value}" is not in {min_}-{max_}')
+    return int(value)
+
+
+@lru_cache(maxsize=1024)
+def parse_cron(expression: str) -> CronRule:
+    """cached parsing - schedules often share rules.
+
+    :raises ValueError: bad rule.
+    """
+    return CronRule(expression)
@@ -1,21 +1,64 @@
-from typing import List, Optional
+import time
+from functools import lru_cache
+from typing import (
+    Any,
+    Dict,
+    Iterator,
+    List,
+    Optional,
+    Tuple,
+)
 
 from flask import abort, make_response
-from marshmallow import Schema, fields
-from peewee import JOIN
+from marshmallow import (
+    Schema,
+    ValidationError,
+    fields,
+    validate,
+)
+from peewee import JOIN, Query
 from playhouse.flask_utils import get_object_or_404
 
+from ..compiled_schema import compile_schema
 from ..doc_utils import exclude_parent_attrs
 from ..fields import HostField, MacField, PortField
-from ..models import Credentials, Target
-from .core import check_host, wakeup_host
+from ..models import (
+    Credentials,
+    Target,
+    WakeUpSchedule,
+    iter_query,
+)
+from .boot import WAIT_METHODS, BootTarget, iter_wake_and_wait
+from .core import (
+    SshCredentials,
+    WakeupTarget,
+    wakeup_host,
+    wakeup_hosts,
+)
+from .cron import parse_cron
+from .fleet import (
+    ERROR_NOT_FOUND,
+    ERROR_NOT_READY,
+    fleet_error,
+    reboot_fleet,
+    shutdown_fleet,
+)
+from .monitor import status_monitor
+from .probe import METHODS
+from .scheduler import wakeup_scheduler
 
 __all__ = ['create_target', 'get_target_by_id', 'get_all_targets', 'delete_target_by_id',
-           'get_target_by_name',
-           'edit_target_by_id', 'wakeup_target_by_id', 'check_target_by_id',
+           'get_target_by_name', 'get_targets_page', 'iter_targets', 'get_credentials_page', 'iter_credentials',
+           'edit_target_by_id', 'wakeup_target_by_id', 'check_target_by_id', 'wakeup_targets',
+           'wake_and_wait_target_by_id', 'wake_and_wait_targets',
+           'check_all_targets', 'get_targets_statuses', 'reboot_targets', 'shutdown_targets',
            'create_credentials', 'get_credentials_by_id', 'get_all_credentials',
-           'delete_credentials_by_id', 'edit_credentials_by_id',
-           'TargetSchema', 'CredentialsSchema']
+           'delete_credentials_by_id', 'edit_credentials_by_id', 'create_schedule', 'get_schedule_by_id',
+           'get_all_schedules', 'edit_schedule_by_id', 'delete_schedule_by_id', 'get_scheduler_stats',
+           'TargetSchema', 'CredentialsSchema', 'BatchWakeupTargetsSchema', 'WakeAndWaitSchema',
+           'BatchWakeAndWaitSchema',
+           'CheckTargetSchema', 'CheckTargetsSchema', 'FleetActionSchema', 'TargetsQuerySchema',
+           'CredentialsQuerySchema', 'ScheduleSchema', 'SchedulesQuerySchema']
 
 # TODO: drop flask deps
 
@@ -38,6 +81,113 @@ class TargetSchema(Schema):
     credentials = fields.Nested(CredentialsSchema())
 
 
+class BatchWakeupTargetsSchema(Schema):
+    """selection of targets for the batch wakeup"""
+    ids = fields.List(fields.Int(), missing=list)
+    names = fields.List(fields.Str(), missing=list)
+    repeat = fields.Int(missing=1, validate=validate.Range(min=1, max=100))
+    interval = fields.Float(missing=0, validate=validate.Range(min=0, max=10))
+    rate = fields.Float(missing=None, validate=validate.Range(min=0, min_inclusive=False))
+
+
+class WakeAndWaitSchema(Schema):
+    """options of waiting, until woken targets are reachable"""
+    method = fields.Str(missing='tcp', validate=validate.OneOf(WAIT_METHODS))
+    port = PortField(missing=22)
+    timeout = fields.Float(missing=120, validate=validate.Range(min=0, max=3600, min_inclusive=False))
+    retransmit = fields.Float(missing=30, validate=validate.Range(min=1))
+    # progress events line by line instead of results
+    stream = fields.Bool(missing=False)
+
+
+class BatchWakeAndWaitSchema(WakeAndWaitSchema):
+    """selection of targets and options of waiting, until they are reachable"""
+    ids = fields.List(fields.Int(), missing=list)
+    names = fields.List(fields.Str(), missing=list)
+
+
+class CheckTargetSchema(Schema):
+    """options of the checking of a target"""
+    fresh = fields.Bool(missing=False)
+
+
+class CheckTargetsSchema(CheckTargetSchema):
+    """options of the checking of all targets"""
+    port = PortField(missing=80)
+    method = fields.Str(missing='auto', validate=validate.OneOf(METHODS))
+    timeout = fields.Float(missing=2, validate=validate.Range(min=0, max=60, min_inclusive=False))
+    concurrency = fields.Int(missing=100, validate=validate.Range(min=1, max=1000))
+
+
+class FleetActionSchema(Schema):
+    """selection of targets and options of the fleet reboot/shutdown"""
+    ids = fields.List(fields.Int(), required=True, validate=validate.Length(min=1))
+    parallelism = fields.Int(missing=10, validate=validate.Range(min=1, max=100))
+    wave_percent = fields.Float(missing=100, validate=validate.Range(min=0, max=100, min_inclusive=False))
+    max_failures = fields.Int(missing=None, validate=validate.Range(min=0))
+    wait = fields.Bool(missing=False)
+    wait_timeout = fields.Float(missing=300, validate=validate.Range(min=0, max=3600, min_inclusive=False))
+
+
+class TargetsQuerySchema(Schema):
+    """filters, fields and page of the targets list"""
+    after = fields.Int(missing=None)
+    limit = fields.Int(missing=None, validate=validate.Range(min=1, max=1000))
+    name = fields.Str(missing=None)
+    host = fields.Str(missing=None)
+    has_mac = fields.Bool(missing=None)
+    has_credentials = fields.Bool(missing=None)
+    # comma separated names
+    only = fields.Str(data_key='fields', missing=None)
+
+
+class CredentialsQuerySchema(Schema):
+    """filters, fields and page of the credentials list"""
+    after = fields.Int(missing=None)
+    limit = fields.Int(missing=None, validate=validate.Range(min=1, max=1000))
+    username = fields.Str(missing=None)
+    # comma separated names
+    only = fields.Str(data_key='fields', missing=None)
+
+
+def _validate_cron(value: str) -> None:
+    try:
+        parse_cron(value)
+    except ValueError as e:
+        raise ValidationError(str(e))
+
+
+class ScheduleSchema(Schema):
+    """wakeup schedule (de)serialization"""
+    id = fields.Int(dump_only=True)  # noqa: A003, VNE003
+    target = fields.Int(required=True)
+    enabled = fields.Bool()
+    cron = fields.Str(required=True, validate=_validate_cron)
+    jitter = fields.Int(validate=validate.Range(min=0, max=3600))
+    misfire_grace = fields.Int(validate=validate.Range(min=0, max=86400))
+    last_fired_at = fields.Float(dump_only=True)
+
+
+class SchedulesQuerySchema(Schema):
+    """filters of the schedules list"""
+    target = fields.Int(missing=None)
+
+
+# targets are dumped by lists, so the plans are built once
+target_schema = compile_schema(TargetSchema())
+credentials_schema = compile_schema(CredentialsSchema())
+schedule_schema = compile_schema(ScheduleSchema())
+TARGET_FIELDS = tuple(TargetSchema().dump_fields)
+CREDENTIALS_FIELDS = tuple(CredentialsSchema().dump_fields)
+# the greatest character of the basic plane, after all strings with a prefix
+PREFIX_END = '\uffff'
+
+
+@lru_cache(maxsize=64)
+def _projected_target_schema(only: Tuple[str, ...]):
+    return compile_schema(TargetSchema(only=only))
+
+
 def _delete_object(model, id_: int) -> None:
     obj = get_object_or_404(model, model.id == id_)
     obj.delete_instance()
@@ -68,22 +218,104 @@ def create_target(
 def get_target_by_id(id_: int) -> dict:
     query = Target.select(Target, Credentials).join(Credentials, JOIN.LEFT_OUTER)
     target = get_object_or_404(query, Target.id == id_)
-    return TargetSchema().dump(target)
+    return target_schema.dump(target)
 
 
 def get_target_by_name(name: str) -> dict:
     query = Target.select(Target, Credentials).join(Credentials, JOIN.LEFT_OUTER)
     target = get_object_or_404(query, Target.name == name)
-    return TargetSchema().dump(target)
+    return target_schema.dump(target)
 
 
 def get_all_targets() -> List[dict]:
     query = Target.select(Target, Credentials).join(Credentials, JOIN.LEFT_OUTER)
-    return TargetSchema(many=True).dump(query)
+    return target_schema.dump_many(query)
+
+
+def _parse_fields(only: Optional[str], allowed: Tuple[str, ...]) -> Tuple[str, ...]:
+    """names of the comma separated fields in the order of `allowed`. all, if not set."""
+    if not only:
+        return allowed
+    names = {name.strip() for name in only.split(',')} - {''}
+    unknown = names - set(allowed)
+    if unknown:
+        raise ValueError(f'unknown fields: {", ".join(sorted(unknown))}')
+    return tuple(name for name in allowed if name in names)
+
+
+def _keyset_page(query: Query, model, after: Optional[int], limit: Optional[int]) -> Query:
+    """rows after the id, ordered by id. one extra row is selected to know, if there is the next page."""
+    if after is not None:
+        query = query.where(model.id > after)
+    query = query.order_by(model.id)
+    return query.limit(limit + 1) if limit else query
+
+
+def _select_targets(
+        only: Tuple[str, ...],
+        name: Optional[str] = None,
+        host: Optional[str] = None,
+        has_mac: Optional[bool] = None,
+        has_credentials: Optional[bool] = None,
+) -> Query:
+    columns = [getattr(Target, field) for field in only if field not in ('id', 'credentials')]
+    if 'credentials' in only:
+        query = Target.select(Target.id, Target.credentials, *columns, Credentials) \
+            .join(Credentials, JOIN.LEFT_OUTER)
+    else:
+        query = Target.select(Target.id, *columns)
+    if name:
+        # case sensitive prefix by a range, so the index of the name is used. `startswith` is ILIKE on postgres
+        query = query.where((Target.name >= name) & (Target.name < name + PREFIX_END))
+    if host:
+        query = query.where(Target.host == host)
+    if has_mac is not None:
+        no_mac = Target.mac.is_null() | (Target.mac == '')
+        query = query.where(~no_mac if has_mac else no_mac)
+    if has_credentials is not None:
+        query = query.where(Target.credentials.is_null(not has_credentials))
+    return query
+
+
+def get_targets_page(
+        limit: int,
+        after: Optional[int] = None,
+        only: Optional[str] = None,
+        **filters,
+) -> Tuple[List[dict], Optional[int]]:
+    """a page of targets, ordered by id. the next page starts after the last id of this one.
+
+    :param limit: max count of targets.
+    :param after: id of the last target of the previous page.
+    :param only: comma separated fields. all by default.
+    :param filters: `name` (prefix), `host`, `has_mac`, `has_credentials`.
+    :return: targets and `after` for the next page, if there is one.
+    :raises ValueError: unknown fields.
+    """
+    only = _parse_fields(only, TARGET_FIELDS)
+    schema = _projected_target_schema(only)
+    targets = list(_keyset_page(_select_targets(only, **filters), Target, after, limit))
+    next_after = targets[limit - 1].id if len(targets) > limit else None
+    return schema.dump_many(targets[:limit]), next_after
+
+
+def iter_targets(after: Optional[int] = None, only: Optional[str] = None, **filters) -> Iterator[dict]:
+    """all targets one by one, ordered by id. rows aren't kept in memory, so it fits for big exports.
+
+    see `get_targets_page` for parameters.
+    """
+    only = _parse_fields(only, TARGET_FIELDS)
+    schema = _projected_target_schema(only)
+    query = _keyset_page(_select_targets(only, **filters), Target, after, None)
+    return (schema.dump(target) for target in iter_query(query))
 
 
 def delete_target_by_id(id_: int) -> None:
-    _delete_object(Target, id_)
+    # sqlite doesn't cascade without the foreign keys pragma
+    with Target._meta.database.atomic():
+        WakeUpSchedule.delete().where(WakeUpSchedule.target == id_).execute()
+        _delete_object(Target, id_)
+    wakeup_scheduler.refresh()
 
 
 def edit_target_by_id(id_: int, **kwargs) -> None:
@@ -97,11 +329,169 @@ def wakeup_target_by_id(id_: int) -> None:
     wakeup_host(target.mac, port=target.wol_port)
 
 
-def check_target_by_id(id_: int) -> bool:
+def _find_targets(ids: List[int], names: List[str]) -> List[Tuple[str, Any, Optional[Target]]]:
+    """(`id` or `name`, requested value, found target) for each requested id and name."""
+    query = Target.select().where(Target.id.in_(ids) | Target.name.in_(names))
+    by_id = {target.id: target for target in query}
+    by_name = {target.name: target for target in by_id.values()}
+    requested = [('id', id_, by_id.get(id_)) for id_ in ids]
+    requested += [('name', name, by_name.get(name)) for name in names]
+    return requested
+
+
+def wakeup_targets(
+        ids: List[int],
+        names: List[str],
+        repeat: int = 1,
+        rate: Optional[float] = None,
+        interval: float = 0,
+) -> List[dict]:
+    """wakeup targets found by ids and names at once.
+
+    :return: sending result for each requested id and name.
+    """
+    results = []
+    to_wakeup = {}
+    for key, value, target in _find_targets(ids, names):
+        if not target:
+            results.append({key: value, 'sent': False, 'error': 'not found'})
+        elif not target.mac:
+            results.append({'id': target.id, 'name': target.name, 'sent': False, 'error': 'empty mac'})
+        else:
+            result = {'id': target.id, 'name': target.name}
+            to_wakeup.setdefault(target.id, (target, []))[1].append(result)
+            results.append(result)
+
+    wakeup_results = wakeup_hosts(
+        [WakeupTarget(mac=target.mac, port=target.wol_port or 9) for target, _ in to_wakeup.values()],
+        repeat=repeat,
+        rate=rate,
+        interval=interval,
+    )
+    # the same target can be requested by id and by name, but it is woken up once
+    for (_, target_results), wakeup_result in zip(to_wakeup.values(), wakeup_results):
+        for result in target_results:
+            result.update(wakeup_result)
+    return results
+
+
+def _boot_target(target: Target) -> BootTarget:
+    return BootTarget(WakeupTarget(mac=target.mac, port=target.wol_port or 9), target.host,
+                      {'id': target.id, 'name': target.name})
+
+
+def wake_and_wait_target_by_id(id_: int, **kwargs) -> Iterator[dict]:
+    """wakeup the target and wait, until it's reachable. see `iter_wake_and_wait`."""
+    target = get_object_or_404(Target, Target.id == id_)
+    for attr in ('mac', 'host'):
+        if not getattr(target, attr):
+            abort(make_response({'error': f'empty {attr}'}, 400))
+    return iter_wake_and_wait([_boot_target(target)], **kwargs)
+
+
+def wake_and_wait_targets(ids: List[int], names: List[str], **kwargs) -> Iterator[dict]:
+    """wakeup targets found by ids and names at once and wait, until they are reachable.
+
+    :return: events of `iter_wake_and_wait`. results of the `done` event are for found targets
+        and then for not found ones and ones without mac or host.
+    """
+    errors = []
+    to_wakeup = {}
+    for key, value, target in _find_targets(ids, names):
+        if not target:
+            errors.append({key: value, 'sent': False, 'up': False, 'error': 'not found'})
+        elif not target.mac or not target.host:
+            error = 'empty mac' if not target.mac else 'empty host'
+            errors.append({'id': target.id, 'name': target.name, 'sent': False, 'up': False, 'error': error})
+        else:
+            to_wakeup.setdefault(target.id, _boot_target(target))
+    # targets are found before the first event, so the database isn't used while waiting
+    return _with_errors(iter_wake_and_wait(list(to_wakeup.values()), **kwargs), errors)
+
+
+def _with_errors(events: Iterator[dict], errors: List[dict]) -> Iterator[dict]:
+    for event in events:
+        if event['event'] == 'done':
+            event['results'] += errors
+        yield event
+
+
+def check_target_by_id(id_: int, fresh: bool = False) -> dict:
+    """status of the target. the cached one is used, if it's actual and not `fresh`."""
     target = get_object_or_404(Target, Target.id == id_)
     if not target.host:
         abort(make_response({'error': 'empty host'}, 400))
-    return check_host(target.host)
+    statuses = status_monitor.check([target], fresh=fresh)
+    return statuses[target.id].as_dict()
+
+
+def check_all_targets(fresh: bool = False, **kwargs) -> List[dict]:
+    """statuses of all targets. not cached ones are checked concurrently.
+
+    :param fresh: check all targets right now, ignoring the cache.
+    :param kwargs: options for `check_hosts`. statuses by options, other than the monitor ones, are not cached.
+    """
+    targets = list(Target.select(Target.id, Target.name, Target.host))
+    statuses = status_monitor.check(targets, fresh=fresh, **kwargs)
+    results = []
+    for target in targets:
+        result = {'id': target.id, 'name': target.name, 'host': target.host}
+        if target.host:
+            result.update(statuses[target.id].as_dict())
+        else:
+            result.update(reached=False, error='empty host')
+        results.append(result)
+    return results
+
+
+def get_targets_statuses(ids: List[int]) -> Dict[int, dict]:
+    """cached statuses of targets, without checking."""
+    return {id_: status.as_dict() for id_, status in status_monitor.cache.get_many(ids).items()}
+
+
+def _run_on_targets(fleet_action, ids: List[int], **kwargs) -> List[dict]:
+    query = Target.select(Target, Credentials).join(Credentials, JOIN.LEFT_OUTER).where(Target.id.in_(ids))
+    by_id = {target.id: target for target in query}
+
+    results = {}
+    to_run = []
+    for id_ in dict.fromkeys(ids):
+        target = by_id.get(id_)
+        if not target:
+            results[id_] = {'id': id_, 'done': False, 'error': fleet_error(ERROR_NOT_FOUND, 'not found')}
+        elif not target.host:
+            results[id_] = {'id': id_, 'name': target.name, 'done': False,
+                            'error': fleet_error(ERROR_NOT_READY, 'empty host')}
+        elif not target.credentials:
+            results[id_] = {'id': id_, 'name': target.name, 'done': False,
+                            'error': fleet_error(ERROR_NOT_READY, 'empty credentials')}
+        else:
+            to_run.append(target)
+
+    creds_list = [SshCredentials(host=target.host, login=target.credentials.username,
+                                 password=target.credentials.password, pkey=target.credentials.pkey)
+                  for target in to_run]
+    for target, result in zip(to_run, fleet_action(creds_list, **kwargs)):
+        results[target.id] = {'id': target.id, 'name': target.name, **result}
+    return [results[id_] for id_ in dict.fromkeys(ids)]
+
+
+def reboot_targets(ids: List[int], **kwargs) -> List[dict]:
+    """reboot targets in parallel waves.
+
+    :param kwargs: options for `reboot_fleet`.
+    :return: result for each target.
+    """
+    return _run_on_targets(reboot_fleet, ids, **kwargs)
+
+
+def shutdown_targets(ids: List[int], **kwargs) -> List[dict]:
+    """shutdown targets in parallel waves.
+
+    :param kwargs: options for `shutdown_fleet`.
+    :return: result for each target.
+    """
+    return _run_on_targets(shutdown_fleet, ids, **kwargs)
 
 
 def create_credentials(
@@ -115,7 +505,7 @@ def create_credentials(
 
 def get_credentials_by_id(id_: int) -> dict:
     credentials = get_object_or_404(Credentials, Credentials.id == id_)
-    return CredentialsSchema().dump(credentials)
+    return credentials_schema.dump(credentials)
 
 
 def get_all_credentials() -> List[dict]:
@@ -123,6 +513,40 @@ def get_all_credentials() -> List[dict]:
     return list(qs.dicts())
 
 
+def _select_credentials(only: Tuple[str, ...], username: Optional[str] = None) -> Query:
+    query = Credentials.select(*[getattr(Credentials, field) for field in only])
+    if username:
+        # case insensitive prefix
+        query = query.where(Credentials.username.startswith(username))
+    return query.dicts()
+
+
+def get_credentials_page(
+        limit: int,
+        after: Optional[int] = None,
+        only: Optional[str] = None,
+        username: Optional[str] = None,
+) -> Tuple[List[dict], Optional[int]]:
+    """a page of credentials, ordered by id. see `get_targets_page`."""
+    only = _parse_fields(only, CREDENTIALS_FIELDS)
+    # the id is needed for the next page
+    query = _select_credentials(tuple({'id', *only}), username)
+    rows = list(_keyset_page(query, Credentials, after, limit))
+    next_after = rows[limit - 1]['id'] if len(rows) > limit else None
+    return [{field: row[field] for field in only} for row in rows[:limit]], next_after
+
+
+def iter_credentials(
+        after: Optional[int] = None,
+        only: Optional[str] = None,
+        username: Optional[str] = None,
+) -> Iterator[dict]:
+    """all credentials one by one, ordered by id. see `iter_targets`."""
+    only = _parse_fields(only, CREDENTIALS_FIELDS)
+    query = _keyset_page(_select_credentials(only, username), Credentials, after, None)
+    return iter_query(query)
+
+
 def delete_credentials_by_id(id_: int) -> None:
     _delete_object(Credentials, id_)
 
@@ -131,5 +555,57 @@ def edit_credentials_by_id(id_: int, **kwargs) -> None:
     _edit_object_by_id(Credentials, id_, **kwargs)
 
 
-for schema in (CredentialsSchema, TargetSchema):
+def _check_target_exists(id_: int) -> None:
+    if not Target.select().where(Target.id == id_).exists():
+        raise ValidationError({'target': ['not found']})
+
+
+def create_schedule(
+        target: int,
+        cron: str,
+        enabled: bool = True,
+        jitter: int = 0,
+        misfire_grace: int = 300,
+) -> int:
+    _check_target_exists(target)
+    schedule = WakeUpSchedule.create(target=target, cron=cron, enabled=enabled, jitter=jitter,
+                                     misfire_grace=misfire_grace)
+    wakeup_scheduler.refresh()
+    return schedule.id
+
+
+def get_schedule_by_id(id_: int) -> dict:
+    schedule = get_object_or_404(WakeUpSchedule.select().dicts(), WakeUpSchedule.id == id_)
+    return schedule_schema.dump(schedule)
+
+
+def get_all_schedules(target: Optional[int] = None) -> List[dict]:
+    query = WakeUpSchedule.select().order_by(WakeUpSchedule.id)
+    if target is not None:
+        query = query.where(WakeUpSchedule.target == target)
+    return schedule_schema.dump_many(query.dicts())
+
+
+def edit_schedule_by_id(id_: int, **kwargs) -> None:
+    """the scheduler reloads the schedule by the changed `updated_at`."""
+    if 'target' in kwargs:
+        _check_target_exists(kwargs['target'])
+    _edit_object_by_id(WakeUpSchedule, id_, updated_at=time.time(), **kwargs)
+    wakeup_scheduler.refresh()
+
+
+def delete_schedule_by_id(id_: int) -> None:
+    _delete_object(WakeUpSchedule, id_)
+    wakeup_scheduler.refresh()
+
+
+def get_scheduler_stats() -> dict:
+    """state of the scheduler of this process."""
+    return wakeup_scheduler.stats()
+
+
+for schema in (CredentialsSchema, TargetSchema, BatchWakeupTargetsSchema, WakeAndWaitSchema,
+               BatchWakeAndWaitSchema, CheckTargetSchema,
+               CheckTargetsSchema, FleetActionSchema, TargetsQuerySchema, CredentialsQuerySchema,
+               ScheduleSchema, SchedulesQuerySchema):
     exclude_parent_attrs(schema)
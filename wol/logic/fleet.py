@@ -0,0 +1,133 @@
+"""
+remote operations over many hosts in parallel and in waves.
+"""
+
+import math
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import (
+    Callable,
+    Dict,
+    List,
+    Optional,
+    Sequence,
+)
+
+from .core import (
+    RemoteExecError,
+    SshCredentials,
+    reboot_host,
+    shutdown_host,
+)
+from .probe import METHOD_TCP, check_hosts
+
+__all__ = ['run_on_fleet', 'reboot_fleet', 'shutdown_fleet', 'fleet_error', 'WAIT_UP', 'WAIT_DOWN',
+           'ERROR_SKIPPED', 'ERROR_NOT_FOUND', 'ERROR_NOT_READY']
+
+WAIT_UP = 'up'
+WAIT_DOWN = 'down'
+
+# codes of errors of results besides the ssh ones (`ERROR_*` of `wol.logic.core`)
+ERROR_SKIPPED = 3
+ERROR_NOT_FOUND = 4
+# e.g. a target without host
+ERROR_NOT_READY = 5
+
+
+def fleet_error(code: int, reason: str) -> dict:
+    """error of a result, the same as of `RemoteExecError`."""
+    return {'code': code, 'reason': reason, 'details': {}}
+
+
+def run_on_fleet(
+        creds_list: Sequence[SshCredentials],
+        action: Callable[[SshCredentials], None],
+        parallelism: int = 10,
+        wave_percent: float = 100,
+        max_failures: Optional[int] = None,
+        wait_for: Optional[str] = None,
+        wait_timeout: float = 300,
+        wait_port: int = 22,
+) -> List[dict]:
+    """run the action on hosts wave by wave. hosts of a wave are processed in parallel.
+
+    :param creds_list: hosts.
+    :param action: remote operation for one host, e.g. `reboot_host`.
+    :param parallelism: max count of hosts processed at the same time.
+    :param wave_percent: size of a wave in percent of all hosts.
+    :param max_failures: skip the remaining waves, when count of failed hosts is exceeded.
+    :param wait_for: `up` - wait until hosts of a wave are down and back up, `down` - until they are down,
+        before the next wave.
+    :param wait_timeout: seconds to wait for hosts of a wave.
+    :param wait_port: tcp port for checking the host state.
+    :return: result for each host in the same order.
+    """
+    wave_size = max(math.ceil(len(creds_list) * wave_percent / 100), 1)
+    results = [{'host': creds.host, 'done': False} for creds in creds_list]
+    failures = 0
+
+    def run(index: int) -> None:
+        started = time.monotonic()
+        try:
+            action(creds_list[index])
+        except RemoteExecError as e:
+            results[index]['error'] = e.as_dict()
+        else:
+            results[index]['done'] = True
+        results[index]['elapsed'] = time.monotonic() - started
+
+    with ThreadPoolExecutor(max_workers=max(min(parallelism, wave_size), 1)) as executor:
+        for wave, first in enumerate(range(0, len(creds_list), wave_size)):
+            indexes = range(first, min(first + wave_size, len(creds_list)))
+            if max_failures is not None and failures > max_failures:
+                for i in indexes:
+                    results[i].update(wave=wave, error=fleet_error(ERROR_SKIPPED, 'too many failures'))
+                continue
+
+            list(executor.map(run, indexes))
+            done = [i for i in indexes if results[i]['done']]
+            if wait_for and done:
+                states = _wait_hosts([creds_list[i].host for i in done], wait_for, wait_timeout, wait_port)
+                for i in done:
+                    results[i]['reached_state'] = states[creds_list[i].host]
+            for i in indexes:
+                results[i]['wave'] = wave
+                failures += not results[i]['done'] or results[i].get('reached_state') is False
+    return results
+
+
+def _wait_hosts(
+        hosts: List[str],
+        wait_for: str,
+        timeout: float,
+        port: int,
+        poll_interval: float = 2,
+) -> Dict[str, bool]:
+    """wait until hosts are in the state. for `up` hosts must go down before."""
+    deadline = time.monotonic() + timeout
+    went_down = dict.fromkeys(hosts, wait_for == WAIT_DOWN)
+    reached = dict.fromkeys(hosts, False)
+    pending = hosts
+    while pending and time.monotonic() < deadline:
+        online = check_hosts(pending, port=port, method=METHOD_TCP, timeout=poll_interval)
+        for host in pending:
+            if not online[host]:
+                went_down[host] = True
+            if wait_for == WAIT_DOWN:
+                reached[host] = not online[host]
+            else:
+                reached[host] = went_down[host] and online[host]
+        pending = [host for host in pending if not reached[host]]
+        if pending:
+            time.sleep(max(min(poll_interval, deadline - time.monotonic()), 0))
+    return reached
+
+
+def reboot_fleet(creds_list: Sequence[SshCredentials], wait: bool = False, **kwargs) -> List[dict]:
+    """reboot hosts. with `wait` every wave waits until its hosts are back up."""
+    return run_on_fleet(creds_list, reboot_host, wait_for=WAIT_UP if wait else None, **kwargs)
+
+
+def shutdown_fleet(creds_list: Sequence[SshCredentials], wait: bool = False, **kwargs) -> List[dict]:
+    """shutdown hosts. with `wait` every wave waits until its hosts are down."""
+    return run_on_fleet(creds_list, shutdown_host, wait_for=WAIT_DOWN if wait else None, **kwargs)
@@ -0,0 +1,158 @@
+"""
+bulk import and export of targets in csv and json.
+"""
+
+import csv
+import io
+import json
+from typing import (
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    Tuple,
+)
+
+from marshmallow import Schema, ValidationError, fields
+
+from ..doc_utils import exclude_parent_attrs
+from ..fields import HostField, MacField, PortField
+from ..models import (
+    Credentials,
+    Target,
+    db,
+    iter_query,
+)
+
+__all__ = ['import_targets', 'export_targets', 'read_targets', 'TargetImportSchema', 'FORMATS', 'COLUMNS']
+
+FORMAT_CSV = 'csv'
+FORMAT_JSON = 'json'
+FORMATS = (FORMAT_CSV, FORMAT_JSON)
+COLUMNS = ('name', 'host', 'mac', 'wol_port', 'credentials_id')
+# count of reported invalid rows
+MAX_ERRORS = 100
+
+
+class TargetImportSchema(Schema):
+    """target row of the import"""
+    name = fields.Str(required=True)
+    host = HostField(missing=None)
+    mac = MacField(missing=None)
+    wol_port = PortField(missing=None)
+    credentials_id = fields.Int(missing=None)
+
+
+def read_targets(stream: Iterable[str], format_: str) -> Iterator[dict]:
+    """rows of the csv with a header or json - an array or objects line by line.
+
+    csv and json lines are read lazily, so big files don't take memory.
+    """
+    if format_ == FORMAT_CSV:
+        for row in csv.DictReader(stream):
+            # empty cells are nulls
+            yield {key: value for key, value in row.items() if key and value not in ('', None)}
+        return
+
+    lines = iter(stream)
+    for line in lines:
+        if not line.strip():
+            continue
+        if line.lstrip().startswith('['):
+            yield from json.loads(line + ''.join(lines))
+            return
+        yield json.loads(line)
+
+
+def import_targets(rows: Iterable[dict], batch_size: int = 500) -> dict:
+    """create targets by batches of inserts, each in a transaction. existing targets with the same mac are updated.
+
+    :param rows: targets as dicts of `COLUMNS`.
+    :param batch_size: count of rows in one insert.
+    :return: counts of created, updated and invalid rows and errors of the first invalid ones.
+    """
+    schema = TargetImportSchema()
+    result = {'created': 0, 'updated': 0, 'failed': 0, 'errors': []}
+    batch: List[Tuple[int, dict]] = []
+    for number, row in enumerate(rows, 1):
+        try:
+            target = schema.load(row)
+        except ValidationError as e:
+            _add_error(result, number, e.messages)
+            continue
+        target['credentials'] = target.pop('credentials_id')
+        batch.append((number, target))
+        if len(batch) >= batch_size:
+            _insert_batch(batch, result)
+            batch = []
+    if batch:
+        _insert_batch(batch, result)
+    return result
+
+
+def _add_error(result: dict, number: int, errors: dict) -> None:
+    result['failed'] += 1
+    if len(result['errors']) < MAX_ERRORS:
+        result['errors'].append({'row': number, 'errors': errors})
+
+
+def _insert_batch(targets: List[Tuple[int, dict]], result: dict) -> None:
+    credentials_ids = {target['credentials'] for _, target in targets if target['credentials']}
+    if credentials_ids:
+        credentials_ids = {row.id for row in Credentials.select(Credentials.id)
+                           .where(Credentials.id.in_(list(credentials_ids)))}
+
+    # the same mac can't be upserted twice by one insert, the last row wins
+    by_mac: Dict[str, Tuple[int, dict]] = {}
+    without_mac = []
+    for number, target in targets:
+        if target['credentials'] and target['credentials'] not in credentials_ids:
+            _add_error(result, number, {'credentials_id': ['not found']})
+        elif target['mac']:
+            if target['mac'] in by_mac:
+                _add_error(result, by_mac[target['mac']][0], {'mac': [f'duplicate of row {number}']})
+            by_mac[target['mac']] = (number, target)
+        else:
+            without_mac.append(target)
+
+    with db.database.atomic():
+        existing = set()
+        if by_mac:
+            existing = {row.mac for row in Target.select(Target.mac).where(Target.mac.in_(list(by_mac)))}
+            Target.insert_many([target for _, target in by_mac.values()]).on_conflict(
+                conflict_target=[Target.mac],
+                preserve=[Target.name, Target.host, Target.wol_port, Target.credentials],
+            ).execute()
+        if without_mac:
+            Target.insert_many(without_mac).execute()
+    result['updated'] += len(existing)
+    result['created'] += len(by_mac) - len(existing) + len(without_mac)
+
+
+def export_targets(format_: str) -> Iterator[str]:
+    """all targets, ordered by id, as chunks of csv with a header or a json array.
+
+    rows are read by a cursor, so the export doesn't take memory.
+    """
+    query = Target.select(Target.name, Target.host, Target.mac, Target.wol_port, Target.credentials) \
+        .order_by(Target.id).tuples()
+    if format_ == FORMAT_CSV:
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        writer.writerow(COLUMNS)
+        for row in iter_query(query):
+            writer.writerow(row)
+            if buffer.tell() > 2**16:
+                yield buffer.getvalue()
+                buffer.seek(0)
+                buffer.truncate()
+        yield buffer.getvalue()
+        return
+
+    yield '['
+    for i, row in enumerate(iter_query(query)):
+        yield (',\n' if i else '\n') + json.dumps(dict(zip(COLUMNS, row)))
+    yield '\n]\n'
+
+
+exclude_parent_attrs(TargetImportSchema)
@@ -0,0 +1,231 @@
+"""
+background jobs for long operations, so web workers don't wait for them.
+"""
+
+import logging
+import queue
+import threading
+import time
+import uuid
+from contextlib import ExitStack
+from datetime import datetime, timezone
+from typing import (
+    Callable,
+    Dict,
+    List,
+    Optional,
+)
+
+from .core import RemoteExecError
+
+__all__ = ['Job', 'JobError', 'JobQueue', 'JobQueueFull', 'job_queue',
+           'STATUS_QUEUED', 'STATUS_RUNNING', 'STATUS_DONE', 'STATUS_FAILED', 'STATUS_CANCELLED']
+
+logger = logging.getLogger(__name__)
+
+STATUS_QUEUED = 'queued'
+STATUS_RUNNING = 'running'
+STATUS_DONE = 'done'
+STATUS_FAILED = 'failed'
+STATUS_CANCELLED = 'cancelled'
+FINISHED = (STATUS_DONE, STATUS_FAILED, STATUS_CANCELLED)
+
+
+class JobQueueFull(Exception):
+    """the queue has no room for a new job."""
+
+
+class JobError(Exception):
+    """failure of a job with the error for clients."""
+
+    def __init__(self, error: dict):
+        super().__init__(error)
+        self.error = error
+
+
+class Job:
+    """one call of a function in background.
+
+    a running job can't be interrupted - after the cancellation its result is dropped.
+    """
+
+    def __init__(self, name: str, func: Callable, *args, **kwargs):
+        self.id = uuid.uuid4().hex  # noqa: A003, VNE003
+        self.name = name
+        self.status = STATUS_QUEUED
+        self.result = None
+        self.error: Optional[dict] = None
+        self.created_at = time.time()
+        self.started_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+        self._call = (func, args, kwargs)
+        self._cancel_requested = False
+        self._finished = threading.Event()
+        self._lock = threading.Lock()
+
+    @property
+    def finished(self) -> bool:
+        return self._finished.is_set()
+
+    def wait(self, timeout: Optional[float] = None) -> bool:
+        """wait until the job is finished. returns False on timeout."""
+        return self._finished.wait(timeout)
+
+    def cancel(self) -> bool:
+        """cancel the job. returns False, if it's already finished."""
+        with self._lock:
+            if self.status in FINISHED:
+                return False
+            if self.status == STATUS_QUEUED:
+                self._finish(STATUS_CANCELLED)
+            else:
+                self._cancel_requested = True
+            return True
+
+    def run(self) -> None:
+        with self._lock:
+            if self.status != STATUS_QUEUED:
+                return
+            self.status = STATUS_RUNNING
+            self.started_at = time.time()
+
+        func, args, kwargs = self._call
+        result, error = None, None
+        try:
+            result = func(*args, **kwargs)
+        except RemoteExecError as e:
+            error = e.as_dict()
+        except JobError as e:
+            error = e.error
+        except NotImplementedError:
+            error = {'reason': 'not implemented'}
+        except Exception as e:
+            logger.exception("job %s (%s) failed", self.id, self.name)
+            error = {'reason': repr(e)}
+
+        with self._lock:
+            if self._cancel_requested:
+                self._finish(STATUS_CANCELLED)
+            elif error:
+                self.error = error
+                self._finish(STATUS_FAILED)
+            else:
+                self.result = result
+                self._finish(STATUS_DONE)
+
+    def _finish(self, status: str) -> None:
+        self.status = status
+        self.finished_at = time.time()
+        self._call = None
+        self._finished.set()
+
+    def as_dict(self) -> dict:
+        data = {
+            'id': self.id,
+            'name': self.name,
+            'status': self.status,
+            'created_at': _isoformat(self.created_at),
+            'started_at': _isoformat(self.started_at),
+            'finished_at': _isoformat(self.finished_at),
+            # seconds in the queue and in the work
+            'wait_time': (self.started_at or self.finished_at or time.time()) - self.created_at,
+            'run_time': (self.finished_at or time.time()) - self.started_at if self.started_at else None,
+        }
+        if self.status == STATUS_DONE:
+            data['result'] = self.result
+        elif self.status == STATUS_FAILED:
+            data['error'] = self.error
+        return data
+
+
+def _isoformat(timestamp: Optional[float]) -> Optional[str]:
+    return datetime.fromtimestamp(timestamp, timezone.utc).isoformat() if timestamp else None
+
+
+class JobQueue:
+    """bounded queue of jobs, executed by a pool of threads.
+
+    jobs run in the flask app context with a database connection, like flask views.
+
+    :param workers: count of threads. they are started by the first job.
+    :param max_size: max count of queued jobs. `submit` raises `JobQueueFull` above it.
+    :param keep: seconds to keep finished jobs for polling.
+    """
+
+    def __init__(self, workers: int = 4, max_size: int = 100, keep: float = 300):
+        self.workers = workers
+        self.max_size = max_size
+        self.keep = keep
+        # the flask app for `abort`, `make_response`, etc. and its database, if it's used
+        self.app = None
+        self.database = None
+        self._queue: Optional[queue.Queue] = None
+        self._jobs: Dict[str, Job] = {}
+        self._threads: List[threading.Thread] = []
+        self._lock = threading.Lock()
+
+    def submit(self, name: str, func: Callable, *args, **kwargs) -> Job:
+        """put the call of `func` to the queue."""
+        job = Job(name, func, *args, **kwargs)
+        with self._lock:
+            self._prune()
+            self._start()
+            try:
+                self._queue.put_nowait(job)
+            except queue.Full:
+                raise JobQueueFull
+            self._jobs[job.id] = job
+        return job
+
+    def get(self, id_: str) -> Optional[Job]:
+        with self._lock:
+            return self._jobs.get(id_)
+
+    def size(self) -> int:
+        """count of queued jobs."""
+        return self._queue.qsize() if self._queue else 0
+
+    def stop(self) -> None:
+        """cancel queued jobs and stop workers after the running ones."""
+        with self._lock:
+            for job in self._jobs.values():
+                if job.status == STATUS_QUEUED:
+                    job.cancel()
+            for _ in self._threads:
+                self._queue.put(None)
+            self._threads = []
+            self._queue = None
+
+    def _start(self) -> None:
+        if self._threads:
+            return
+        self._queue = queue.Queue(self.max_size)
+        for i in range(self.workers):
+            thread = threading.Thread(target=self._work, args=(self._queue,), name=f'job-worker-{i}', daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def _work(self, jobs: queue.Queue) -> None:
+        while True:
+            job = jobs.get()
+            if job is None:
+                return
+            with self._context():
+                job.run()
+
+    def _context(self) -> ExitStack:
+        stack = ExitStack()
+        if self.app is not None:
+            stack.enter_context(self.app.app_context())
+        if self.database is not None:
+            stack.enter_context(self.database.connection_context())
+        return stack
+
+    def _prune(self) -> None:
+        border = time.time() - self.keep
+        for id_ in [id_ for id_, job in self._jobs.items() if job.finished and job.finished_at < border]:
+            del self._jobs[id_]
+
+
+job_queue = JobQueue()
+"""jobs of the api."""
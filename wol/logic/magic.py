@@ -0,0 +1,190 @@
+"""
+magic packets sender with cached payloads and long-lived sockets.
+"""
+
+import atexit
+import ipaddress
+import socket
+import threading
+import time
+from dataclasses import dataclass
+from functools import lru_cache
+from typing import (
+    Dict,
+    Iterable,
+    List,
+    Optional,
+    Tuple,
+)
+
+__all__ = ['WakeupTarget', 'make_magic_packet', 'MagicSender', 'magic_sender']
+
+# SO_BINDTODEVICE is not exported by the socket module on some python versions
+SO_BINDTODEVICE = getattr(socket, 'SO_BINDTODEVICE', 25)
+
+
+@dataclass
+class WakeupTarget:
+    mac: str
+    host: str = '255.255.255.255'
+    port: int = 9
+    iface: Optional[str] = None
+    password: Optional[str] = None
+
+
+def _parse_hex(value: str, sizes: Tuple[int, ...], what: str) -> bytes:
+    digits = value.replace(':', '').replace('-', '').replace('.', '')
+    try:
+        data = bytes.fromhex(digits)
+    except ValueError:
+        data = b''
+    if len(data) not in sizes:
+        raise ValueError(f'"{value}" is not a valid {what}')
+    return data
+
+
+@lru_cache(maxsize=4096)
+def make_magic_packet(mac: str, password: Optional[str] = None) -> bytes:
+    """6 bytes of 0xFF, 16 times the mac and SecureOn password (4 or 6 bytes in hex), if set."""
+    packet = b'\xff' * 6 + _parse_hex(mac, (6,), 'mac') * 16
+    if password:
+        packet += _parse_hex(password, (4, 6), 'SecureOn password')
+    return packet
+
+
+class MagicSender:
+    """sends magic packets through one UDP socket per address family and interface.
+
+    sockets are opened by the first packet and kept open. a socket is reopened after a sending error.
+    binding to an interface needs CAP_NET_RAW on linux.
+    """
+
+    def __init__(self):
+        self._sockets: Dict[Tuple[int, Optional[str]], socket.socket] = {}
+        self._lock = threading.Lock()
+
+    def send(
+            self,
+            mac: str,
+            host: str = '255.255.255.255',
+            port: int = 9,
+            iface: Optional[str] = None,
+            password: Optional[str] = None,
+    ) -> None:
+        """send one packet. `host` can be IPv4 (broadcast) or IPv6 (multicast, e.g. ff02::1) address.
+
+        :raises ValueError: bad mac or password.
+        :raises OSError: the packet is not sent.
+        """
+        packet = make_magic_packet(mac, password)
+        family, address = _resolve(host, port, iface)
+        sock = self._socket(family, iface)
+        try:
+            sock.sendto(packet, address)
+        except OSError:
+            self._drop(family, iface, sock)
+            raise
+
+    def send_many(
+            self,
+            targets: Iterable[WakeupTarget],
+            repeat: int = 1,
+            interval: float = 0,
+            rate: Optional[float] = None,
+    ) -> List[dict]:
+        """send packets to many hosts. all packets are built up front.
+
+        :param targets: hosts to wakeup.
+        :param repeat: how many times to send every packet.
+        :param interval: seconds between repeats.
+        :param rate: max count of packets per second. unlimited, if not set.
+        :return: sending result for each target in the same order.
+        """
+        results = []
+        packets = []
+        for target in targets:
+            result = {'mac': target.mac, 'sent': False}
+            try:
+                packet = make_magic_packet(target.mac, target.password)
+                family, address = _resolve(target.host, target.port, target.iface)
+            except (ValueError, OSError) as e:
+                result['error'] = str(e)
+            else:
+                packets.append((packet, family, target.iface, address, result))
+            results.append(result)
+
+        pause = 1 / rate if rate else 0
+        next_send = time.monotonic()
+        for i in range(repeat):
+            if i and interval:
+                time.sleep(interval)
+            for packet, family, iface, address, result in packets:
+                if pause:
+                    delay = next_send - time.monotonic()
+                    if delay > 0:
+                        time.sleep(delay)
+                    next_send = max(next_send, time.monotonic()) + pause
+                try:
+                    sock = self._socket(family, iface)
+                    sock.sendto(packet, address)
+                except OSError as e:
+                    self._drop(family, iface)
+                    result['error'] = str(e)
+                else:
+                    result['sent'] = True
+        return results
+
+    def close(self) -> None:
+        with self._lock:
+            for sock in self._sockets.values():
+                sock.close()
+            self._sockets.clear()
+
+    def _socket(self, family: int, iface: Optional[str]) -> socket.socket:
+        key = (family, iface)
+        with self._lock:
+            sock = self._sockets.get(key)
+            if sock is None:
+                sock = self._sockets[key] = _open_socket(family, iface)
+            return sock
+
+    def _drop(self, family: int, iface: Optional[str], sock: Optional[socket.socket] = None) -> None:
+        with self._lock:
+            current = self._sockets.get((family, iface))
+            if current is not None and (sock is None or current is sock):
+                del self._sockets[(family, iface)]
+                current.close()
+
+
+def _open_socket(family: int, iface: Optional[str]) -> socket.socket:
+    sock = socket.socket(family, socket.SOCK_DGRAM)
+    try:
+        if family == socket.AF_INET:
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_BROADCAST, 1)
+        elif iface:
+            sock.setsockopt(socket.IPPROTO_IPV6, socket.IPV6_MULTICAST_IF, socket.if_nametoindex(iface))
+        if iface:
+            sock.setsockopt(socket.SOL_SOCKET, SO_BINDTODEVICE, iface.encode())
+    except OSError:
+        sock.close()
+        raise
+    return sock
+
+
+def _resolve(host: str, port: int, iface: Optional[str]) -> Tuple[int, tuple]:
+    """address family and socket address of the host."""
+    try:
+        address = ipaddress.ip_address(host)
+    except ValueError:
+        family, *_, sockaddr = socket.getaddrinfo(host, port, type=socket.SOCK_DGRAM)[0]
+        return family, sockaddr
+    if address.version == 4:
+        return socket.AF_INET, (host, port)
+    # link-local and multicast addresses need the interface
+    scope_id = socket.if_nametoindex(iface) if iface else 0
+    return socket.AF_INET6, (host, port, 0, scope_id)
+
+
+magic_sender = MagicSender()
+"""sender, shared by the api and the cli."""
+atexit.register(magic_sender.close)
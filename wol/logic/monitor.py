@@ -0,0 +1,154 @@
+"""
+cached reachability of targets, refreshed in background.
+"""
+
+import logging
+import threading
+import time
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from inspect import signature
+from typing import Dict, Iterable, Optional
+
+from ..models import Target, TargetStatus, db
+from .probe import check_hosts
+
+__all__ = ['HostStatus', 'MemoryStatusCache', 'DbStatusCache', 'StatusMonitor', 'status_monitor']
+
+logger = logging.getLogger(__name__)
+
+# options of `check_hosts`, which change statuses, with their defaults
+RESULT_OPTIONS = {name: param.default for name, param in signature(check_hosts).parameters.items()
+                  if name in ('port', 'method', 'timeout')}
+
+
+@dataclass
+class HostStatus:
+    reached: bool
+    checked_at: float
+
+    def as_dict(self) -> dict:
+        return {
+            'reached': self.reached,
+            'checked_at': datetime.fromtimestamp(self.checked_at, timezone.utc).isoformat(),
+        }
+
+
+class MemoryStatusCache:
+    """statuses by target id in the process memory.
+
+    :param ttl: seconds, while a status is actual.
+    """
+
+    def __init__(self, ttl: float = 60):
+        self.ttl = ttl
+        self._statuses: Dict[int, HostStatus] = {}
+        self._lock = threading.Lock()
+
+    def get_many(self, ids: Iterable[int]) -> Dict[int, HostStatus]:
+        border = time.time() - self.ttl
+        with self._lock:
+            found = {id_: self._statuses.get(id_) for id_ in ids}
+        return {id_: status for id_, status in found.items() if status and status.checked_at > border}
+
+    def set_many(self, statuses: Dict[int, HostStatus]) -> None:
+        with self._lock:
+            self._statuses.update(statuses)
+
+    def get(self, id_: int) -> Optional[HostStatus]:
+        return self.get_many([id_]).get(id_)
+
+
+class DbStatusCache(MemoryStatusCache):
+    """statuses in the database table, shared between app workers."""
+
+    def get_many(self, ids: Iterable[int]) -> Dict[int, HostStatus]:
+        border = time.time() - self.ttl
+        query = TargetStatus.select().where(TargetStatus.target.in_(list(ids)),
+                                            TargetStatus.checked_at > border)
+        return {row.target_id: HostStatus(row.reached, row.checked_at) for row in query}
+
+    def set_many(self, statuses: Dict[int, HostStatus]) -> None:
+        if not statuses:
+            return
+        rows = [{'target': id_, 'reached': status.reached, 'checked_at': status.checked_at}
+                for id_, status in statuses.items()]
+        query = TargetStatus.insert_many(rows).on_conflict(
+            conflict_target=[TargetStatus.target],
+            preserve=[TargetStatus.reached, TargetStatus.checked_at],
+        )
+        query.execute()
+
+
+class StatusMonitor:
+    """periodically checks all targets and stores statuses into the cache.
+
+    :param cache: where to store statuses.
+    :param interval: seconds between refreshes. 0 - don't refresh in background.
+    :param probe_options: kwargs for `check_hosts`.
+    """
+
+    def __init__(self, cache: Optional[MemoryStatusCache] = None, interval: float = 0, **probe_options):
+        self.cache = cache or MemoryStatusCache()
+        self.interval = interval
+        self.probe_options = probe_options
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def check(self, targets: Iterable[Target], fresh: bool = False, **probe_options) -> Dict[int, HostStatus]:
+        """statuses of targets with host. not cached ones (or all, if `fresh`) are checked right now.
+
+        :param probe_options: kwargs for `check_hosts`, overrides the monitor ones.
+            with another port, method or timeout the cache is neither read nor updated.
+        """
+        targets = [target for target in targets if target.host]
+        options = {**self.probe_options, **probe_options}
+        cached = _result_options(options) == _result_options(self.probe_options)
+        statuses = self.cache.get_many([target.id for target in targets]) if cached and not fresh else {}
+        to_check = [target for target in targets if target.id not in statuses]
+        if to_check:
+            reached = check_hosts([target.host for target in to_check], **options)
+            now = time.time()
+            checked = {target.id: HostStatus(reached[target.host], now) for target in to_check}
+            if cached:
+                self.cache.set_many(checked)
+            statuses.update(checked)
+        return statuses
+
+    def refresh(self) -> None:
+        """check all targets."""
+        with db.database.connection_context():
+            targets = list(Target.select(Target.id, Target.host).where(Target.host.is_null(False)))
+            self.check(targets, fresh=True)
+
+    def start(self) -> None:
+        """start refreshing in a daemon thread, if the interval is set."""
+        if not self.interval or self._thread:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self.run, name='status-monitor', daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self._thread:
+            self._thread.join()
+            self._thread = None
+
+    def run(self) -> None:
+        """refresh statuses until stopped. the interval must be set."""
+        while not self._stop.is_set():
+            started = time.monotonic()
+            try:
+                self.refresh()
+            except Exception:
+                logger.exception("can't refresh targets statuses")
+            self._stop.wait(max(self.interval - (time.monotonic() - started), 0))
+
+
+def _result_options(options: dict) -> dict:
+    return {name: options.get(name, default) for name, default in RESULT_OPTIONS.items()}
+
+
+status_monitor = StatusMonitor()
+"""statuses of targets, used by the CRUD api and pages."""
@@ -0,0 +1,255 @@
+"""
+table of hosts seen in the local net, refreshed incrementally.
+"""
+
+import ipaddress
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from typing import (
+    Dict,
+    Iterable,
+    List,
+    Optional,
+    Sequence,
+)
+
+from .core import (
+    LocalNet,
+    _can_use_scapy,
+    _load_scapy,
+    arping_addresses,
+    get_nets,
+)
+
+try:
+    from ..models import Neighbor as NeighborModel
+except ImportError:
+    NeighborModel = None
+
+__all__ = ['Neighbor', 'MemoryNeighborTable', 'DbNeighborTable', 'NeighborScanner', 'neighbor_scanner',
+           'read_kernel_neighbors', 'SCAN_MODES']
+
+logger = logging.getLogger(__name__)
+
+KERNEL_ARP_TABLE = '/proc/net/arp'
+ARP_FLAG_COMPLETE = 0x2
+EMPTY_MAC = '00:00:00:00:00:00'
+
+MODE_CACHED = 'cached'
+MODE_INCREMENTAL = 'incremental'
+MODE_FULL = 'full'
+SCAN_MODES = (MODE_CACHED, MODE_INCREMENTAL, MODE_FULL)
+
+
+@dataclass
+class Neighbor:
+    ip: str
+    mac: str
+    first_seen: float
+    last_seen: float
+    vendor: Optional[str] = None
+    iface: Optional[str] = None
+
+    def as_dict(self) -> dict:
+        return {
+            'ip': self.ip,
+            'mac': self.mac,
+            'vendor': self.vendor,
+            'iface': self.iface,
+            'first_seen': _isoformat(self.first_seen),
+            'last_seen': _isoformat(self.last_seen),
+            # seconds since the host was seen
+            'age': time.time() - self.last_seen,
+        }
+
+
+def _isoformat(timestamp: float) -> str:
+    return datetime.fromtimestamp(timestamp, timezone.utc).isoformat()
+
+
+def _lookup_vendor(mac: str) -> Optional[str]:
+    scapy = _load_scapy()
+    if scapy is None or not scapy.conf.manufdb:
+        return None
+    try:
+        vendor = scapy.conf.manufdb._get_manuf(mac)
+    except Exception:
+        return None
+    # the mac itself is returned for unknown vendors
+    return vendor if vendor and vendor != mac else None
+
+
+def read_kernel_neighbors(path: str = KERNEL_ARP_TABLE) -> List[Dict[str, str]]:
+    """complete entries (ip, mac, iface) of the kernel ARP cache. nothing, if it's not available."""
+    try:
+        with open(path) as f:
+            lines = f.readlines()[1:]
+    except OSError:
+        return []
+
+    hosts = []
+    for line in lines:
+        parts = line.split()
+        if len(parts) < 4 or not int(parts[2], 16) & ARP_FLAG_COMPLETE or parts[3] == EMPTY_MAC:
+            continue
+        hosts.append({'ip': parts[0], 'mac': parts[3], 'iface': parts[5] if len(parts) > 5 else None})
+    return hosts
+
+
+class MemoryNeighborTable:
+    """neighbors by ip in the process memory."""
+
+    def __init__(self):
+        self._neighbors: Dict[str, Neighbor] = {}
+        self._lock = threading.Lock()
+
+    def get_many(self, ips: Optional[Iterable[str]] = None) -> Dict[str, Neighbor]:
+        """neighbors with the ips or all."""
+        with self._lock:
+            if ips is None:
+                return dict(self._neighbors)
+            found = {ip: self._neighbors.get(ip) for ip in ips}
+        return {ip: neighbor for ip, neighbor in found.items() if neighbor}
+
+    def set_many(self, neighbors: Iterable[Neighbor]) -> None:
+        with self._lock:
+            self._neighbors.update((neighbor.ip, neighbor) for neighbor in neighbors)
+
+
+class DbNeighborTable(MemoryNeighborTable):
+    """neighbors in the database table, kept between restarts and shared between app workers."""
+
+    def get_many(self, ips: Optional[Iterable[str]] = None) -> Dict[str, Neighbor]:
+        if ips is None:
+            queries = [NeighborModel.select()]
+        else:
+            ips = list(ips)
+            # the count of query parameters is limited
+            queries = [NeighborModel.select().where(NeighborModel.ip.in_(ips[i:i + 500]))
+                       for i in range(0, len(ips), 500)]
+        return {row.ip: Neighbor(row.ip, row.mac, row.first_seen, row.last_seen, row.vendor, row.iface)
+                for query in queries for row in query}
+
+    def set_many(self, neighbors: Iterable[Neighbor]) -> None:
+        rows = [{'ip': neighbor.ip, 'mac': neighbor.mac, 'vendor': neighbor.vendor, 'iface': neighbor.iface,
+                 'first_seen': neighbor.first_seen, 'last_seen': neighbor.last_seen} for neighbor in neighbors]
+        for i in range(0, len(rows), 500):
+            query = NeighborModel.insert_many(rows[i:i + 500]).on_conflict(
+                conflict_target=[NeighborModel.ip],
+                preserve=[NeighborModel.mac, NeighborModel.vendor, NeighborModel.iface,
+                          NeighborModel.first_seen, NeighborModel.last_seen],
+            )
+            query.execute()
+
+
+class NeighborScanner:
+    """keeps the neighbor table actual with as few ARP requests as possible.
+
+    the kernel ARP cache is read first, then only unknown addresses and the ones,
+    not seen for `stale_after` seconds, are probed.
+
+    :param table: where to store neighbors.
+    :param stale_after: seconds, while a seen host is not probed again.
+    :param chunk_size: count of addresses in one ARP scan.
+    :param parallelism: count of chunks scanned at the same time.
+    """
+
+    def __init__(
+            self,
+            table: Optional[MemoryNeighborTable] = None,
+            stale_after: float = 300,
+            chunk_size: int = 256,
+            parallelism: int = 8,
+    ):
+        self.table = table or MemoryNeighborTable()
+        self.stale_after = stale_after
+        self.chunk_size = chunk_size
+        self.parallelism = parallelism
+
+    def scan(
+            self,
+            net: Optional[str] = None,
+            mode: str = MODE_INCREMENTAL,
+            ifaces: Optional[Sequence[str]] = None,
+    ) -> List[Neighbor]:
+        """neighbors in the net or nets of interfaces. nets are scanned concurrently.
+
+        :param net: net with mask. only the first of `ifaces` is used with it.
+        :param mode: `cached` - known neighbors without scanning, `incremental` - probe unknown
+            and stale addresses, `full` - probe all addresses.
+        :param ifaces: names or prefixes of interfaces. default - all, except docker ones.
+        :return: for `cached` - all known neighbors, otherwise - the ones, which are online.
+        """
+        if mode == MODE_CACHED:
+            neighbors = self.table.get_many().values()
+            if net:
+                network = ipaddress.ip_network(net, strict=False)
+                neighbors = [neighbor for neighbor in neighbors if ipaddress.ip_address(neighbor.ip) in network]
+            elif ifaces:
+                neighbors = [neighbor for neighbor in neighbors
+                             if neighbor.iface and neighbor.iface.startswith(tuple(ifaces))]
+            return _sorted(neighbors)
+        if not _can_use_scapy():
+            raise NotImplementedError
+
+        if net:
+            nets = [LocalNet(ifaces[0] if ifaces else None, str(ipaddress.ip_network(net, strict=False)))]
+        else:
+            nets = get_nets(ifaces)
+        if not nets:
+            return []
+        networks = [ipaddress.ip_network(local_net.net, strict=False) for local_net in nets]
+        started = time.time()
+        kernel_hosts = read_kernel_neighbors()
+        for local_net, network in zip(nets, networks):
+            self._update([host for host in kernel_hosts
+                          if ipaddress.ip_address(host['ip']) in network
+                          and (not local_net.iface or host['iface'] == local_net.iface)], started)
+
+        known = self.table.get_many() if mode == MODE_INCREMENTAL else {}
+        stale_border = started - self.stale_after
+        to_probe = []
+        for local_net, network in zip(nets, networks):
+            addresses = [str(address) for address in network.hosts()]
+            if mode == MODE_INCREMENTAL:
+                addresses = [address for address in addresses
+                             if address not in known or known[address].last_seen < stale_border]
+            logger.debug("probe %s addresses of %s", len(addresses), local_net.net)
+            to_probe.append(addresses)
+
+        # threads only probe, the table is read and written by the calling thread with its connection
+        with ThreadPoolExecutor(max_workers=len(nets)) as executor:
+            for answered in executor.map(self._probe, nets, to_probe):
+                self._update(answered, time.time())
+
+        border = started - (self.stale_after if mode == MODE_INCREMENTAL else 0)
+        return _sorted(neighbor for neighbor in self.table.get_many().values() if neighbor.last_seen >= border
+                       and any(ipaddress.ip_address(neighbor.ip) in network for network in networks))
+
+    def _probe(self, local_net: LocalNet, addresses: List[str]) -> List[Dict[str, str]]:
+        return arping_addresses(addresses, self.chunk_size, self.parallelism, iface=local_net.iface)
+
+    def _update(self, hosts: List[Dict[str, str]], seen_at: float) -> None:
+        if not hosts:
+            return
+        known = self.table.get_many(host['ip'] for host in hosts)
+        neighbors = []
+        for host in hosts:
+            previous = known.get(host['ip'])
+            # the address is taken by another host - it's a new neighbor
+            first_seen = previous.first_seen if previous and previous.mac == host['mac'] else seen_at
+            vendor = previous.vendor if previous and previous.mac == host['mac'] else _lookup_vendor(host['mac'])
+            neighbors.append(Neighbor(host['ip'], host['mac'], first_seen, seen_at, vendor, host.get('iface')))
+        self.table.set_many(neighbors)
+
+
+def _sorted(neighbors: Iterable[Neighbor]) -> List[Neighbor]:
+    return sorted(neighbors, key=lambda neighbor: ipaddress.ip_address(neighbor.ip))
+
+
+neighbor_scanner = NeighborScanner()
+"""neighbors, shared by the api."""
@@ -0,0 +1,187 @@
+"""
+keyed pool of long-lived connections (e.g. ssh sessions).
+"""
+
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+from dataclasses import dataclass
+from typing import (
+    Callable,
+    Dict,
+    Hashable,
+    Iterator,
+    List,
+    Optional,
+)
+
+from ..doc_utils import exclude_parent_attrs
+
+__all__ = ['ConnectionPool', 'PoolExhausted', 'PoolStats']
+
+
+class PoolExhausted(Exception):
+    """all connections for the key are busy and waiting for a free one timed out."""
+
+
+@dataclass
+class PoolStats:
+    hits: int = 0
+    misses: int = 0
+    evictions: int = 0
+    discards: int = 0
+    idle: int = 0
+    in_use: int = 0
+
+
+@dataclass
+class _IdleEntry:
+    conn: any
+    released_at: float
+
+
+class ConnectionPool:
+    """thread-safe pool of connections grouped by key.
+
+    idle connections older than `idle_timeout` are evicted,
+    dead ones (by `is_alive`) are discarded before reuse.
+
+    :param close: closes a connection.
+    :param is_alive: liveness check of an idle connection.
+    :param idle_timeout: seconds, after which an idle connection is closed.
+    :param max_per_key: max count of connections (idle and in use) per key.
+    :param acquire_timeout: seconds to wait for a free connection, if the limit is reached.
+    """
+
+    def __init__(
+            self,
+            close: Callable[[any], None],
+            is_alive: Callable[[any], bool],
+            idle_timeout: float = 60,
+            max_per_key: int = 4,
+            acquire_timeout: float = 10,
+    ):
+        self.close = close
+        self.is_alive = is_alive
+        self.idle_timeout = idle_timeout
+        self.max_per_key = max_per_key
+        self.acquire_timeout = acquire_timeout
+        self._cond = threading.Condition()
+        self._idle: Dict[Hashable, List[_IdleEntry]] = defaultdict(list)
+        self._in_use: Dict[Hashable, int] = defaultdict(int)
+        self._stats = PoolStats()
+
+    def acquire(self, key: Hashable, opener: Callable[[], any]) -> any:
+        """take an idle connection for the key or open a new one by `opener`."""
+        deadline = time.monotonic() + self.acquire_timeout
+        to_close = []
+        conn = None
+        try:
+            with self._cond:
+                to_close.extend(self._pop_expired())
+                while True:
+                    conn = self._pop_alive(key, to_close)
+                    if conn is not None:
+                        self._in_use[key] += 1
+                        self._stats.hits += 1
+                        return conn
+                    if self._in_use[key] < self.max_per_key:
+                        self._in_use[key] += 1
+                        self._stats.misses += 1
+                        break
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        raise PoolExhausted(key)
+                    self._cond.wait(remaining)
+        finally:
+            self._close_all(to_close)
+
+        try:
+            return opener()
+        except BaseException:
+            self._forget(key)
+            raise
+
+    def release(self, key: Hashable, conn: any, discard: bool = False) -> None:
+        """return the connection to the pool. broken connections must be discarded."""
+        with self._cond:
+            self._decrement(key)
+            if discard:
+                self._stats.discards += 1
+            else:
+                self._idle[key].append(_IdleEntry(conn, time.monotonic()))
+            self._cond.notify()
+        if discard:
+            self._close_all([conn])
+
+    @contextmanager
+    def connection(self, key: Hashable, opener: Callable[[], any]) -> Iterator[any]:
+        """acquire a connection for the block. it is discarded, if the block fails."""
+        conn = self.acquire(key, opener)
+        try:
+            yield conn
+        except BaseException:
+            self.release(key, conn, discard=True)
+            raise
+        self.release(key, conn)
+
+    def stats(self) -> PoolStats:
+        with self._cond:
+            idle = sum(len(entries) for entries in self._idle.values())
+            in_use = sum(self._in_use.values())
+            return PoolStats(hits=self._stats.hits, misses=self._stats.misses,
+                             evictions=self._stats.evictions, discards=self._stats.discards,
+                             idle=idle, in_use=in_use)
+
+    def clear(self, key: Optional[Hashable] = None) -> None:
+        """close idle connections of the key or of all keys."""
+        with self._cond:
+            keys = [key] if key is not None else list(self._idle)
+            to_close = [entry.conn for k in keys for entry in self._idle.pop(k, [])]
+        self._close_all(to_close)
+
+    def _forget(self, key: Hashable) -> None:
+        with self._cond:
+            self._decrement(key)
+            self._cond.notify()
+
+    def _decrement(self, key: Hashable) -> None:
+        self._in_use[key] -= 1
+        if not self._in_use[key]:
+            del self._in_use[key]
+
+    def _pop_alive(self, key: Hashable, to_close: List[any]) -> Optional[any]:
+        entries = self._idle[key]
+        while entries:
+            # LIFO - the most recently used connection is the most likely alive
+            conn = entries.pop().conn
+            if self.is_alive(conn):
+                return conn
+            self._stats.discards += 1
+            to_close.append(conn)
+        return None
+
+    def _pop_expired(self) -> List[any]:
+        border = time.monotonic() - self.idle_timeout
+        expired = []
+        for key in list(self._idle):
+            entries = self._idle[key]
+            alive = [entry for entry in entries if entry.released_at > border]
+            expired.extend(entry.conn for entry in entries if entry.released_at <= border)
+            if alive:
+                self._idle[key] = alive
+            else:
+                del self._idle[key]
+        self._stats.evictions += len(expired)
+        return expired
+
+    def _close_all(self, conns: List[any]) -> None:
+        for conn in conns:
+            try:
+                self.close(conn)
+            except Exception:  # noqa: S110
+                pass
+
+
+exclude_parent_attrs(PoolExhausted)
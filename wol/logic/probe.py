@@ -0,0 +1,254 @@
+"""
+concurrent reachability checks of many hosts in one event loop.
+"""
+
+import asyncio
+import os
+import random
+import socket
+import struct
+from typing import (
+    Dict,
+    Iterable,
+    List,
+    Optional,
+)
+
+from ..profiling import span
+from .core import _load_scapy
+
+__all__ = ['METHODS', 'check_hosts', 'check_hosts_async']
+
+METHOD_AUTO = 'auto'
+METHOD_TCP = 'tcp'
+METHOD_ICMP = 'icmp'
+METHOD_PING = 'ping'
+METHOD_SCAPY = 'scapy'
+METHOD_SSH = 'ssh'
+METHODS = (METHOD_AUTO, METHOD_TCP, METHOD_ICMP, METHOD_PING, METHOD_SCAPY, METHOD_SSH)
+
+ICMP_ECHO_REQUEST = 8
+ICMP_ECHO_REPLY = 0
+
+
+def check_hosts(
+        hosts: Iterable[str],
+        port: int = 80,
+        method: str = METHOD_AUTO,
+        timeout: float = 2,
+        concurrency: int = 100,
+) -> Dict[str, bool]:
+    """check, if hosts are online. all hosts are probed concurrently.
+
+    :param hosts: ip addresses or hostnames.
+    :param port: tcp port for `tcp`, `scapy` and `ssh` methods.
+    :param method: `tcp` - connect to the port, `icmp` - echo request through ping/raw socket,
+        `ping` - ping subprocess, `scapy` - SYN to the port (root only), `ssh` - banner of sshd on the port,
+        `auto` - the best available of `scapy`, `icmp`, `ping`.
+    :param timeout: seconds to wait for each host.
+    :param concurrency: max count of hosts probed at the same time.
+    :return: reachability by host.
+    """
+    with span(f'probe.{method}'):
+        return asyncio.run(check_hosts_async(hosts, port, method, timeout, concurrency))
+
+
+async def check_hosts_async(
+        hosts: Iterable[str],
+        port: int = 80,
+        method: str = METHOD_AUTO,
+        timeout: float = 2,
+        concurrency: int = 100,
+) -> Dict[str, bool]:
+    """the same as `check_hosts`, but for using inside a running event loop."""
+    hosts = list(dict.fromkeys(hosts))
+    if method == METHOD_AUTO:
+        method = _best_method()
+    if method == METHOD_SCAPY:
+        return await _check_scapy(hosts, port, timeout)
+    if method == METHOD_ICMP and not _can_use_icmp():
+        raise NotImplementedError
+
+    probe = {
+        METHOD_TCP: lambda host: _check_tcp(host, port, timeout),
+        METHOD_ICMP: lambda host: _check_icmp(host, timeout),
+        METHOD_PING: lambda host: _check_ping(host, timeout),
+        METHOD_SSH: lambda host: _check_ssh(host, port, timeout),
+    }[method]
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def limited(host: str) -> bool:
+        async with semaphore:
+            return await probe(host)
+
+    results = await asyncio.gather(*[limited(host) for host in hosts])
+    return dict(zip(hosts, results))
+
+
+def _is_root() -> bool:
+    return os.geteuid() == 0
+
+
+def _can_use_icmp() -> bool:
+    try:
+        _open_icmp_socket().close()
+    except OSError:
+        return False
+    return True
+
+
+def _best_method() -> str:
+    if _is_root() and _load_scapy() is not None:
+        return METHOD_SCAPY
+    if _can_use_icmp():
+        return METHOD_ICMP
+    return METHOD_PING
+
+
+async def _check_tcp(host: str, port: int, timeout: float) -> bool:
+    try:
+        _, writer = await asyncio.wait_for(asyncio.open_connection(host, port), timeout)
+    except ConnectionRefusedError:
+        # RST is an answer too - the host is online, the port is closed
+        return True
+    except (OSError, asyncio.TimeoutError):
+        return False
+    writer.close()
+    return True
+
+
+async def _check_ssh(host: str, port: int, timeout: float) -> bool:
+    """sshd is ready, when it sends the banner. other lines can be sent before it."""
+    async def read_banner() -> bool:
+        reader, writer = await asyncio.open_connection(host, port)
+        try:
+            for _ in range(10):
+                line = await reader.readline()
+                if not line or line.startswith(b'SSH-'):
+                    return bool(line)
+            return False
+        finally:
+            writer.close()
+
+    try:
+        return await asyncio.wait_for(read_banner(), timeout)
+    except (OSError, asyncio.TimeoutError):
+        return False
+
+
+async def _check_ping(host: str, timeout: float) -> bool:
+    cmd = ['ping', '-c', '1', '-W', str(max(int(timeout), 1)), host]
+    try:
+        proc = await asyncio.create_subprocess_exec(*cmd, stdout=asyncio.subprocess.DEVNULL,
+                                                    stderr=asyncio.subprocess.DEVNULL)
+    except OSError:
+        return False
+    return await proc.wait() == 0
+
+
+def _open_icmp_socket() -> socket.socket:
+    """unprivileged ping socket if allowed by `net.ipv4.ping_group_range`, otherwise raw socket."""
+    try:
+        return socket.socket(socket.AF_INET, socket.SOCK_DGRAM, socket.IPPROTO_ICMP)
+    except PermissionError:
+        return socket.socket(socket.AF_INET, socket.SOCK_RAW, socket.IPPROTO_ICMP)
+
+
+def _icmp_checksum(data: bytes) -> int:
+    if len(data) % 2:
+        data += b'\x00'
+    total = sum(struct.unpack(f'!{len(data) // 2}H', data))
+    total = (total >> 16) + (total & 0xFFFF)
+    total += total >> 16
+    return ~total & 0xFFFF
+
+
+def _make_echo_request(ident: int, seq: int) -> bytes:
+    payload = b'wol-probe'
+    header = struct.pack('!BBHHH', ICMP_ECHO_REQUEST, 0, 0, ident, seq)
+    checksum = _icmp_checksum(header + payload)
+    return struct.pack('!BBHHH', ICMP_ECHO_REQUEST, 0, checksum, ident, seq) + payload
+
+
+def _is_echo_reply(data: bytes, raw: bool, ident: int, seq: int) -> bool:
+    if raw:
+        data = data[(data[0] & 0x0F) * 4:]
+    if len(data) < 8:
+        return False
+    type_, _, _, reply_ident, reply_seq = struct.unpack('!BBHHH', data[:8])
+    # kernel replaces the identifier of the unprivileged ping socket by own
+    return type_ == ICMP_ECHO_REPLY and reply_seq == seq and (not raw or reply_ident == ident)
+
+
+async def _check_icmp(host: str, timeout: float) -> bool:
+    address = await _resolve(host)
+    if not address:
+        return False
+
+    loop = asyncio.get_running_loop()
+    ident, seq = random.getrandbits(16), random.getrandbits(16)
+    with _open_icmp_socket() as sock:
+        sock.setblocking(False)
+        raw = sock.type == socket.SOCK_RAW
+        # connected socket receives replies only from this address
+        sock.connect((address, 0))
+        try:
+            sock.send(_make_echo_request(ident, seq))
+        except OSError:
+            return False
+        return await _wait_echo_reply(loop, sock, raw, ident, seq, timeout)
+
+
+async def _wait_echo_reply(
+        loop: asyncio.AbstractEventLoop,
+        sock: socket.socket,
+        raw: bool,
+        ident: int,
+        seq: int,
+        timeout: float,
+) -> bool:
+    deadline = loop.time() + timeout
+    while True:
+        remaining = deadline - loop.time()
+        if remaining <= 0:
+            return False
+        try:
+            data = await asyncio.wait_for(loop.sock_recv(sock, 1024), remaining)
+        except (OSError, asyncio.TimeoutError):
+            return False
+        if _is_echo_reply(data, raw, ident, seq):
+            return True
+
+
+async def _resolve(host: str) -> Optional[str]:
+    loop = asyncio.get_running_loop()
+    try:
+        infos = await loop.getaddrinfo(host, None, family=socket.AF_INET)
+    except socket.gaierror:
+        return None
+    return infos[0][4][0]
+
+
+async def _check_scapy(hosts: List[str], port: int, timeout: float) -> Dict[str, bool]:
+    """SYN to the port of all hosts by one `sr` call."""
+    scapy = _load_scapy()
+    if not _is_root() or scapy is None:
+        raise NotImplementedError
+
+    addresses = await asyncio.gather(*[_resolve(host) for host in hosts])
+    by_address = {}
+    for host, address in zip(hosts, addresses):
+        if address:
+            by_address.setdefault(address, []).append(host)
+
+    results = dict.fromkeys(hosts, False)
+    if not by_address:
+        return results
+
+    packets = [scapy.IP(dst=address) / scapy.TCP(dport=port) for address in by_address]
+    loop = asyncio.get_running_loop()
+    answered, _ = await loop.run_in_executor(None, lambda: scapy.sr(packets, timeout=timeout, verbose=0))
+    for sent, _ in answered:
+        for host in by_address.get(sent.dst, []):
+            results[host] = True
+    return results
@@ -0,0 +1,264 @@
+"""
+long-lived samplers of remote host load through one ssh channel.
+"""
+
+import logging
+import socket
+import threading
+import time
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from typing import (
+    Dict,
+    Iterator,
+    List,
+    NamedTuple,
+    Optional,
+    Tuple,
+)
+
+from ..doc_utils import exclude_parent_attrs
+from .core import (
+    ERROR_SSH,
+    SSH_BACKEND_ASYNCSSH,
+    CpuStat,
+    RemoteExecError,
+    SshCredentials,
+    _async_ssh_client,
+    _get_delta,
+    _parse_cpu_line,
+    _ssh_connection,
+    _ssh_pool_key,
+    ssh_options,
+)
+from .timeseries import TimeSeriesStore
+
+__all__ = ['MemStat', 'LoadAvg', 'Sample', 'HostSampler', 'SampleNotReady', 'SamplerRegistry', 'samplers',
+           'SAMPLE_FIELDS']
+
+logger = logging.getLogger(__name__)
+
+# blocks of measures are separated by an empty line
+SAMPLE_SCRIPT = (
+    'while :; do'
+    ' head -1 /proc/stat;'
+    ' grep -E "^(MemTotal|MemAvailable):" /proc/meminfo;'
+    ' cat /proc/loadavg;'
+    ' echo;'
+    ' sleep {interval};'
+    ' done'
+)
+
+
+SAMPLE_FIELDS = (
+    [f'cpu.{field}' for field in CpuStat._fields]
+    + ['memory.total', 'memory.available', 'memory.used_percent', 'load.la1', 'load.la5', 'load.la15']
+)
+"""flat names of sample values."""
+
+
+class MemStat(NamedTuple):
+    """memory usage in kB."""
+    total: int
+    available: int
+
+    @property
+    def used_percent(self) -> float:
+        return (self.total - self.available) / self.total * 100 if self.total else 0
+
+
+class LoadAvg(NamedTuple):
+    """average count of runnable processes."""
+    la1: float
+    la5: float
+    la15: float
+
+
+@dataclass
+class Sample:
+    time: float
+    cpu: CpuStat
+    memory: MemStat
+    load: LoadAvg
+
+    def as_dict(self, precision: Optional[int] = None) -> dict:
+        cpu = round(self.cpu, precision) if precision else self.cpu
+        return {
+            'time': datetime.fromtimestamp(self.time, timezone.utc).isoformat(),
+            'cpu': cpu._asdict(),
+            'memory': {**self.memory._asdict(), 'used_percent': self.memory.used_percent},
+            'load': self.load._asdict(),
+        }
+
+    def values(self) -> Dict[str, float]:
+        """flat values by names from `SAMPLE_FIELDS`."""
+        values = {f'cpu.{field}': value for field, value in self.cpu._asdict().items()}
+        values.update({'memory.total': self.memory.total, 'memory.available': self.memory.available,
+                       'memory.used_percent': self.memory.used_percent})
+        values.update({f'load.{field}': value for field, value in self.load._asdict().items()})
+        return values
+
+
+def _parse_block(lines: List[str]) -> Tuple[CpuStat, MemStat, LoadAvg]:
+    cpu_line, *mem_lines, load_line = lines
+    mem = {line.split(':')[0]: int(line.split()[1]) for line in mem_lines}
+    load = LoadAvg(*map(float, load_line.split()[:3]))
+    return _parse_cpu_line(cpu_line), MemStat(mem.get('MemTotal', 0), mem.get('MemAvailable', 0)), load
+
+
+class SampleNotReady(Exception):
+    """the first sample of the running sampler isn't collected yet."""
+
+
+class HostSampler:
+    """samples cpu, memory and load of a remote host every `interval` seconds.
+
+    the remote loop is started once, so sampling costs neither ssh handshakes nor waiting.
+    sampler stops itself, if nobody reads samples for `idle_timeout` seconds.
+    """
+
+    def __init__(
+            self,
+            creds: SshCredentials,
+            interval: float = 1,
+            idle_timeout: float = 60,
+            store: Optional[TimeSeriesStore] = None,
+    ):
+        self.creds = creds
+        self.interval = interval
+        self.idle_timeout = idle_timeout
+        self.store = store
+        self.error: Optional[Exception] = None
+        self._latest: Optional[Sample] = None
+        self._cond = threading.Condition()
+        self._stop = threading.Event()
+        self._accessed = time.monotonic()
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self) -> None:
+        self._thread = threading.Thread(target=self._run, name=f'sampler-{self.creds.host}', daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+
+    def latest(self, timeout: Optional[float] = None) -> Sample:
+        """the last sample. waits for the first one, if it is not ready yet.
+
+        :param timeout: seconds to wait. `SampleNotReady` is raised after it, if the sampler is still running.
+        """
+        self._accessed = time.monotonic()
+        timeout = timeout if timeout is not None else self.interval * 2 + 10
+        with self._cond:
+            if not self._cond.wait_for(lambda: self._latest or not self.running, timeout):
+                raise SampleNotReady
+            return self._check(self._latest)
+
+    def stream(self) -> Iterator[Sample]:
+        """all new samples, while the sampler is running."""
+        last = None
+        while True:
+            self._accessed = time.monotonic()
+            with self._cond:
+                self._cond.wait_for(lambda last=last: self._latest is not last or not self.running,
+                                    self.interval * 2 + 10)
+                if self._latest is last:
+                    if not self.running:
+                        self._check(None)
+                    continue
+                last = self._latest
+            yield last
+
+    def _check(self, sample: Optional[Sample]) -> Sample:
+        if sample:
+            return sample
+        if self.error:
+            raise self.error
+        raise RemoteExecError(ERROR_SSH, "no samples from host")
+
+    def _run(self) -> None:
+        script = SAMPLE_SCRIPT.format(interval=self.interval)
+        try:
+            if ssh_options.backend == SSH_BACKEND_ASYNCSSH:
+                lines = _async_ssh_client().iter_lines(self.creds, script, self.interval + 30)
+                try:
+                    self._read(lines)
+                finally:
+                    lines.close()
+            else:
+                with _ssh_connection(self.creds) as c:
+                    channel = c.client.get_transport().open_session()
+                    channel.settimeout(self.interval + 30)
+                    channel.exec_command(script)
+                    try:
+                        self._read(channel.makefile('r'))
+                    finally:
+                        channel.close()
+        except (RemoteExecError, NotImplementedError) as e:
+            self.error = e
+        except (OSError, ValueError) as e:
+            logger.warning("sampler of %s failed: %r", self.creds.host, e)
+            self.error = RemoteExecError(ERROR_SSH, "sampling failed", {'error': str(e)})
+        finally:
+            self._stop.set()
+            with self._cond:
+                self._cond.notify_all()
+
+    def _read(self, stream) -> None:
+        previous = None
+        block = []
+        for line in stream:
+            line = line.strip()
+            if line:
+                block.append(line)
+                continue
+            cpu, memory, load = _parse_block(block)
+            block = []
+            if previous and sum(cpu) != sum(previous):
+                sample = Sample(time.time(), _get_delta(previous, cpu), memory, load)
+                if self.store:
+                    self.store.add(self.creds.host, sample.time, sample.values())
+                with self._cond:
+                    self._latest = sample
+                    self._cond.notify_all()
+            previous = cpu
+            if self._stop.is_set() or time.monotonic() - self._accessed > self.idle_timeout:
+                return
+        raise socket.error('remote loop exited')
+
+
+class SamplerRegistry:
+    """running samplers by host and credentials. samples are recorded into the `store`."""
+
+    def __init__(self, store: Optional[TimeSeriesStore] = None):
+        self.store = store
+        self._samplers: Dict[tuple, HostSampler] = {}
+        self._lock = threading.Lock()
+
+    def get(self, creds: SshCredentials, interval: float = 1) -> HostSampler:
+        """running sampler of the host. it's started, if there is no one."""
+        key = (_ssh_pool_key(creds), interval)
+        with self._lock:
+            sampler = self._samplers.get(key)
+            if not sampler or not sampler.running:
+                sampler = HostSampler(creds, interval, store=self.store)
+                sampler.start()
+                self._samplers[key] = sampler
+            return sampler
+
+    def stop_all(self) -> None:
+        with self._lock:
+            for sampler in self._samplers.values():
+                sampler.stop()
+            self._samplers.clear()
+
+
+samplers = SamplerRegistry(TimeSeriesStore(SAMPLE_FIELDS))
+"""samplers, shared by the api. their samples are kept in the history."""
+
+exclude_parent_attrs(MemStat)
+exclude_parent_attrs(LoadAvg)
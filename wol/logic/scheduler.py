@@ -0,0 +1,250 @@
+"""
+wakeup of targets by cron rules of their schedules.
+"""
+
+import heapq
+import logging
+import random
+import threading
+import time
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from typing import (
+    Dict,
+    Iterable,
+    List,
+    Optional,
+    Tuple,
+)
+
+from ..models import Target, WakeUpSchedule, db
+from .core import WakeupTarget, wakeup_hosts
+from .cron import CronRule, parse_cron
+
+__all__ = ['WakeupScheduler', 'wakeup_scheduler']
+
+logger = logging.getLogger(__name__)
+
+# updates of the same second can be missed without an overlap
+SYNC_OVERLAP = 1
+# count of query parameters is limited
+CHUNK_SIZE = 500
+# seconds of lateness of the loop itself, which is not a missed firing
+MISFIRE_TOLERANCE = 1
+
+
+@dataclass
+class _Firing:
+    schedule_id: int
+    rule: CronRule
+    jitter: int
+    misfire_grace: int
+    # the rule time and the time with the jitter
+    due_at: float
+    fire_at: float
+
+
+class WakeupScheduler:
+    """sends magic packets to targets at times of their schedules.
+
+    next firings of all enabled schedules are kept in a min-heap. changed schedules are reloaded
+    by `updated_at` every `sync_interval` seconds, or at once after `refresh` in the same process.
+    due firings are sent by one batch. a firing, missed by more than its `misfire_grace` after its time
+    with the jitter (e.g. the scheduler was stopped), is skipped, otherwise it's done late.
+
+    :param sync_interval: seconds between reloads of changed schedules.
+    :param rate: max count of packets per second of a batch. unlimited, if not set.
+    :param repeat: how many times to send every packet.
+    """
+
+    def __init__(self, sync_interval: float = 30, rate: Optional[float] = None, repeat: int = 1):
+        self.sync_interval = sync_interval
+        self.rate = rate
+        self.repeat = repeat
+        self.fired = 0
+        self.misfired = 0
+        self.failed = 0
+        self._heap: List[Tuple[float, int]] = []
+        self._firings: Dict[int, _Firing] = {}
+        self._synced_till: Optional[float] = None
+        self._running = False
+        self._sync_requested = False
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def refresh(self) -> None:
+        """reload changed schedules as soon as possible."""
+        self._sync_requested = True
+        self._wakeup.set()
+
+    def stats(self) -> dict:
+        with self._lock:
+            next_fire_at = min((firing.fire_at for firing in self._firings.values()), default=None)
+            scheduled = len(self._firings)
+        return {
+            'running': self._running,
+            'scheduled': scheduled,
+            'next_fire_at': _isoformat(next_fire_at) if next_fire_at else None,
+            'fired': self.fired,
+            'misfired': self.misfired,
+            'failed': self.failed,
+        }
+
+    def next_fire_at(self, schedule_id: int) -> Optional[float]:
+        with self._lock:
+            firing = self._firings.get(schedule_id)
+            return firing.fire_at if firing else None
+
+    def sync(self) -> None:
+        """load schedules, changed since the previous sync, and forget deleted and disabled ones."""
+        now = time.time()
+        with db.database.connection_context():
+            active = WakeUpSchedule.select(WakeUpSchedule.id) \
+                .where(WakeUpSchedule.enabled, WakeUpSchedule.cron.is_null(False))
+            active_ids = {row.id for row in active}
+            changed = WakeUpSchedule.select()
+            if self._synced_till is not None:
+                changed = changed.where(WakeUpSchedule.updated_at >= self._synced_till - SYNC_OVERLAP)
+            changed = list(changed)
+
+        with self._lock:
+            for id_ in set(self._firings) - active_ids:
+                del self._firings[id_]
+            for schedule in changed:
+                if schedule.id in active_ids:
+                    self._schedule(schedule, now)
+                else:
+                    self._firings.pop(schedule.id, None)
+            # invalid entries of the heap are dropped by popping
+            if len(self._heap) > 2 * len(self._firings) + 100:
+                self._heap = [(firing.fire_at, firing.schedule_id) for firing in self._firings.values()]
+                heapq.heapify(self._heap)
+        self._synced_till = now
+        logger.debug("%s schedules changed, %s active", len(changed), len(active_ids))
+
+    def fire_due(self) -> Optional[float]:
+        """send wakeups of due firings.
+
+        :return: seconds till the next firing. None, if nothing is scheduled.
+        """
+        now = time.time()
+        due = []
+        with self._lock:
+            while self._heap and self._heap[0][0] <= now:
+                fire_at, id_ = heapq.heappop(self._heap)
+                firing = self._firings.get(id_)
+                if not firing or firing.fire_at != fire_at:
+                    continue
+                # the jitter delays the firing on purpose, lateness is counted from its time
+                if now - firing.fire_at > firing.misfire_grace + MISFIRE_TOLERANCE:
+                    self.misfired += 1
+                    logger.warning("schedule %s missed the firing at %s", id_, _isoformat(firing.fire_at))
+                else:
+                    due.append(id_)
+                self._reschedule(firing, now)
+            next_in = self._heap[0][0] - now if self._heap else None
+
+        if due:
+            try:
+                self._dispatch(due, now)
+            except Exception:
+                self.failed += len(due)
+                logger.exception("can't fire %s schedules", len(due))
+        return next_in
+
+    def start(self) -> None:
+        """run in a daemon thread."""
+        if self._thread:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self.run, name='wakeup-scheduler', daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        self._wakeup.set()
+        if self._thread:
+            self._thread.join()
+            self._thread = None
+
+    def run(self) -> None:
+        """fire schedules until stopped."""
+        next_sync = 0
+        self._running = True
+        while not self._stop.is_set():
+            if self._sync_requested or time.monotonic() >= next_sync:
+                self._sync_requested = False
+                try:
+                    self.sync()
+                except Exception:
+                    logger.exception("can't load schedules")
+                next_sync = time.monotonic() + self.sync_interval
+            try:
+                next_in = self.fire_due()
+            except Exception:
+                logger.exception("can't fire schedules")
+                next_in = None
+            timeout = next_sync - time.monotonic()
+            if next_in is not None:
+                timeout = min(timeout, next_in)
+            self._wakeup.wait(max(timeout, 0))
+            self._wakeup.clear()
+        self._running = False
+
+    def _schedule(self, schedule: WakeUpSchedule, now: float) -> None:
+        try:
+            rule = parse_cron(schedule.cron)
+        except ValueError as e:
+            self._firings.pop(schedule.id, None)
+            logger.error("schedule %s has bad rule: %s", schedule.id, e)
+            return
+        # a firing, missed within the grace period, is done now
+        since = now
+        if schedule.last_fired_at:
+            since = max(schedule.last_fired_at, now - schedule.misfire_grace)
+        firing = _Firing(schedule.id, rule, schedule.jitter, schedule.misfire_grace, 0, 0)
+        self._reschedule(firing, since)
+
+    def _reschedule(self, firing: _Firing, after: float) -> None:
+        due = firing.rule.next_after(datetime.fromtimestamp(after))
+        if due is None:
+            self._firings.pop(firing.schedule_id, None)
+            return
+        firing.due_at = due.timestamp()
+        firing.fire_at = firing.due_at + (random.uniform(0, firing.jitter) if firing.jitter else 0)  # noqa: S311
+        self._firings[firing.schedule_id] = firing
+        heapq.heappush(self._heap, (firing.fire_at, firing.schedule_id))
+
+    def _dispatch(self, ids: List[int], fired_at: float) -> None:
+        with db.database.connection_context():
+            macs = {}
+            for chunk in _chunks(ids):
+                query = Target.select(Target.mac, Target.wol_port).join(WakeUpSchedule) \
+                    .where(WakeUpSchedule.id.in_(chunk), Target.mac.is_null(False))
+                # schedules of the same target fire once
+                macs.update((target.mac, target.wol_port or 9) for target in query)
+            results = wakeup_hosts([WakeupTarget(mac=mac, port=port) for mac, port in macs.items()],
+                                   repeat=self.repeat, rate=self.rate)
+            for chunk in _chunks(ids):
+                WakeUpSchedule.update(last_fired_at=fired_at).where(WakeUpSchedule.id.in_(chunk)).execute()
+
+        failed = [result for result in results if not result['sent']]
+        self.fired += len(ids)
+        self.failed += len(failed)
+        logger.info("fired %s schedules, sent %s packets", len(ids), len(results) - len(failed))
+        for result in failed:
+            logger.error("wakeup of %s failed: %s", result['mac'], result.get('error'))
+
+
+def _chunks(ids: List[int]) -> Iterable[List[int]]:
+    return (ids[i:i + CHUNK_SIZE] for i in range(0, len(ids), CHUNK_SIZE))
+
+
+def _isoformat(timestamp: float) -> str:
+    return datetime.fromtimestamp(timestamp, timezone.utc).isoformat()
+
+
+wakeup_scheduler = WakeupScheduler()
+"""scheduler of the app or the separate process."""
@@ -0,0 +1,267 @@
+"""
+in-memory history of host metrics in fixed size ring buffers with rollups.
+"""
+
+import logging
+import math
+import threading
+from array import array
+from bisect import bisect_left, bisect_right
+from collections import OrderedDict
+from typing import (
+    Dict,
+    Iterable,
+    List,
+    Optional,
+    Tuple,
+)
+
+__all__ = ['RingBuffer', 'TimeSeriesStore', 'RESOLUTIONS']
+
+logger = logging.getLogger(__name__)
+
+RAW = 'raw'
+ROLLUPS = (('1m', 60), ('5m', 300), ('1h', 3600))
+RESOLUTIONS = (RAW,) + tuple(name for name, _ in ROLLUPS)
+
+# part of the memory of a series for each resolution
+SHARES = {RAW: 0.5, '1m': 0.25, '5m': 0.15, '1h': 0.1}
+# bytes per point: time, value for raw and time, avg, max, p95, count for rollups
+POINT_SIZES = {RAW: 2 * 8, '1m': 5 * 8, '5m': 5 * 8, '1h': 5 * 8}
+
+
+class RingBuffer:
+    """fixed count of rows of float columns. the oldest rows are overwritten.
+
+    the first column is time, rows must be appended in time order.
+    """
+
+    def __init__(self, capacity: int, columns: int):
+        self.capacity = capacity
+        self._columns = [array('d', bytes(8 * capacity)) for _ in range(columns)]
+        self._start = 0
+        self._size = 0
+
+    def __len__(self) -> int:
+        return self._size
+
+    def __getitem__(self, index: int) -> float:
+        # time of the row by the logical index - for bisect
+        return self._columns[0][(self._start + index) % self.capacity]
+
+    def append(self, *values: float) -> None:
+        if self._size < self.capacity:
+            pos = (self._start + self._size) % self.capacity
+            self._size += 1
+        else:
+            pos = self._start
+            self._start = (self._start + 1) % self.capacity
+        for column, value in zip(self._columns, values):
+            column[pos] = value
+
+    def rows(self, start: Optional[float] = None, end: Optional[float] = None) -> List[Tuple[float, ...]]:
+        """rows with time in [start, end], from the oldest."""
+        first = bisect_left(self, start) if start is not None else 0
+        last = bisect_right(self, end) if end is not None else self._size
+        positions = [(self._start + i) % self.capacity for i in range(first, last)]
+        return [tuple(column[pos] for column in self._columns) for pos in positions]
+
+    def oldest(self) -> Optional[float]:
+        return self[0] if self._size else None
+
+
+def _percentile(values: List[float], percent: float) -> float:
+    values = sorted(values)
+    index = max(math.ceil(len(values) * percent / 100) - 1, 0)
+    return values[index]
+
+
+def _merge(items: List[Tuple[float, float, float, float]]) -> Tuple[float, float, float, float]:
+    """(avg, max, p95, count) of a bucket by finer buckets or raw values.
+
+    p95 is exact for raw values and approximate for rollups of rollups.
+    """
+    count = sum(item[3] for item in items)
+    avg = sum(item[0] * item[3] for item in items) / count
+    return avg, max(item[1] for item in items), _percentile([item[2] for item in items], 95), count
+
+
+class _Series:
+    def __init__(self, capacities: Dict[str, int]):
+        self.raw = RingBuffer(capacities[RAW], 2)
+        self.rollups = {name: RingBuffer(capacities[name], 5) for name, _ in ROLLUPS}
+        self._buckets: Dict[str, Optional[float]] = dict.fromkeys(self.rollups)
+        self._pending: Dict[str, list] = {name: [] for name in self.rollups}
+
+    def add(self, time_: float, value: float) -> None:
+        self.raw.append(time_, value)
+        self._feed(0, time_, (value, value, value, 1))
+
+    def _feed(self, level: int, time_: float, item: Tuple[float, float, float, float]) -> None:
+        name, size = ROLLUPS[level]
+        bucket = time_ - time_ % size
+        current = self._buckets[name]
+        if current is not None and bucket != current:
+            closed = _merge(self._pending[name])
+            self.rollups[name].append(current, *closed)
+            self._pending[name] = []
+            if level + 1 < len(ROLLUPS):
+                self._feed(level + 1, current, closed)
+        self._buckets[name] = bucket
+        self._pending[name].append(item)
+
+    def buffer(self, resolution: str) -> RingBuffer:
+        return self.raw if resolution == RAW else self.rollups[resolution]
+
+
+class TimeSeriesStore:
+    """history of metrics by host and field.
+
+    memory is allocated up front: `memory_budget` bytes are split between
+    `max_hosts` hosts and `fields` of each host. the least recently updated host
+    is dropped, when a new one doesn't fit.
+    """
+
+    def __init__(self, fields: Iterable[str], memory_budget: int = 16 * 2**20, max_hosts: int = 64):
+        self.fields = tuple(fields)
+        self.max_hosts = max_hosts
+        per_series = memory_budget / (max_hosts * len(self.fields))
+        self.capacities = {name: max(int(per_series * share / POINT_SIZES[name]), 2)
+                           for name, share in SHARES.items()}
+        self._hosts: Dict[str, Dict[str, _Series]] = OrderedDict()
+        self._lock = threading.Lock()
+        self._spilled: Dict[tuple, float] = {}
+        self._spilling = False
+        self._stop = threading.Event()
+
+    def add(self, host: str, time_: float, values: Dict[str, float]) -> None:
+        """store values of fields measured at the time."""
+        with self._lock:
+            series = self._hosts.get(host)
+            if series is None:
+                if len(self._hosts) >= self.max_hosts:
+                    self._hosts.popitem(last=False)
+                series = self._hosts[host] = {field: _Series(self.capacities) for field in self.fields}
+            else:
+                self._hosts.move_to_end(host)
+            for field, value in values.items():
+                if field in series:
+                    series[field].add(time_, value)
+
+    def hosts(self) -> List[str]:
+        with self._lock:
+            return list(self._hosts)
+
+    def query(
+            self,
+            host: str,
+            field: str,
+            start: Optional[float] = None,
+            end: Optional[float] = None,
+            resolution: str = RAW,
+    ) -> List[dict]:
+        """points in [start, end]. rollup points also have avg, max, p95 and count."""
+        with self._lock:
+            series = self._hosts.get(host, {}).get(field)
+            rows = series.buffer(resolution).rows(start, end) if series else []
+            oldest = series.buffer(resolution).oldest() if series else None
+        if resolution == RAW:
+            return [{'time': row[0], 'value': row[1]} for row in rows]
+
+        points = [_rollup_point(*row) for row in rows]
+        if self._spilling and (oldest is None or start is None or start < oldest):
+            border = oldest if oldest is not None else end
+            points = self._query_spilled(host, field, resolution, start, border) + points
+        return points
+
+    def aggregate(
+            self,
+            host: str,
+            field: str,
+            start: Optional[float] = None,
+            end: Optional[float] = None,
+    ) -> Optional[dict]:
+        """avg, max, p95 and count in [start, end] by the finest resolution, which covers the range."""
+        with self._lock:
+            series = self._hosts.get(host, {}).get(field)
+            if not series:
+                return None
+            covering = [resolution for resolution in RESOLUTIONS
+                        if len(series.buffer(resolution))
+                        and (start is None or series.buffer(resolution).oldest() <= start)]
+            # if nothing covers the range, the longest history is the best
+            with_data = [resolution for resolution in RESOLUTIONS if len(series.buffer(resolution))]
+            resolution = (covering or with_data[-1:] or [RAW])[0]
+            rows = series.buffer(resolution).rows(start, end)
+        if not rows:
+            return None
+        if resolution == RAW:
+            items = [(row[1], row[1], row[1], 1) for row in rows]
+        else:
+            items = [row[1:] for row in rows]
+        avg, max_, p95, count = _merge(items)
+        return {'avg': avg, 'max': max_, 'p95': p95, 'count': int(count), 'resolution': resolution}
+
+    def spill(self) -> int:
+        """save new rollup points to the database. returns count of saved points."""
+        rows = []
+        with self._lock:
+            for host, series in self._hosts.items():
+                for field, one in series.items():
+                    for resolution in one.rollups:
+                        key = (host, field, resolution)
+                        new = one.rollups[resolution].rows(self._spilled.get(key, -1) + 1e-6)
+                        if new:
+                            self._spilled[key] = new[-1][0]
+                        rows.extend({'host': host, 'field': field, 'resolution': resolution,
+                                     'time': row[0], 'avg': row[1], 'max': row[2], 'p95': row[3],
+                                     'count': int(row[4])} for row in new)
+        if not rows:
+            return 0
+        from ..models import MetricRollup, db
+        with db.database.connection_context(), db.database.atomic():
+            for i in range(0, len(rows), 500):
+                MetricRollup.insert_many(rows[i:i + 500]).on_conflict_ignore().execute()
+        return len(rows)
+
+    def start_spilling(self, interval: float) -> None:
+        """spill to the database every `interval` seconds in a daemon thread."""
+        # the database deps are loaded only for spilling
+        try:
+            from ..models import MetricRollup  # noqa: F401
+        except ImportError:
+            raise NotImplementedError
+        self._spilling = True
+        threading.Thread(target=self._spill_loop, args=(interval,), name='metrics-spill', daemon=True).start()
+
+    def stop(self) -> None:
+        self._stop.set()
+
+    def _spill_loop(self, interval: float) -> None:
+        while not self._stop.wait(interval):
+            try:
+                self.spill()
+            except Exception:
+                logger.exception("can't spill metrics")
+
+    def _query_spilled(
+            self,
+            host: str,
+            field: str,
+            resolution: str,
+            start: Optional[float],
+            end: Optional[float],
+    ) -> List[dict]:
+        from ..models import MetricRollup
+        query = MetricRollup.select().where(MetricRollup.host == host, MetricRollup.field == field,
+                                            MetricRollup.resolution == resolution)
+        if start is not None:
+            query = query.where(MetricRollup.time >= start)
+        if end is not None:
+            query = query.where(MetricRollup.time < end)
+        return [_rollup_point(row.time, row.avg, row.max, row.p95, row.count)
+                for row in query.order_by(MetricRollup.time)]
+
+
+def _rollup_point(time_: float, avg: float, max_: float, p95: float, count: float) -> dict:
+    return {'time': time_, 'avg': avg, 'max': max_, 'p95': p95, 'count': int(count)}
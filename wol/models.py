@@ -1,13 +1,100 @@
+import time
+from contextlib import nullcontext
+from typing import Iterator, List, Optional
+from urllib.parse import parse_qs, urlsplit
+
 from peewee import *
+from peewee import ModelSelect
+from playhouse import db_url
 from playhouse.flask_utils import FlaskDB
+from playhouse.migrate import SchemaMigrator, migrate
+from playhouse.pool import PooledDatabase
 
 from .doc_utils import exclude_parent_attrs
+from .profiling import span
+from .telemetry import db_query_seconds, registry
 
-__all__ = ['db', 'Credentials', 'Target', 'WakeUpSchedule']
+__all__ = ['db', 'Credentials', 'Target', 'TargetStatus', 'WakeUpSchedule', 'MetricRollup', 'Neighbor',
+           'init_db', 'migrate_db', 'iter_query', 'make_database', 'db_pool_stats']
 
 db = FlaskDB()
 
 
+def make_database(
+        url: str,
+        pool: bool = True,
+        max_connections: int = 20,
+        stale_timeout: float = 300,
+        pool_timeout: float = 10,
+        sqlite_wal: bool = True,
+        sqlite_busy_timeout: float = 5,
+) -> Database:
+    """database by the url. parameters in the url query take precedence.
+
+    :param pool: keep connections open between requests. sqlite connections are cheap,
+        so sqlite is pooled only by the explicit `sqlite+pool://` url.
+    :param max_connections: size of the pool.
+    :param stale_timeout: seconds to reuse a connection, after that it's reopened.
+    :param pool_timeout: seconds to wait for a free connection, when the pool is exhausted.
+    :param sqlite_wal: write-ahead log mode - readers don't block the writer and vice versa.
+    :param sqlite_busy_timeout: seconds to wait for a lock of the sqlite database.
+    """
+    scheme, separator, rest = url.partition('://')
+    in_url = set(parse_qs(urlsplit(url).query, keep_blank_values=True))
+    params = {}
+    if scheme.startswith('sqlite'):
+        pragmas = {'busy_timeout': int(sqlite_busy_timeout * 1000)}
+        if sqlite_wal:
+            # synchronous=normal is safe with wal
+            pragmas.update(journal_mode='wal', synchronous='normal')
+        params['pragmas'] = pragmas
+    elif pool and not scheme.endswith('+pool') and f'{scheme}+pool' in db_url.schemes:
+        scheme += '+pool'
+    if scheme.endswith('+pool'):
+        if scheme.startswith('sqlite'):
+            # a pooled connection is used by one thread at a time, but not by the one, which opened it
+            params['check_same_thread'] = False
+        params.update(max_connections=max_connections, stale_timeout=stale_timeout, timeout=pool_timeout)
+    params = {key: value for key, value in params.items() if key not in in_url}
+    database = db_url.connect(scheme + separator + rest, **params)
+    _instrument_database(database)
+    return database
+
+
+def _instrument_database(database: Database) -> None:
+    """time all queries by statements (select, insert, etc), in metrics and spans of the profile."""
+    execute_sql = database.execute_sql
+
+    def timed_execute_sql(sql: str, *args, **kwargs):
+        statement = sql.split(None, 1)[0].lower() if sql else ''
+        with db_query_seconds.time(statement=statement), span(f'db.{statement}'):
+            return execute_sql(sql, *args, **kwargs)
+
+    database.execute_sql = timed_execute_sql
+
+
+def db_pool_stats() -> Optional[dict]:
+    """usage of the connection pool. None, if the database is not pooled."""
+    # models are bound to the proxy of the database
+    database = getattr(db.database, 'obj', db.database)
+    if not isinstance(database, PooledDatabase):
+        return None
+    # the pool has no public api for it
+    return {
+        'max_connections': database._max_connections,
+        'in_use': len(database._in_use),
+        'idle': len(database._connections),
+    }
+
+
+def _db_connections() -> dict:
+    stats = db_pool_stats()
+    return {(state,): stats[state] for state in ('idle', 'in_use')} if stats else {}
+
+
+registry.gauge('wol_db_connections', "count of pooled database connections", ('state',), callback=_db_connections)
+
+
 class Credentials(db.Model):
     username = CharField()
     password = CharField(null=True)
@@ -15,22 +102,132 @@ class Credentials(db.Model):
 
 
 class Target(db.Model):
-    name = CharField()
-    host = CharField(null=True)
-    mac = CharField(null=True)
+    name = CharField(index=True)
+    host = CharField(null=True, index=True)
+    # imports are upserted by mac
+    mac = CharField(null=True, unique=True)
     wol_port = IntegerField(null=True)
     credentials = ForeignKeyField(Credentials, backref='targets', null=True)
 
 
 class WakeUpSchedule(db.Model):
+    """cron rule of waking up a target. fire times are in the local time of the scheduler."""
     enabled = BooleanField(default=True)
-    target = ForeignKeyField(Target, backref='wakeup_schedules')
-    # TODO: schedule settings
+    target = ForeignKeyField(Target, backref='wakeup_schedules', on_delete='CASCADE')
+    # schedules without a rule don't fire
+    cron = CharField(null=True)
+    # seconds of a random delay of each firing, spreads wakeups of many targets
+    jitter = IntegerField(default=0)
+    # seconds, while a firing missed by the stopped scheduler is still done
+    misfire_grace = IntegerField(default=300)
+    last_fired_at = DoubleField(null=True)
+    # the scheduler reloads changed schedules by it
+    updated_at = DoubleField(default=time.time, index=True)
+
+
+class TargetStatus(db.Model):
+    """the last reachability check of a target, shared between app workers."""
+    target = ForeignKeyField(Target, primary_key=True, backref='status', on_delete='CASCADE')
+    reached = BooleanField()
+    checked_at = DoubleField()
+
+
+class MetricRollup(db.Model):
+    """aggregated host metric for a period, spilled from the memory."""
+    host = CharField()
+    field = CharField()
+    resolution = CharField()
+    time = DoubleField()
+    avg = DoubleField()
+    max = DoubleField()  # noqa: A003
+    p95 = DoubleField()
+    count = IntegerField()
+
+    class Meta:
+        indexes = (
+            (('host', 'field', 'resolution', 'time'), True),
+        )
+
+
+class Neighbor(db.Model):
+    """host, seen in the local net."""
+    ip = CharField(unique=True)
+    mac = CharField()
+    vendor = CharField(null=True)
+    iface = CharField(null=True)
+    first_seen = DoubleField()
+    last_seen = DoubleField()
+
+
+MODELS = [Credentials, Target, WakeUpSchedule, TargetStatus, MetricRollup, Neighbor]
 
 
 def init_db():
-    db.database.create_tables([Credentials, Target, WakeUpSchedule])
+    db.database.create_tables(MODELS)
+
+
+def migrate_db() -> List[str]:
+    """create missing tables, columns and indexes of the existing database.
+
+    :return: applied changes.
+    :raises ValueError: the data doesn't fit a new unique index.
+    """
+    database = db.database
+    existing_tables = set(database.get_tables())
+    applied = [f'create table {model._meta.table_name}' for model in MODELS
+               if model._meta.table_name not in existing_tables]
+    database.create_tables([model for model in MODELS if model._meta.table_name not in existing_tables])
+
+    migrator = SchemaMigrator.from_database(database)
+    operations = []
+    unique_fields = []
+    for model in MODELS:
+        table = model._meta.table_name
+        if table not in existing_tables:
+            continue
+        existing_columns = {column.name for column in database.get_columns(table)}
+        for field in model._meta.sorted_fields:
+            if field.column_name not in existing_columns:
+                operations.append(migrator.add_column(table, field.column_name, field))
+                applied.append(f'add column {table}.{field.column_name}')
+        # indexes of new columns are created with them
+        existing_indexes = {tuple(index.columns) for index in database.get_indexes(table)}
+        existing_indexes.update((field.column_name,) for field in model._meta.sorted_fields
+                                if field.column_name not in existing_columns)
+        for field in model._meta.sorted_fields:
+            if not (field.index or field.unique) or field.primary_key or (field.column_name,) in existing_indexes:
+                continue
+            if field.unique:
+                unique_fields.append((model, field))
+            operations.append(migrator.add_index(table, (field.column_name,), field.unique))
+            applied.append(f'create {"unique " if field.unique else ""}index on {table}.{field.column_name}')
+    # data isn't changed, if it doesn't fit an index
+    with database.atomic():
+        for model, field in unique_fields:
+            _check_unique(model, field)
+        migrate(*operations)
+    return applied
+
+
+def iter_query(query: ModelSelect) -> Iterator:
+    """rows of the query by a cursor, without caching them.
+
+    the connection is opened, if it's closed - a streamed response is read after its request.
+    """
+    database = query.model._meta.database
+    with database.connection_context() if database.is_closed() else nullcontext():
+        yield from query.iterator()
+
+
+def _check_unique(model, field) -> None:
+    # empty strings would be duplicates, unlike nulls
+    model.update({field: None}).where(field == '').execute()
+    duplicates = (model.select(field).where(field.is_null(False))
+                  .group_by(field).having(fn.COUNT(model._meta.primary_key) > 1).limit(10))
+    values = [getattr(row, field.name) for row in duplicates]
+    if values:
+        raise ValueError(f'duplicate values of {model._meta.table_name}.{field.column_name}: {", ".join(values)}')
 
 
-for model in (Credentials, Target, WakeUpSchedule):
+for model in MODELS:
     exclude_parent_attrs(model, ('id',))
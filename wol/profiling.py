@@ -0,0 +1,220 @@
+"""
+opt-in profiling of requests and commands.
+
+a profile is active in the context of one request or command. code marks its parts by `span`,
+e.g. ssh connecting or database queries. without an active profile a span is a shared no-op,
+so marks cost one context variable lookup.
+
+profiles are saved to files:
+
+* `<name>.spans.folded` - microseconds of spans, e.g. `request;get_cpu_stat;ssh.exec 1002345`;
+* `<name>.folded` (`sample` mode) - counts of sampled stacks of the thread, prefixed by active spans;
+* `<name>.pstats` (`cprofile` mode) - all calls by cProfile, for `python -m pstats`, snakeviz, etc.
+
+folded files are the input of flamegraph.pl, speedscope, inferno, etc.
+"""
+
+import os
+import sys
+import threading
+import time
+import uuid
+from collections import Counter
+from contextlib import contextmanager, nullcontext
+from contextvars import ContextVar
+from typing import (
+    Callable,
+    ContextManager,
+    Iterable,
+    Iterator,
+    List,
+    Optional,
+)
+
+__all__ = ['Profile', 'ProfilerMiddleware', 'span', 'profile_label', 'MODES', 'MODE_SAMPLE', 'MODE_CPROFILE']
+
+MODE_SAMPLE = 'sample'
+MODE_CPROFILE = 'cprofile'
+MODES = (MODE_SAMPLE, MODE_CPROFILE)
+
+_current = ContextVar('wol_profile', default=None)
+_no_span = nullcontext()
+
+
+def span(name: str) -> ContextManager[None]:
+    """mark the block for the active profile."""
+    profile = _current.get()
+    if profile is None:
+        return _no_span
+    return profile.span(name)
+
+
+class Profile:
+    """profile of one request or command in the current thread.
+
+    spans and samples of other threads, e.g. of concurrent checks, are not recorded.
+
+    :param label: the root span, e.g. `get.targets`. files are named by it and the start time.
+    :param mode: `sample` - stacks of the thread every `interval` seconds, `cprofile` - all calls.
+    :param interval: seconds between samples.
+    """
+
+    def __init__(self, label: str, mode: str = MODE_SAMPLE, interval: float = 0.005):
+        if mode not in MODES:
+            raise ValueError(f'unknown mode "{mode}"')
+        self.label = label
+        self.name = f'{label}-{time.strftime("%Y%m%d-%H%M%S")}-{uuid.uuid4().hex[:6]}'
+        self.mode = mode
+        self.interval = interval
+        self.spans: Counter = Counter()
+        self.samples: Counter = Counter()
+        self._stack: List[str] = []
+        # seconds of nested spans by levels of the stack, they are excluded from the own time
+        self._nested: List[float] = []
+        self._started = 0.0
+        self._token = None
+        self._profiler = None
+        self._sampler: Optional[threading.Thread] = None
+        self._stopped = threading.Event()
+
+    def __enter__(self) -> 'Profile':
+        self.start()
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.stop()
+
+    def start(self) -> None:
+        self._token = _current.set(self)
+        self._stack.append(self.label)
+        self._nested.append(0)
+        self._started = time.perf_counter()
+        if self.mode == MODE_CPROFILE:
+            import cProfile
+
+            self._profiler = cProfile.Profile()
+            self._profiler.enable()
+        else:
+            self._sampler = threading.Thread(target=self._sample, args=(threading.get_ident(),),
+                                             name='profile-sampler', daemon=True)
+            self._sampler.start()
+
+    def stop(self) -> None:
+        if self._profiler:
+            self._profiler.disable()
+        if self._sampler:
+            self._stopped.set()
+            self._sampler.join()
+        self._close_span(time.perf_counter() - self._started)
+        _current.reset(self._token)
+
+    @contextmanager
+    def span(self, name: str) -> Iterator[None]:
+        self._stack.append(name)
+        self._nested.append(0)
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self._close_span(time.perf_counter() - started)
+
+    def _close_span(self, elapsed: float) -> None:
+        # folded stacks have own time, flame graphs sum it up for parents
+        path = ';'.join(self._stack)
+        self.spans[path] += _microseconds(elapsed - self._nested.pop())
+        self._stack.pop()
+        if self._nested:
+            self._nested[-1] += elapsed
+
+    def save(self, directory: str) -> List[str]:
+        """write files of the profile.
+
+        :return: paths of the files.
+        """
+        os.makedirs(directory, exist_ok=True)
+        base = os.path.join(directory, self.name)
+        paths = [_write_folded(f'{base}.spans.folded', self.spans)]
+        if self.samples:
+            paths.append(_write_folded(f'{base}.folded', self.samples))
+        if self._profiler:
+            self._profiler.dump_stats(f'{base}.pstats')
+            paths.append(f'{base}.pstats')
+        return paths
+
+    def _sample(self, thread_id: int) -> None:
+        while not self._stopped.wait(self.interval):
+            frame = sys._current_frames().get(thread_id)
+            if frame is None:
+                continue
+            frames = []
+            while frame is not None:
+                code = frame.f_code
+                frames.append(f'{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})')
+                frame = frame.f_back
+            # spans are changed by the profiled thread meanwhile, a copy is enough
+            self.samples[';'.join([*list(self._stack), *reversed(frames)])] += 1
+
+
+def _microseconds(seconds: float) -> int:
+    return max(int(seconds * 1_000_000), 1)
+
+
+def _write_folded(path: str, counts: Counter) -> str:
+    with open(path, 'w') as f:
+        f.writelines(f'{stack} {count}\n' for stack, count in sorted(counts.items()))
+    return path
+
+
+def profile_label(*parts: str) -> str:
+    """label of a profile by parts of a path or a command, e.g. `get.targets.1`."""
+    return '.'.join(part.strip('/').replace('/', '.') for part in parts if part.strip('/')) or 'root'
+
+
+class ProfilerMiddleware:
+    """wsgi middleware, profiling requests with the `X-Profile` header or all of them.
+
+    the name of the profile is returned in the `X-Profile` header of the response.
+    the profile is saved, when the body is sent - streamed bodies are profiled too.
+
+    :param app: wsgi app.
+    :param directory: directory for files of profiles.
+    :param all_requests: profile requests without the header too.
+    """
+
+    def __init__(self, app: Callable, directory: str, mode: str = MODE_SAMPLE, all_requests: bool = False,
+                 interval: float = 0.005):
+        self.app = app
+        self.directory = directory
+        self.mode = mode
+        self.all_requests = all_requests
+        self.interval = interval
+
+    def __call__(self, environ: dict, start_response: Callable) -> Iterable[bytes]:
+        if not self.all_requests and not environ.get('HTTP_X_PROFILE'):
+            return self.app(environ, start_response)
+
+        profile = Profile(profile_label(environ['REQUEST_METHOD'].lower(), environ.get('PATH_INFO', '')),
+                          self.mode, self.interval)
+
+        def start_profiled_response(status, headers, exc_info=None):
+            return start_response(status, [*headers, ('X-Profile', profile.name)], exc_info)
+
+        profile.start()
+        try:
+            body = self.app(environ, start_profiled_response)
+        except BaseException:
+            self._finish(profile)
+            raise
+        return self._profiled_body(profile, body)
+
+    def _profiled_body(self, profile: Profile, body: Iterable[bytes]) -> Iterator[bytes]:
+        try:
+            yield from body
+        finally:
+            if hasattr(body, 'close'):
+                body.close()
+            self._finish(profile)
+
+    def _finish(self, profile: Profile) -> None:
+        profile.stop()
+        profile.save(self.directory)
@@ -0,0 +1,389 @@
+"""
+metrics of the app in the prometheus text format.
+
+metrics are kept in the memory of a process, updates are a dict change under a lock.
+with several processes (gunicorn workers) each of them saves its metrics to `<directory>/<pid>.json`
+every `interval` seconds, and the scraped process sums the files. counters and histograms
+of finished processes are kept, gauges are summed only for alive ones.
+"""
+
+import atexit
+import json
+import logging
+import os
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from functools import wraps
+from typing import (
+    Any,
+    Callable,
+    Dict,
+    Iterator,
+    List,
+    Optional,
+    Sequence,
+    Tuple,
+    Union,
+)
+
+from .profiling import span
+
+__all__ = ['Counter', 'Gauge', 'Histogram', 'Registry', 'registry', 'instrumented', 'CONTENT_TYPE']
+
+logger = logging.getLogger(__name__)
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+DEFAULT_BUCKETS = (.005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5, 10, 30, 60)
+# metrics of finished processes
+ARCHIVE_FILE = 'archive.json'
+
+LabelValues = Tuple[str, ...]
+
+
+class Metric:
+    """values by label values."""
+    type_ = 'untyped'
+
+    def __init__(self, name: str, documentation: str, labels: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self._values: Dict[LabelValues, Any] = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels: Dict[str, Any]) -> LabelValues:
+        if len(labels) != len(self.labels):
+            raise ValueError(f'{self.name} has labels {self.labels}, got {tuple(labels)}')
+        return tuple(str(labels[label]) for label in self.labels)
+
+    def samples(self) -> Dict[LabelValues, Any]:
+        with self._lock:
+            return {key: list(value) if isinstance(value, list) else value for key, value in self._values.items()}
+
+
+class Counter(Metric):
+    type_ = 'counter'
+
+    def inc(self, amount: float = 1, **labels) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(Metric):
+    """current value. with `callback` it's computed at collecting - the callback returns a value
+    or values by label values.
+    """
+    type_ = 'gauge'
+
+    def __init__(
+            self,
+            name: str,
+            documentation: str,
+            labels: Sequence[str] = (),
+            callback: Optional[Callable[[], Union[float, Dict[LabelValues, float]]]] = None,
+    ):
+        super().__init__(name, documentation, labels)
+        self.callback = callback
+
+    def set(self, value: float, **labels) -> None:  # noqa: A003
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def inc(self, amount: float = 1, **labels) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount: float = 1, **labels) -> None:
+        self.inc(-amount, **labels)
+
+    @contextmanager
+    def track(self, **labels) -> Iterator[None]:
+        """count of running blocks."""
+        self.inc(**labels)
+        try:
+            yield
+        finally:
+            self.dec(**labels)
+
+    def samples(self) -> Dict[LabelValues, Any]:
+        if not self.callback:
+            return super().samples()
+        try:
+            values = self.callback()
+        except Exception:
+            logger.exception("can't collect %s", self.name)
+            return {}
+        return values if isinstance(values, dict) else {(): values}
+
+
+class Histogram(Metric):
+    """count of values by buckets. a value is `[count of each bucket and +Inf, sum]`."""
+    type_ = 'histogram'
+
+    def __init__(self, name: str, documentation: str, labels: Sequence[str] = (),
+                 buckets: Sequence[float] = DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labels)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value: float, **labels) -> None:
+        key = self._key(labels)
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            counts = self._values.get(key)
+            if counts is None:
+                counts = self._values[key] = [0] * (len(self.buckets) + 1) + [0.0]
+            counts[index] += 1
+            counts[-1] += value
+
+    @contextmanager
+    def time(self, **labels) -> Iterator[None]:
+        """duration of the block in seconds. it's a decorator too."""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+
+class Registry:
+    """metrics of the app.
+
+    :param directory: directory for metrics of all processes. only the own ones are exposed, if not set.
+    :param interval: seconds between saving of the own metrics to the directory.
+    """
+
+    def __init__(self, directory: Optional[str] = None, interval: float = 1):
+        self.directory = directory
+        self.interval = interval
+        self._metrics: Dict[str, Metric] = {}
+        self._lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+
+    def counter(self, name: str, documentation: str, labels: Sequence[str] = ()) -> Counter:
+        return self._register(Counter(name, documentation, labels))
+
+    def gauge(self, name: str, documentation: str, labels: Sequence[str] = (),
+              callback: Optional[Callable[[], Any]] = None) -> Gauge:
+        return self._register(Gauge(name, documentation, labels, callback))
+
+    def histogram(self, name: str, documentation: str, labels: Sequence[str] = (),
+                  buckets: Sequence[float] = DEFAULT_BUCKETS) -> Histogram:
+        return self._register(Histogram(name, documentation, labels, buckets))
+
+    def _register(self, metric: Metric) -> Any:
+        with self._lock:
+            if metric.name in self._metrics:
+                raise ValueError(f'{metric.name} is already registered')
+            self._metrics[metric.name] = metric
+        return metric
+
+    def snapshot(self) -> Dict[str, dict]:
+        """metrics of this process, serializable to json."""
+        return {metric.name: {
+            'type': metric.type_,
+            'help': metric.documentation,
+            'labels': metric.labels,
+            'buckets': getattr(metric, 'buckets', None),
+            'samples': [[list(key), value] for key, value in metric.samples().items()],
+        } for metric in list(self._metrics.values())}
+
+    def collect(self) -> Dict[str, dict]:
+        """metrics of this process and, with the directory, of others."""
+        snapshot = self.snapshot()
+        if not self.directory:
+            return snapshot
+        snapshots = [snapshot]
+        for pid, path in self._files():
+            if pid == os.getpid():
+                continue
+            if pid is not None and not _is_alive(pid):
+                self._archive(path)
+                continue
+            other = _read(path)
+            if other:
+                snapshots.append(other)
+        archive = _read(os.path.join(self.directory, ARCHIVE_FILE))
+        if archive:
+            snapshots.append(archive)
+        return _merge(snapshots)
+
+    def expose(self) -> str:
+        """metrics in the text format."""
+        lines = []
+        for name, metric in sorted(self.collect().items()):
+            lines.append(f'# HELP {name} {_escape(metric["help"], help_=True)}')
+            lines.append(f'# TYPE {name} {metric["type"]}')
+            for key, value in metric['samples']:
+                labels = list(zip(metric['labels'], key))
+                if metric['type'] != 'histogram':
+                    lines.append(f'{name}{_format_labels(labels)} {_format_value(value)}')
+                    continue
+                cumulative = 0
+                for bound, count in zip([*metric['buckets'], float('inf')], value):
+                    cumulative += count
+                    lines.append(f'{name}_bucket{_format_labels([*labels, ("le", _format_value(bound))])} '
+                                 f'{cumulative}')
+                lines.append(f'{name}_sum{_format_labels(labels)} {_format_value(value[-1])}')
+                lines.append(f'{name}_count{_format_labels(labels)} {cumulative}')
+        return '\n'.join(lines) + '\n'
+
+    def start_saving(self, directory: str, interval: float = 1) -> None:
+        """save metrics of this process to the directory in a daemon thread."""
+        self.directory = directory
+        self.interval = interval
+        if self._thread:
+            return
+        os.makedirs(directory, exist_ok=True)
+        # the same pid of a finished process
+        own = self._path(os.getpid())
+        if os.path.exists(own):
+            self._archive(own)
+        self._thread = threading.Thread(target=self._save_periodically, name='telemetry-saver', daemon=True)
+        self._thread.start()
+        atexit.register(self.save)
+
+    def save(self) -> None:
+        path = self._path(os.getpid())
+        tmp_path = f'{path}.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(self.snapshot(), f)
+        os.replace(tmp_path, path)
+
+    def _save_periodically(self) -> None:
+        while True:
+            time.sleep(self.interval)
+            try:
+                self.save()
+            except OSError:
+                logger.exception("can't save metrics")
+
+    def _path(self, pid: int) -> str:
+        return os.path.join(self.directory, f'{pid}.json')
+
+    def _files(self) -> List[Tuple[Optional[int], str]]:
+        files = []
+        for name in os.listdir(self.directory):
+            stem, ext = os.path.splitext(name)
+            if ext == '.json' and stem.isdigit():
+                files.append((int(stem), os.path.join(self.directory, name)))
+        return files
+
+    def _archive(self, path: str) -> None:
+        """move counters and histograms of the finished process to the archive."""
+        import fcntl
+
+        with open(os.path.join(self.directory, '.lock'), 'w') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            # another process could archive it already
+            finished = _read(path)
+            if finished is None:
+                return
+            archive_path = os.path.join(self.directory, ARCHIVE_FILE)
+            finished = {name: metric for name, metric in finished.items() if metric['type'] != 'gauge'}
+            merged = _merge([_read(archive_path) or {}, finished])
+            tmp_path = f'{archive_path}.tmp'
+            with open(tmp_path, 'w') as f:
+                json.dump(merged, f)
+            os.replace(tmp_path, archive_path)
+            os.remove(path)
+
+
+def _read(path: str) -> Optional[Dict[str, dict]]:
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def _is_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def _merge(snapshots: List[Dict[str, dict]]) -> Dict[str, dict]:
+    """sum of samples with the same labels."""
+    merged: Dict[str, dict] = {}
+    for snapshot in snapshots:
+        for name, metric in snapshot.items():
+            target = merged.setdefault(name, {**metric, 'samples': {}})
+            for key, value in metric['samples']:
+                key = tuple(key)
+                current = target['samples'].get(key)
+                if current is None:
+                    target['samples'][key] = list(value) if isinstance(value, list) else value
+                elif isinstance(value, list):
+                    target['samples'][key] = [a + b for a, b in zip(current, value)]
+                else:
+                    target['samples'][key] = current + value
+    for metric in merged.values():
+        metric['samples'] = [[list(key), value] for key, value in metric['samples'].items()]
+    return merged
+
+
+def _escape(value: str, help_: bool = False) -> str:
+    value = value.replace('\\', r'\\').replace('\n', r'\n')
+    return value if help_ else value.replace('"', r'\"')
+
+
+def _format_labels(labels: List[Tuple[str, str]]) -> str:
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in labels) + '}'
+
+
+def _format_value(value: float) -> str:
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value))
+
+
+registry = Registry()
+"""metrics of the app."""
+
+operation_seconds = registry.histogram('wol_operation_seconds', "duration of operations", ('operation',))
+operations_in_progress = registry.gauge('wol_operations_in_progress', "count of running operations",
+                                        ('operation',))
+operation_errors = registry.counter('wol_operation_errors_total', "count of failed operations by errors",
+                                    ('operation', 'error'))
+ssh_errors = registry.counter('wol_ssh_errors_total', "count of failed remote operations by error codes",
+                              ('code',))
+db_query_seconds = registry.histogram('wol_db_query_seconds', "duration of database queries by statements",
+                                      ('statement',))
+http_request_seconds = registry.histogram('wol_http_request_seconds', "duration of requests by endpoints",
+                                          ('endpoint', 'method', 'status'))
+http_requests_in_progress = registry.gauge('wol_http_requests_in_progress', "count of processed requests",
+                                           ('endpoint',))
+
+
+def instrumented(operation: str) -> Callable[[Callable], Callable]:
+    """count duration, running calls and errors (by exception classes) of the function.
+
+    calls are spans of the active profile too.
+    """
+    def decorator(func: Callable) -> Callable:
+        @wraps(func)
+        def wrapped(*args, **kwargs):
+            started = time.perf_counter()
+            operations_in_progress.inc(operation=operation)
+            try:
+                with span(operation):
+                    return func(*args, **kwargs)
+            except Exception as e:
+                operation_errors.inc(operation=operation, error=type(e).__name__)
+                raise
+            finally:
+                operations_in_progress.dec(operation=operation)
+                operation_seconds.observe(time.perf_counter() - started, operation=operation)
+        return wrapped
+    return decorator
@@ -1,4 +1,6 @@
 from .core import core
+from .jobs import jobs
+from .telemetry import telemetry
 
 try:
     from .crud import crud
@@ -6,4 +8,4 @@ try:
 except ImportError:
     pass
 
-__all__ = ('core', 'crud', 'pages')
+__all__ = ('core', 'jobs', 'telemetry', 'crud', 'pages')
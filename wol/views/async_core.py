@@ -0,0 +1,212 @@
+"""
+async views of the core api for the asgi app. routes and schemas are the same as in `wol.views.core`.
+"""
+
+import json
+from dataclasses import asdict
+
+from starlette.requests import Request
+from starlette.responses import StreamingResponse
+
+from ..logic.core import (
+    RemoteExecError,
+    SshCredentials,
+    WakeupTarget,
+    check_host,
+    get_cpu_stat,
+    get_cpu_stats,
+    get_ssh_pool_stats,
+    reboot_host,
+    shutdown_host,
+    wakeup_host,
+    wakeup_hosts,
+)
+from ..logic.neighbors import neighbor_scanner
+from ..logic.probe import check_hosts_async
+from ..logic.sampler import SampleNotReady, samplers
+from .async_utils import (
+    POOL_IO,
+    POOL_SSH,
+    AsyncBlueprint,
+    as_job,
+    parse_body,
+    parse_query,
+    thread_pools,
+)
+from .core import (
+    STATS_WAIT,
+    BatchCpuStatSchema,
+    BatchWakeupSchema,
+    CheckHostSchema,
+    CheckHostsSchema,
+    HistoryPointsSchema,
+    HistorySchema,
+    ScanNetSchema,
+    SshActionSchema,
+    StatsSchema,
+    WakeupSchema,
+    _sample_not_ready,
+)
+
+__all__ = ['core']
+
+core = AsyncBlueprint('core')
+
+
+@core.route('/check_host/', methods=['POST'])
+@parse_body(CheckHostSchema())
+@as_job('check_host')
+async def ping(request: Request, body: dict):
+    """check, if host online."""
+    reached = await thread_pools.run(POOL_IO, check_host, **body)
+    return {'reached': reached}
+
+
+@core.route('/check_host/batch/', methods=['POST'])
+@parse_body(CheckHostsSchema())
+@as_job('check_host_batch')
+async def ping_batch(request: Request, body: dict):
+    """check, if hosts online. all hosts are checked concurrently in the event loop of the app."""
+    reached = await check_hosts_async(**body)
+    return {'results': [{'host': host, 'reached': value} for host, value in reached.items()]}
+
+
+@core.route('/wake/', methods=['POST'])
+@parse_body(WakeupSchema())
+async def wake(request: Request, body: dict):
+    """wakeup host by Wake on Lan."""
+    # one datagram through the kept socket doesn't block
+    try:
+        wakeup_host(**body)
+    except OSError as e:
+        return {'error': str(e)}, 500
+    return '', 204
+
+
+@core.route('/wake/batch/', methods=['POST'])
+@parse_body(BatchWakeupSchema())
+async def wake_batch(request: Request, body: dict):
+    """wakeup many hosts by Wake on Lan at once."""
+    targets = [WakeupTarget(**target) for target in body['targets']]
+    results = await thread_pools.run(POOL_IO, wakeup_hosts, targets, repeat=body['repeat'], rate=body['rate'],
+                                     interval=body['interval'])
+    return {'results': results}
+
+
+@core.route('/cpu_stat/', methods=['POST'])
+@parse_body(SshActionSchema())
+@as_job('cpu_stat')
+async def cpu_stat(request: Request, body: dict):
+    """cpu load of remote host (ssh)."""
+    try:
+        stat = await thread_pools.run(POOL_SSH, get_cpu_stat, SshCredentials(**body), precision=3)
+    except RemoteExecError as e:
+        return e.as_dict(), 400
+    return stat._asdict()
+
+
+@core.route('/cpu_stat/batch/', methods=['POST'])
+@parse_body(BatchCpuStatSchema())
+@as_job('cpu_stat_batch')
+async def cpu_stat_batch(request: Request, body: dict):
+    """cpu load of many remote hosts (ssh), measured in parallel."""
+    stats = await thread_pools.run(POOL_SSH, get_cpu_stats, [SshCredentials(**host) for host in body['hosts']],
+                                   precision=body['precision'])
+    results = []
+    for host, stat in zip(body['hosts'], stats):
+        if isinstance(stat, RemoteExecError):
+            results.append({'host': host['host'], 'error': stat.as_dict()})
+        else:
+            results.append({'host': host['host'], 'stat': stat._asdict()})
+    return {'results': results}
+
+
+@core.route('/stats/', methods=['POST'])
+@parse_body(StatsSchema())
+async def stats(request: Request, body: dict):
+    """the last sample of cpu, memory and load of remote host (ssh)."""
+    precision, interval = body.pop('precision'), body.pop('interval')
+    sampler = samplers.get(SshCredentials(**body), interval)
+    try:
+        sample = await thread_pools.run(POOL_SSH, sampler.latest, STATS_WAIT)
+    except SampleNotReady:
+        return _sample_not_ready(interval)
+    except RemoteExecError as e:
+        return e.as_dict(), 400
+    return sample.as_dict(precision)
+
+
+@core.route('/stats/stream/', methods=['POST'])
+@parse_body(StatsSchema())
+async def stats_stream(request: Request, body: dict):
+    """samples of cpu, memory and load of remote host (ssh) as server-sent events."""
+    precision, interval = body.pop('precision'), body.pop('interval')
+    sampler = samplers.get(SshCredentials(**body), interval)
+
+    def events():
+        try:
+            for sample in sampler.stream():
+                yield f'data: {json.dumps(sample.as_dict(precision))}\n\n'
+        except RemoteExecError as e:
+            yield f'event: error\ndata: {json.dumps(e.as_dict())}\n\n'
+
+    return StreamingResponse(thread_pools.stream(events), media_type='text/event-stream')
+
+
+@core.route('/stats/history/', methods=['GET'])
+@parse_query(HistoryPointsSchema())
+async def stats_history(request: Request, query: dict):
+    """collected samples of the host field. rollups (1m, 5m, 1h) have avg, max and p95."""
+    return {'points': samplers.store.query(**query)}
+
+
+@core.route('/stats/history/aggregate/', methods=['GET'])
+@parse_query(HistorySchema())
+async def stats_history_aggregate(request: Request, query: dict):
+    """avg, max and p95 of collected samples of the host field."""
+    aggregate = samplers.store.aggregate(**query)
+    if not aggregate:
+        return {'error': 'no data'}, 404
+    return aggregate
+
+
+@core.route('/reboot/', methods=['POST'])
+@parse_body(SshActionSchema())
+async def reboot(request: Request, body: dict):
+    """reboot the remote host (ssh)."""
+    try:
+        await thread_pools.run(POOL_SSH, reboot_host, SshCredentials(**body))
+    except RemoteExecError as e:
+        return e.as_dict(), 400
+    return '', 204
+
+
+@core.route('/shutdown/', methods=['POST'])
+@parse_body(SshActionSchema())
+async def shutdown(request: Request, body: dict):
+    """immediately shutdown the remote host (ssh)."""
+    try:
+        await thread_pools.run(POOL_SSH, shutdown_host, SshCredentials(**body))
+    except RemoteExecError as e:
+        return e.as_dict(), 400
+    return '', 204
+
+
+@core.route('/scan_net/', methods=['POST'])
+@parse_query(ScanNetSchema())
+@as_job('scan_net')
+async def scan_net(request: Request, query: dict):
+    """search all hosts in local net. see `wol.views.core.scan_net`."""
+    iface = query.pop('iface')
+    try:
+        neighbors = await thread_pools.run(POOL_IO, neighbor_scanner.scan, **query,
+                                           ifaces=iface.split(',') if iface else None)
+    except ValueError as e:
+        return {'net': [str(e)]}, 400
+    return {'hosts': [neighbor.as_dict() for neighbor in neighbors]}
+
+
+@core.route('/ssh_pool/', methods=['GET'])
+async def ssh_pool_stats(request: Request):
+    """usage counters of the ssh connection pool."""
+    return asdict(get_ssh_pool_stats())
@@ -0,0 +1,340 @@
+"""
+async views of the crud api for the asgi app. routes and schemas are the same as in `wol.views.crud`.
+queries run in the `db` pool, actions on hosts - in the `ssh` and `io` ones.
+"""
+
+import io
+import json
+from typing import (
+    AsyncIterator,
+    Callable,
+    Iterator,
+    Optional,
+)
+from urllib.parse import urlencode
+
+from peewee import IntegrityError
+from starlette.requests import Request
+from starlette.responses import Response, StreamingResponse
+
+from ..logic.crud import (
+    BatchWakeAndWaitSchema,
+    BatchWakeupTargetsSchema,
+    CheckTargetSchema,
+    CheckTargetsSchema,
+    CredentialsQuerySchema,
+    CredentialsSchema,
+    FleetActionSchema,
+    ScheduleSchema,
+    SchedulesQuerySchema,
+    TargetSchema,
+    TargetsQuerySchema,
+    WakeAndWaitSchema,
+    check_all_targets,
+    check_target_by_id,
+    create_credentials,
+    create_schedule,
+    create_target,
+    delete_credentials_by_id,
+    delete_schedule_by_id,
+    delete_target_by_id,
+    edit_credentials_by_id,
+    edit_schedule_by_id,
+    edit_target_by_id,
+    get_all_schedules,
+    get_credentials_by_id,
+    get_credentials_page,
+    get_schedule_by_id,
+    get_scheduler_stats,
+    get_target_by_id,
+    get_target_by_name,
+    get_targets_page,
+    iter_credentials,
+    iter_targets,
+    reboot_targets,
+    shutdown_targets,
+    wake_and_wait_target_by_id,
+    wake_and_wait_targets,
+    wakeup_target_by_id,
+    wakeup_targets,
+)
+from ..logic.inventory import export_targets, import_targets, read_targets
+from ..models import db_pool_stats
+from .async_utils import (
+    POOL_DB,
+    POOL_IO,
+    POOL_SSH,
+    AsyncBlueprint,
+    as_job,
+    parse_body,
+    parse_query,
+    thread_pools,
+)
+from .crud import MIMETYPES, InventoryFormatSchema
+
+__all__ = ['crud']
+
+crud = AsyncBlueprint('crud')
+
+
+@crud.errorhandler(IntegrityError)
+def handle_integrity_error(error: IntegrityError):
+    """e.g. a duplicate mac."""
+    return {'error': str(error)}, 409
+
+
+def _stream_json_list(items: Callable[..., Iterator[dict]], **kwargs) -> Response:
+    """json array, sent item by item, so memory doesn't depend on its length."""
+    async def generate() -> AsyncIterator[str]:
+        yield '['
+        first = True
+        async for item in thread_pools.stream(items, **kwargs):
+            yield ('' if first else ',') + json.dumps(item)
+            first = False
+        yield ']'
+    return StreamingResponse(generate(), media_type='application/json')
+
+
+async def _events_response(request: Request, events: Iterator[dict], stream: bool):
+    """progress events as json lines, while they happen, or only results of the last event.
+
+    results can be waited in background by the `async` query parameter, it's ignored for the stream.
+    """
+    if stream:
+        lines = (json.dumps(event) + '\n' async for event in thread_pools.stream(iter, events))
+        return StreamingResponse(lines, media_type='application/x-ndjson')
+    return await _wait_results(request, events=events)
+
+
+@as_job('wake_and_wait')
+async def _wait_results(request: Request, events: Iterator[dict]):
+    done = await thread_pools.run(POOL_IO, _last_event, events)
+    return {'results': done['results']}
+
+
+def _last_event(events: Iterator[dict]) -> dict:
+    *_, done = events
+    return done
+
+
+def _page_response(request: Request, items: list, next_after: Optional[int]):
+    """json array with a link to the next page in the `Link` header, if there is one."""
+    headers = {}
+    if next_after is not None:
+        url = f'{request.url.path}?{urlencode({**request.query_params, "after": next_after})}'
+        headers['Link'] = f'<{url}>; rel="next"'
+    return Response(json.dumps(items), media_type='application/json', headers=headers)
+
+
+@crud.route('/targets/', methods=['GET'])
+@parse_query(TargetsQuerySchema())
+async def get_targets(request: Request, query: dict):
+    """targets, ordered by id. a page with `limit`, otherwise all of them are streamed."""
+    limit = query.pop('limit')
+    try:
+        if limit:
+            return _page_response(request, *await thread_pools.run(POOL_DB, get_targets_page, limit, **query))
+        # wrong fields are found before the response is started
+        iter_targets(**query)
+        return _stream_json_list(iter_targets, **query)
+    except ValueError as e:
+        return {'fields': [str(e)]}, 400
+
+
+@crud.route('/targets/', methods=['POST'])
+@parse_body(TargetSchema())
+async def create_target_(request: Request, body: dict):
+    created = await thread_pools.run(POOL_DB, create_target, **body)
+    return {'id': created}, 201
+
+
+@crud.route('/targets/import/', methods=['POST'])
+@parse_query(InventoryFormatSchema())
+async def import_targets_(request: Request, query: dict):
+    """create targets from csv or json body, targets with existing macs are updated."""
+    mimetype = request.headers.get('content-type', '').split(';')[0].strip()
+    format_ = query['format'] or ('csv' if mimetype == MIMETYPES['csv'] else 'json')
+    stream = io.TextIOWrapper(io.BytesIO(await request.body()), encoding='utf-8', newline='')
+    try:
+        return await thread_pools.run(POOL_DB, lambda: import_targets(read_targets(stream, format_)))
+    except ValueError as e:
+        return {'body': [str(e)]}, 400
+
+
+@crud.route('/targets/export/', methods=['GET'])
+@parse_query(InventoryFormatSchema())
+async def export_targets_(request: Request, query: dict):
+    """all targets as csv or json (default), streamed."""
+    format_ = query['format'] or 'json'
+    return StreamingResponse(thread_pools.stream(export_targets, format_), media_type=MIMETYPES[format_],
+                             headers={'Content-Disposition': f'attachment; filename=targets.{format_}'})
+
+
+@crud.route('/targets/{pk:int}/', methods=['GET'])
+async def get_target_by_id_(request: Request, pk: int):
+    return await thread_pools.run(POOL_DB, get_target_by_id, pk)
+
+
+@crud.route('/targets/{name}/', methods=['GET'])
+async def get_target_by_name_(request: Request, name: str):
+    return await thread_pools.run(POOL_DB, get_target_by_name, name)
+
+
+@crud.route('/targets/{pk:int}/', methods=['PUT', 'PATCH'])
+@parse_body(TargetSchema())
+async def update_target(request: Request, pk: int, body: dict):
+    await thread_pools.run(POOL_DB, edit_target_by_id, pk, **body)
+    return '', 204
+
+
+@crud.route('/targets/{pk:int}/', methods=['DELETE'])
+async def delete_target(request: Request, pk: int):
+    await thread_pools.run(POOL_DB, delete_target_by_id, pk)
+    return '', 204
+
+
+@crud.route('/targets/{pk:int}/wake/', methods=['POST'])
+async def wakeup_target(request: Request, pk: int):
+    await thread_pools.run(POOL_DB, wakeup_target_by_id, pk)
+    return '', 204
+
+
+@crud.route('/targets/wake/', methods=['POST'])
+@parse_body(BatchWakeupTargetsSchema())
+async def wakeup_targets_(request: Request, body: dict):
+    results = await thread_pools.run(POOL_IO, wakeup_targets, **body)
+    return {'results': results}
+
+
+@crud.route('/targets/{pk:int}/wake_and_wait/', methods=['POST'])
+@parse_body(WakeAndWaitSchema())
+async def wake_and_wait_target(request: Request, pk: int, body: dict):
+    """wakeup the target and wait, until it's reachable."""
+    stream = body.pop('stream')
+    # a missing target is found before the response is started
+    events = await thread_pools.run(POOL_DB, wake_and_wait_target_by_id, pk, **body)
+    return await _events_response(request, events, stream)
+
+
+@crud.route('/targets/wake_and_wait/', methods=['POST'])
+@parse_body(BatchWakeAndWaitSchema())
+async def wake_and_wait_targets_(request: Request, body: dict):
+    """wakeup targets at once and wait, until they are reachable."""
+    stream = body.pop('stream')
+    events = await thread_pools.run(POOL_DB, wake_and_wait_targets, **body)
+    return await _events_response(request, events, stream)
+
+
+@crud.route('/targets/check/', methods=['POST'])
+@parse_body(CheckTargetsSchema())
+async def check_all_targets_(request: Request, body: dict):
+    results = await thread_pools.run(POOL_IO, check_all_targets, **body)
+    return {'results': results}
+
+
+@crud.route('/targets/{pk:int}/check/', methods=['POST'])
+@parse_query(CheckTargetSchema())
+async def check_target(request: Request, pk: int, query: dict):
+    return await thread_pools.run(POOL_IO, check_target_by_id, pk, **query)
+
+
+@crud.route('/targets/reboot/', methods=['POST'])
+@parse_body(FleetActionSchema())
+@as_job('reboot_targets')
+async def reboot_targets_(request: Request, body: dict):
+    results = await thread_pools.run(POOL_SSH, reboot_targets, **body)
+    return {'results': results}
+
+
+@crud.route('/targets/shutdown/', methods=['POST'])
+@parse_body(FleetActionSchema())
+@as_job('shutdown_targets')
+async def shutdown_targets_(request: Request, body: dict):
+    results = await thread_pools.run(POOL_SSH, shutdown_targets, **body)
+    return {'results': results}
+
+
+@crud.route('/credentials/', methods=['GET'])
+@parse_query(CredentialsQuerySchema())
+async def get_credentials_list(request: Request, query: dict):
+    """credentials, ordered by id. a page with `limit`, otherwise all of them are streamed."""
+    limit = query.pop('limit')
+    try:
+        if limit:
+            return _page_response(request, *await thread_pools.run(POOL_DB, get_credentials_page, limit, **query))
+        iter_credentials(**query)
+        return _stream_json_list(iter_credentials, **query)
+    except ValueError as e:
+        return {'fields': [str(e)]}, 400
+
+
+@crud.route('/credentials/', methods=['POST'])
+@parse_body(CredentialsSchema())
+async def create_credentials_(request: Request, body: dict):
+    created = await thread_pools.run(POOL_DB, create_credentials, **body)
+    return {'id': created}, 201
+
+
+@crud.route('/credentials/{pk:int}/', methods=['GET'])
+async def get_credentials(request: Request, pk: int):
+    return await thread_pools.run(POOL_DB, get_credentials_by_id, pk)
+
+
+@crud.route('/credentials/{pk:int}/', methods=['PUT', 'PATCH'])
+@parse_body(CredentialsSchema())
+async def update_credentials(request: Request, pk: int, body: dict):
+    await thread_pools.run(POOL_DB, edit_credentials_by_id, pk, **body)
+    return '', 204
+
+
+@crud.route('/credentials/{pk:int}/', methods=['DELETE'])
+async def delete_credentials(request: Request, pk: int):
+    await thread_pools.run(POOL_DB, delete_credentials_by_id, pk)
+    return '', 204
+
+
+@crud.route('/schedules/', methods=['GET'])
+@parse_query(SchedulesQuerySchema())
+async def get_schedules(request: Request, query: dict):
+    return Response(json.dumps(await thread_pools.run(POOL_DB, get_all_schedules, **query)),
+                    media_type='application/json')
+
+
+@crud.route('/schedules/', methods=['POST'])
+@parse_body(ScheduleSchema())
+async def create_schedule_(request: Request, body: dict):
+    created = await thread_pools.run(POOL_DB, create_schedule, **body)
+    return {'id': created}, 201
+
+
+@crud.route('/schedules/{pk:int}/', methods=['GET'])
+async def get_schedule(request: Request, pk: int):
+    return await thread_pools.run(POOL_DB, get_schedule_by_id, pk)
+
+
+@crud.route('/schedules/{pk:int}/', methods=['PUT', 'PATCH'])
+@parse_body(ScheduleSchema(partial=True))
+async def update_schedule(request: Request, pk: int, body: dict):
+    await thread_pools.run(POOL_DB, edit_schedule_by_id, pk, **body)
+    return '', 204
+
+
+@crud.route('/schedules/{pk:int}/', methods=['DELETE'])
+async def delete_schedule(request: Request, pk: int):
+    await thread_pools.run(POOL_DB, delete_schedule_by_id, pk)
+    return '', 204
+
+
+@crud.route('/scheduler/', methods=['GET'])
+async def get_scheduler_stats_(request: Request):
+    """state of the scheduler of this process. `running` is false, if it works in the separate process."""
+    return get_scheduler_stats()
+
+
+@crud.route('/db_pool/', methods=['GET'])
+async def db_pool_stats_(request: Request):
+    """usage of the database connection pool."""
+    stats = db_pool_stats()
+    if stats is None:
+        return {'error': 'the database is not pooled'}, 404
+    return stats
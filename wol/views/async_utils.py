@@ -0,0 +1,269 @@
+"""
+helpers of the asgi api: blueprints of async views, parsing of requests and thread pools for blocking calls.
+
+async views return the same values as flask ones - a dict, a list, `''`, a response,
+or a tuple of a body, a status and optionally headers.
+"""
+
+import asyncio
+import json
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import ExitStack
+from functools import partial, wraps
+from typing import (
+    Any,
+    AsyncIterator,
+    Callable,
+    Dict,
+    Iterable,
+    List,
+    Optional,
+    Type,
+)
+
+from marshmallow import Schema, ValidationError, fields
+from starlette.requests import Request
+from starlette.responses import JSONResponse, Response
+from starlette.routing import Route
+from werkzeug.exceptions import HTTPException
+
+from ..compiled_schema import compile_schema
+from ..decorators import _view_result
+from ..logic.jobs import JobQueueFull, job_queue
+from ..profiling import span
+from ..telemetry import http_request_seconds, http_requests_in_progress
+
+__all__ = ['AsyncBlueprint', 'ThreadPools', 'thread_pools', 'parse_body', 'parse_query', 'as_job',
+           'to_response', 'app_error_handlers', 'POOL_DB', 'POOL_SSH', 'POOL_IO']
+
+POOL_DB = 'db'
+POOL_SSH = 'ssh'
+POOL_IO = 'io'
+
+ErrorHandler = Callable[[Exception], Any]
+
+app_error_handlers: Dict[Type[Exception], ErrorHandler] = {}
+"""handlers of errors of all async views, e.g. an exhausted database pool."""
+
+
+class ThreadPools:
+    """bounded thread pools for blocking calls of async views, so slow ssh hosts don't take threads of queries.
+
+    calls are made in the flask app context with a database connection, like flask views.
+
+    :param sizes: max threads by pools - `db` for queries, `ssh` for remote commands, `io` for probes and the rest.
+    """
+
+    def __init__(self, **sizes: int):
+        self.sizes = {POOL_DB: 20, POOL_SSH: 64, POOL_IO: 32, **sizes}
+        # the flask app for `abort`, `make_response`, etc. and its database, if it's used
+        self.app = None
+        self.database = None
+        self._executors: Dict[str, ThreadPoolExecutor] = {}
+        self._lock = threading.Lock()
+
+    async def run(self, pool: str, func: Callable, *args, **kwargs) -> Any:
+        """result of the blocking call in the pool."""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor(pool), partial(self._call, func, *args, **kwargs))
+
+    async def stream(self, func: Callable[..., Iterable], *args, **kwargs) -> AsyncIterator:
+        """items of the blocking iterator, read by a separate thread.
+
+        streams are long (server-sent events, exports), so they don't take threads of pools.
+        the thread is stopped by the next item after the client is gone.
+        """
+        loop = asyncio.get_running_loop()
+        items: asyncio.Queue = asyncio.Queue(maxsize=16)
+        stopped = threading.Event()
+        end = object()
+
+        def produce():
+            error = None
+            try:
+                with self._context():
+                    for item in func(*args, **kwargs):
+                        if stopped.is_set():
+                            return
+                        asyncio.run_coroutine_threadsafe(items.put((item, None)), loop).result()
+            except Exception as e:
+                error = e
+            if not stopped.is_set():
+                asyncio.run_coroutine_threadsafe(items.put((end, error)), loop)
+
+        threading.Thread(target=produce, name='async-stream', daemon=True).start()
+        try:
+            while True:
+                item, error = await items.get()
+                if item is end:
+                    if error:
+                        raise error
+                    return
+                yield item
+        finally:
+            stopped.set()
+            # the producer may wait for a free place
+            while not items.empty():
+                items.get_nowait()
+
+    def shutdown(self) -> None:
+        with self._lock:
+            executors, self._executors = self._executors, {}
+        for executor in executors.values():
+            executor.shutdown(wait=False)
+
+    def executor(self, pool: str) -> ThreadPoolExecutor:
+        """the pool, started by the first call."""
+        with self._lock:
+            if pool not in self._executors:
+                self._executors[pool] = ThreadPoolExecutor(self.sizes[pool], thread_name_prefix=f'async-{pool}')
+            return self._executors[pool]
+
+    def _call(self, func: Callable, *args, **kwargs) -> Any:
+        with self._context():
+            return func(*args, **kwargs)
+
+    def _context(self) -> ExitStack:
+        stack = ExitStack()
+        if self.app is not None:
+            stack.enter_context(self.app.app_context())
+        if self.database is not None:
+            stack.enter_context(self.database.connection_context())
+        return stack
+
+
+thread_pools = ThreadPools()
+"""pools of the asgi app, configured by `create_asgi_app`."""
+
+
+def to_response(result: Any) -> Response:
+    """response by the value, returned by a view."""
+    if isinstance(result, Response):
+        return result
+    status, headers = 200, None
+    if isinstance(result, tuple):
+        result, status, *rest = result
+        headers = rest[0] if rest else None
+    if result == '' or result is None:
+        return Response(status_code=status, headers=headers)
+    return JSONResponse(result, status_code=status, headers=headers)
+
+
+def _error_response(error: Exception, handlers: Dict[Type[Exception], ErrorHandler]) -> Optional[Response]:
+    for error_class in type(error).__mro__:
+        handler = handlers.get(error_class) or app_error_handlers.get(error_class)
+        if handler:
+            return to_response(handler(error))
+    if isinstance(error, ValidationError):
+        return JSONResponse(error.messages, status_code=400)
+    if isinstance(error, HTTPException):
+        # `abort` of the shared logic
+        response = error.get_response()
+        return Response(response.get_data(), status_code=response.status_code, media_type=response.mimetype)
+    if isinstance(error, NotImplementedError):
+        return Response(status_code=501)
+    return None
+
+
+class AsyncBlueprint:
+    """routes of async views with the same endpoint names, metrics and error handling, as a flask blueprint."""
+
+    def __init__(self, name: str):
+        self.name = name
+        self._views: List[tuple] = []
+        self._error_handlers: Dict[Type[Exception], ErrorHandler] = {}
+
+    def route(self, rule: str, methods: List[str]) -> Callable[[Callable], Callable]:
+        """register the view. the rule is in the starlette syntax - `/targets/{pk:int}/`."""
+        def decorator(func: Callable) -> Callable:
+            self._views.append((rule, methods, func))
+            return func
+        return decorator
+
+    def errorhandler(self, error_class: Type[Exception]) -> Callable[[ErrorHandler], ErrorHandler]:
+        def decorator(func: ErrorHandler) -> ErrorHandler:
+            self._error_handlers[error_class] = func
+            return func
+        return decorator
+
+    def routes(self, url_prefix: str = '') -> List[Route]:
+        return [Route(url_prefix + rule, self._endpoint(func), methods=methods, name=f'{self.name}.{func.__name__}')
+                for rule, methods, func in self._views]
+
+    def _endpoint(self, func: Callable) -> Callable[[Request], Any]:
+        name = f'{self.name}.{func.__name__}'
+
+        async def endpoint(request: Request) -> Response:
+            started = time.perf_counter()
+            http_requests_in_progress.inc(endpoint=name)
+            status = 500
+            try:
+                try:
+                    response = to_response(await func(request, **request.path_params))
+                except Exception as e:
+                    response = _error_response(e, self._error_handlers)
+                    if response is None:
+                        raise
+                status = response.status_code
+                return response
+            finally:
+                http_requests_in_progress.dec(endpoint=name)
+                http_request_seconds.observe(time.perf_counter() - started, endpoint=name,
+                                             method=request.method, status=status)
+        return endpoint
+
+
+def parse_body(schema: Schema) -> Callable[[Callable], Callable]:
+    """parse the request json body according to the specified scheme."""
+    compiled = compile_schema(schema)
+
+    def decorator(func: Callable) -> Callable:
+        @wraps(func)
+        async def wrapped(request: Request, **kwargs):
+            try:
+                data = json.loads(await request.body())
+            except ValueError:
+                return {'error': 'the body is not json'}, 400
+            with span('schema.load'):
+                data = compiled.load(data)
+            return await func(request, **kwargs, body=data)
+        return wrapped
+    return decorator
+
+
+def parse_query(schema: Schema) -> Callable[[Callable], Callable]:
+    """parse the request query parameters according to the specified scheme."""
+    def decorator(func: Callable) -> Callable:
+        @wraps(func)
+        async def wrapped(request: Request, **kwargs):
+            with span('schema.load'):
+                data = schema.load(request.query_params)
+            return await func(request, **kwargs, query=data)
+        return wrapped
+    return decorator
+
+
+def as_job(name: str) -> Callable[[Callable], Callable]:
+    """run the view in background, if the `async` query parameter is set. see `wol.decorators.as_job`.
+
+    the view runs by its own event loop in the thread of the job queue.
+    """
+    def decorator(func: Callable) -> Callable:
+        @wraps(func)
+        async def wrapped(request: Request, **kwargs):
+            if not fields.Bool().deserialize(request.query_params.get('async', False)):
+                return await func(request, **kwargs)
+            try:
+                job = job_queue.submit(name, _view_result, _run_view, func, request, **kwargs)
+            except JobQueueFull:
+                return {'error': 'too many jobs'}, 503, {'Retry-After': '5'}
+            location = request.scope.get('root_path', '') + f'/api/jobs/{job.id}/'
+            return job.as_dict(), 202, {'Location': location}
+        return wrapped
+    return decorator
+
+
+def _run_view(func: Callable, *args, **kwargs) -> Any:
+    return asyncio.run(func(*args, **kwargs))
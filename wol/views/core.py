@@ -1,7 +1,15 @@
-from flask import Blueprint
-from marshmallow import Schema, fields
+import json
+from dataclasses import asdict
 
-from ..decorators import parse_body
+from flask import Blueprint, Response
+from marshmallow import (
+    EXCLUDE,
+    Schema,
+    fields,
+    validate,
+)
+
+from ..decorators import as_job, parse_body, parse_query
 from ..fields import (
     HostField,
     IpAddressField,
@@ -11,15 +19,29 @@ from ..fields import (
 from ..logic.core import (
     RemoteExecError,
     SshCredentials,
+    WakeupTarget,
     check_host,
     get_cpu_stat,
+    get_cpu_stats,
+    get_ssh_pool_stats,
     reboot_host,
-    scan_local_net,
     shutdown_host,
     wakeup_host,
+    wakeup_hosts,
 )
+from ..logic.neighbors import SCAN_MODES, neighbor_scanner
+from ..logic.probe import METHODS, check_hosts
+from ..logic.sampler import SAMPLE_FIELDS, SampleNotReady, samplers
+from ..logic.timeseries import RESOLUTIONS
+from .telemetry import instrument_blueprint
 
 core = Blueprint('core', __name__)
+instrument_blueprint(core)
+
+# 4 or 6 bytes in hex, optionally separated like a mac
+SECURE_ON_PASSWORD = r'^[0-9a-fA-F]{2}([:-]?[0-9a-fA-F]{2}){3}(([:-]?[0-9a-fA-F]{2}){2})?$'
+# seconds to wait for the first sample of a new sampler
+STATS_WAIT = 5
 
 
 class SshActionSchema(Schema):
@@ -29,34 +51,106 @@ class SshActionSchema(Schema):
     password = fields.String()
 
 
+class BatchCpuStatSchema(Schema):
+    hosts = fields.List(fields.Nested(SshActionSchema()), required=True, validate=validate.Length(min=1))
+    precision = fields.Integer(missing=3, validate=validate.Range(min=0, max=10))
+
+
+class StatsSchema(SshActionSchema):
+    interval = fields.Float(missing=1, validate=validate.Range(min=0.1, max=3600))
+    precision = fields.Integer(missing=3, validate=validate.Range(min=0, max=10))
+
+
+class HistorySchema(Schema):
+    host = fields.String(required=True)
+    field = fields.String(required=True, validate=validate.OneOf(SAMPLE_FIELDS))
+    start = fields.Float(missing=None)
+    end = fields.Float(missing=None)
+
+
+class HistoryPointsSchema(HistorySchema):
+    resolution = fields.String(missing='raw', validate=validate.OneOf(RESOLUTIONS))
+
+
 class WakeupSchema(Schema):
     mac = MacField(required=True)
     host = IpAddressField(missing='255.255.255.255')
     port = PortField(missing=9)
+    iface = fields.String(missing=None)
+    password = fields.String(missing=None, validate=validate.Regexp(SECURE_ON_PASSWORD))
+
+
+class BatchWakeupSchema(Schema):
+    targets = fields.List(fields.Nested(WakeupSchema()), required=True, validate=validate.Length(min=1))
+    repeat = fields.Integer(missing=1, validate=validate.Range(min=1, max=100))
+    interval = fields.Float(missing=0, validate=validate.Range(min=0, max=10))
+    rate = fields.Float(missing=None, validate=validate.Range(min=0, min_inclusive=False))
 
 
 class CheckHostSchema(Schema):
     host = HostField(required=True)
 
 
+class CheckHostsSchema(Schema):
+    hosts = fields.List(HostField(), required=True, validate=validate.Length(min=1))
+    port = PortField(missing=80)
+    method = fields.String(missing='auto', validate=validate.OneOf(METHODS))
+    timeout = fields.Float(missing=2, validate=validate.Range(min=0, max=60, min_inclusive=False))
+    concurrency = fields.Integer(missing=100, validate=validate.Range(min=1, max=1000))
+
+
+class ScanNetSchema(Schema):
+    net = fields.String(missing=None)
+    mode = fields.String(missing='incremental', validate=validate.OneOf(SCAN_MODES))
+    # comma separated names or prefixes
+    iface = fields.String(missing=None)
+
+    class Meta:
+        # `async` is handled by `as_job`
+        unknown = EXCLUDE
+
+
 @core.route('/check_host/', methods=['POST'])
 @parse_body(CheckHostSchema())
+@as_job('check_host')
 def ping(body: dict):
     """check, if host online."""
     reached = check_host(**body)
     return {'reached': reached}
 
 
+@core.route('/check_host/batch/', methods=['POST'])
+@parse_body(CheckHostsSchema())
+@as_job('check_host_batch')
+def ping_batch(body: dict):
+    """check, if hosts online. all hosts are checked concurrently."""
+    reached = check_hosts(**body)
+    return {'results': [{'host': host, 'reached': value} for host, value in reached.items()]}
+
+
 @core.route('/wake/', methods=['POST'])
 @parse_body(WakeupSchema())
 def wake(body: dict):
     """wakeup host by Wake on Lan."""
-    wakeup_host(**body)
+    try:
+        wakeup_host(**body)
+    except OSError as e:
+        return {'error': str(e)}, 500
     return '', 204
 
 
+@core.route('/wake/batch/', methods=['POST'])
+@parse_body(BatchWakeupSchema())
+def wake_batch(body: dict):
+    """wakeup many hosts by Wake on Lan at once."""
+    targets = [WakeupTarget(**target) for target in body['targets']]
+    results = wakeup_hosts(targets, repeat=body['repeat'], rate=body['rate'], interval=body['interval'])
+    return {'results': results}
+
+
 @core.route('/cpu_stat/', methods=['POST'])
 @parse_body(SshActionSchema())
+@as_job('cpu_stat')
 def cpu_stat(body: dict):
     """cpu load of remote host (ssh)."""
     creds = SshCredentials(**body)
@@ -67,6 +161,78 @@ def cpu_stat(body: dict):
     return stat._asdict()
 
 
+@core.route('/cpu_stat/batch/', methods=['POST'])
+@parse_body(BatchCpuStatSchema())
+@as_job('cpu_stat_batch')
+def cpu_stat_batch(body: dict):
+    """cpu load of many remote hosts (ssh), measured in parallel."""
+    stats = get_cpu_stats([SshCredentials(**host) for host in body['hosts']], precision=body['precision'])
+    results = []
+    for host, stat in zip(body['hosts'], stats):
+        if isinstance(stat, RemoteExecError):
+            results.append({'host': host['host'], 'error': stat.as_dict()})
+        else:
+            results.append({'host': host['host'], 'stat': stat._asdict()})
+    return {'results': results}
+
+
+@core.route('/stats/', methods=['POST'])
+@parse_body(StatsSchema())
+def stats(body: dict):
+    """the last sample of cpu, memory and load of remote host (ssh).
+
+    sampling is started by the first request and stops, if nobody asks for samples.
+    """
+    precision, interval = body.pop('precision'), body.pop('interval')
+    sampler = samplers.get(SshCredentials(**body), interval)
+    try:
+        sample = sampler.latest(STATS_WAIT)
+    except SampleNotReady:
+        return _sample_not_ready(interval)
+    except RemoteExecError as e:
+        return e.as_dict(), 400
+    return sample.as_dict(precision)
+
+
+def _sample_not_ready(interval: float):
+    """the first sample is expected in about the interval."""
+    return {'error': 'no samples yet'}, 503, {'Retry-After': str(max(round(interval), 1))}
+
+
+@core.route('/stats/stream/', methods=['POST'])
+@parse_body(StatsSchema())
+def stats_stream(body: dict):
+    """samples of cpu, memory and load of remote host (ssh) as server-sent events."""
+    precision, interval = body.pop('precision'), body.pop('interval')
+    sampler = samplers.get(SshCredentials(**body), interval)
+
+    def events():
+        try:
+            for sample in sampler.stream():
+                yield f'data: {json.dumps(sample.as_dict(precision))}\n\n'
+        except RemoteExecError as e:
+            yield f'event: error\ndata: {json.dumps(e.as_dict())}\n\n'
+
+    return Response(events(), mimetype='text/event-stream')
+
+
+@core.route('/stats/history/', methods=['GET'])
+@parse_query(HistoryPointsSchema())
+def stats_history(query: dict):
+    """collected samples of the host field. rollups (1m, 5m, 1h) have avg, max and p95."""
+    return {'points': samplers.store.query(**query)}
+
+
+@core.route('/stats/history/aggregate/', methods=['GET'])
+@parse_query(HistorySchema())
+def stats_history_aggregate(query: dict):
+    """avg, max and p95 of collected samples of the host field."""
+    aggregate = samplers.store.aggregate(**query)
+    if not aggregate:
+        return {'error': 'no data'}, 404
+    return aggregate
+
+
 @core.route('/reboot/', methods=['POST'])
 @parse_body(SshActionSchema())
 def reboot(body: dict):
@@ -92,6 +258,23 @@ def shutdown(body: dict):
 
 
 @core.route('/scan_net/', methods=['POST'])
-def scan_net():
-    """search all hosts in local net."""
-    return {'hosts': scan_local_net()}
+@parse_query(ScanNetSchema())
+@as_job('scan_net')
+def scan_net(query: dict):
+    """search all hosts in local net.
+
+    only unknown and stale addresses are probed by default. `cached` mode returns known hosts without probing.
+    nets of all interfaces (or the selected ones) are scanned concurrently.
+    """
+    iface = query.pop('iface')
+    try:
+        neighbors = neighbor_scanner.scan(**query, ifaces=iface.split(',') if iface else None)
+    except ValueError as e:
+        return {'net': [str(e)]}, 400
+    return {'hosts': [neighbor.as_dict() for neighbor in neighbors]}
+
+
+@core.route('/ssh_pool/', methods=['GET'])
+def ssh_pool_stats():
+    """usage counters of the ssh connection pool."""
+    return asdict(get_ssh_pool_stats())
@@ -1,30 +1,131 @@
-from flask import Blueprint, jsonify
+import io
+import json
+from typing import Iterable, Iterator, Optional
 
-from ..decorators import parse_body
+from flask import (
+    Blueprint,
+    Response,
+    request,
+    stream_with_context,
+    url_for,
+)
+from marshmallow import Schema, fields, validate
+from peewee import IntegrityError
+
+from ..decorators import as_job, parse_body, parse_query
 from ..logic.crud import (
+    BatchWakeAndWaitSchema,
+    BatchWakeupTargetsSchema,
+    CheckTargetSchema,
+    CheckTargetsSchema,
+    CredentialsQuerySchema,
     CredentialsSchema,
+    FleetActionSchema,
+    ScheduleSchema,
+    SchedulesQuerySchema,
     TargetSchema,
+    TargetsQuerySchema,
+    WakeAndWaitSchema,
+    check_all_targets,
     check_target_by_id,
     create_credentials,
+    create_schedule,
     create_target,
     delete_credentials_by_id,
+    delete_schedule_by_id,
     delete_target_by_id,
     edit_credentials_by_id,
+    edit_schedule_by_id,
     edit_target_by_id,
-    get_all_credentials,
-    get_all_targets,
+    get_all_schedules,
     get_credentials_by_id,
+    get_credentials_page,
+    get_schedule_by_id,
+    get_scheduler_stats,
     get_target_by_id,
     get_target_by_name,
+    get_targets_page,
+    iter_credentials,
+    iter_targets,
+    reboot_targets,
+    shutdown_targets,
+    wake_and_wait_target_by_id,
+    wake_and_wait_targets,
     wakeup_target_by_id,
+    wakeup_targets,
 )
+from ..logic.inventory import (
+    FORMATS,
+    export_targets,
+    import_targets,
+    read_targets,
+)
+from ..models import db_pool_stats
+from .telemetry import instrument_blueprint
 
 crud = Blueprint('crud', __name__)
+instrument_blueprint(crud)
+
+MIMETYPES = {'csv': 'text/csv', 'json': 'application/json'}
+
+
+class InventoryFormatSchema(Schema):
+    format = fields.Str(missing=None, validate=validate.OneOf(FORMATS))  # noqa: A003, VNE003
+
+
+@crud.errorhandler(IntegrityError)
+def handle_integrity_error(error: IntegrityError):
+    """e.g. a duplicate mac."""
+    return {'error': str(error)}, 409
+
+
+def _stream_json_list(items: Iterable[dict]) -> Response:
+    """json array, sent item by item, so memory doesn't depend on its length."""
+    def generate():
+        yield '['
+        for i, item in enumerate(items):
+            yield (',' if i else '') + json.dumps(item)
+        yield ']'
+    return Response(stream_with_context(generate()), mimetype='application/json')
+
+
+def _events_response(events: Iterator[dict], stream: bool):
+    """progress events as json lines, while they happen, or only results of the last event.
+
+    results can be waited in background by the `async` query parameter, it's ignored for the stream.
+    """
+    if stream:
+        lines = (json.dumps(event) + '\n' for event in events)
+        return Response(stream_with_context(lines), mimetype='application/x-ndjson')
+    return _wait_results(events)
+
+
+@as_job('wake_and_wait')
+def _wait_results(events: Iterator[dict]):
+    *_, done = events
+    return {'results': done['results']}
+
+
+def _page_response(items: list, next_after: Optional[int]):
+    """json array with a link to the next page in the `Link` header, if there is one."""
+    headers = {}
+    if next_after is not None:
+        url = url_for(request.endpoint, **{**request.args.to_dict(), 'after': next_after})
+        headers['Link'] = f'<{url}>; rel="next"'
+    return Response(json.dumps(items), mimetype='application/json', headers=headers)
 
 
 @crud.route('/targets/', methods=['GET'])
-def get_targets():
-    return jsonify(get_all_targets())
+@parse_query(TargetsQuerySchema())
+def get_targets(query: dict):
+    """targets, ordered by id. a page with `limit`, otherwise all of them are streamed."""
+    limit = query.pop('limit')
+    try:
+        if limit:
+            return _page_response(*get_targets_page(limit, **query))
+        return _stream_json_list(iter_targets(**query))
+    except ValueError as e:
+        return {'fields': [str(e)]}, 400
 
 
 @crud.route('/targets/', methods=['POST'])
@@ -34,6 +135,30 @@ def create_target_(body: dict):
     return {'id': created}, 201
 
 
+@crud.route('/targets/import/', methods=['POST'])
+@parse_query(InventoryFormatSchema())
+def import_targets_(query: dict):
+    """create targets from csv or json body, targets with existing macs are updated.
+
+    the format is taken from the `format` parameter or from the content type.
+    """
+    format_ = query['format'] or ('csv' if request.mimetype == MIMETYPES['csv'] else 'json')
+    stream = io.TextIOWrapper(io.BufferedReader(request.stream), encoding='utf-8', newline='')
+    try:
+        return import_targets(read_targets(stream, format_))
+    except ValueError as e:
+        return {'body': [str(e)]}, 400
+
+
+@crud.route('/targets/export/', methods=['GET'])
+@parse_query(InventoryFormatSchema())
+def export_targets_(query: dict):
+    """all targets as csv or json (default), streamed."""
+    format_ = query['format'] or 'json'
+    return Response(stream_with_context(export_targets(format_)), mimetype=MIMETYPES[format_],
+                    headers={'Content-Disposition': f'attachment; filename=targets.{format_}'})
+
+
 @crud.route('/targets/<int:pk>/', methods=['GET'])
 def get_target_by_id_(pk: int):
     return get_target_by_id(pk)
@@ -63,15 +188,69 @@ def wakeup_target(pk: int):
     return '', 204
 
 
+@crud.route('/targets/wake/', methods=['POST'])
+@parse_body(BatchWakeupTargetsSchema())
+def wakeup_targets_(body: dict):
+    results = wakeup_targets(**body)
+    return {'results': results}
+
+
+@crud.route('/targets/<int:pk>/wake_and_wait/', methods=['POST'])
+@parse_body(WakeAndWaitSchema())
+def wake_and_wait_target(pk: int, body: dict):
+    """wakeup the target and wait, until it's reachable."""
+    stream = body.pop('stream')
+    return _events_response(wake_and_wait_target_by_id(pk, **body), stream)
+
+
+@crud.route('/targets/wake_and_wait/', methods=['POST'])
+@parse_body(BatchWakeAndWaitSchema())
+def wake_and_wait_targets_(body: dict):
+    """wakeup targets at once and wait, until they are reachable."""
+    stream = body.pop('stream')
+    return _events_response(wake_and_wait_targets(**body), stream)
+
+
+@crud.route('/targets/check/', methods=['POST'])
+@parse_body(CheckTargetsSchema())
+def check_all_targets_(body: dict):
+    results = check_all_targets(**body)
+    return {'results': results}
+
+
 @crud.route('/targets/<int:pk>/check/', methods=['POST'])
-def check_target(pk: int):
-    reached = check_target_by_id(pk)
-    return {'reached': reached}
+@parse_query(CheckTargetSchema())
+def check_target(pk: int, query: dict):
+    return check_target_by_id(pk, **query)
+
+
+@crud.route('/targets/reboot/', methods=['POST'])
+@parse_body(FleetActionSchema())
+@as_job('reboot_targets')
+def reboot_targets_(body: dict):
+    results = reboot_targets(**body)
+    return {'results': results}
+
+
+@crud.route('/targets/shutdown/', methods=['POST'])
+@parse_body(FleetActionSchema())
+@as_job('shutdown_targets')
+def shutdown_targets_(body: dict):
+    results = shutdown_targets(**body)
+    return {'results': results}
 
 
 @crud.route('/credentials/', methods=['GET'])
-def get_credentials_list():
-    return jsonify(get_all_credentials())
+@parse_query(CredentialsQuerySchema())
+def get_credentials_list(query: dict):
+    """credentials, ordered by id. a page with `limit`, otherwise all of them are streamed."""
+    limit = query.pop('limit')
+    try:
+        if limit:
+            return _page_response(*get_credentials_page(limit, **query))
+        return _stream_json_list(iter_credentials(**query))
+    except ValueError as e:
+        return {'fields': [str(e)]}, 400
 
 
 @crud.route('/credentials/', methods=['POST'])
@@ -97,3 +276,49 @@ def update_credentials(pk: int, body: dict):
 def delete_credentials(pk: int):
     delete_credentials_by_id(pk)
     return '', 204
+
+
+@crud.route('/schedules/', methods=['GET'])
+@parse_query(SchedulesQuerySchema())
+def get_schedules(query: dict):
+    return Response(json.dumps(get_all_schedules(**query)), mimetype='application/json')
+
+
+@crud.route('/schedules/', methods=['POST'])
+@parse_body(ScheduleSchema())
+def create_schedule_(body: dict):
+    created = create_schedule(**body)
+    return {'id': created}, 201
+
+
+@crud.route('/schedules/<int:pk>/', methods=['GET'])
+def get_schedule(pk: int):
+    return get_schedule_by_id(pk)
+
+
+@crud.route('/schedules/<int:pk>/', methods=['PUT', 'PATCH'])
+@parse_body(ScheduleSchema(partial=True))
+def update_schedule(pk: int, body: dict):
+    edit_schedule_by_id(pk, **body)
+    return '', 204
+
+
+@crud.route('/schedules/<int:pk>/', methods=['DELETE'])
+def delete_schedule(pk: int):
+    delete_schedule_by_id(pk)
+    return '', 204
+
+
+@crud.route('/scheduler/', methods=['GET'])
+def get_scheduler_stats_():
+    """state of the scheduler of this process. `running` is false, if it works in the separate process."""
+    return get_scheduler_stats()
+
+
+@crud.route('/db_pool/', methods=['GET'])
+def db_pool_stats_():
+    """usage of the database connection pool."""
+    stats = db_pool_stats()
+    if stats is None:
+        return {'error': 'the database is not pooled'}, 404
+    return stats
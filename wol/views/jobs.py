@@ -0,0 +1,36 @@
+from flask import Blueprint
+from marshmallow import Schema, fields, validate
+
+from ..decorators import parse_query
+from ..logic.jobs import job_queue
+from .telemetry import instrument_blueprint
+
+jobs = Blueprint('jobs', __name__)
+instrument_blueprint(jobs)
+
+
+class WaitJobSchema(Schema):
+    wait = fields.Float(missing=0, validate=validate.Range(min=0, max=60))
+
+
+@jobs.route('/jobs/<id_>/', methods=['GET'])
+@parse_query(WaitJobSchema())
+def get_job(id_: str, query: dict):
+    """state of the job. with `wait` it responds, when the job is finished or the time is out."""
+    job = job_queue.get(id_)
+    if not job:
+        return {'error': 'not found'}, 404
+    if query['wait']:
+        job.wait(query['wait'])
+    return job.as_dict()
+
+
+@jobs.route('/jobs/<id_>/', methods=['DELETE'])
+def cancel_job(id_: str):
+    """cancel the job. the running job is finished, but its result is dropped."""
+    job = job_queue.get(id_)
+    if not job:
+        return {'error': 'not found'}, 404
+    if not job.cancel():
+        return {'error': 'already finished'}, 409
+    return '', 204
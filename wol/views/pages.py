@@ -1,11 +1,23 @@
-from flask import Blueprint, render_template
+from flask import Blueprint, render_template, request
 
-from ..logic.crud import get_all_targets
+from ..decorators import parse_query
+from ..logic.crud import TargetsQuerySchema, get_targets_page, get_targets_statuses
+from .telemetry import instrument_blueprint
 
 pages = Blueprint('web', __name__, template_folder='../templates')
+instrument_blueprint(pages)
+
+
+PAGE_SIZE = 100
 
 
 @pages.route('/targets/', methods=['GET'])
-def get_web_targets():
-    targets = get_all_targets()
-    return render_template('targets.html', targets=targets)
+@parse_query(TargetsQuerySchema())
+def get_web_targets(query: dict):
+    query['limit'] = query['limit'] or PAGE_SIZE
+    # the table shows all fields
+    query['only'] = None
+    targets, next_after = get_targets_page(**query)
+    statuses = get_targets_statuses([target['id'] for target in targets])
+    next_args = {**request.args.to_dict(), 'after': next_after} if next_after is not None else None
+    return render_template('targets.html', targets=targets, statuses=statuses, next_args=next_args)
@@ -0,0 +1,59 @@
+import time
+
+from flask import (
+    Blueprint,
+    Response,
+    g,
+    request,
+)
+
+from ..logic.core import get_ssh_pool_stats
+from ..logic.jobs import job_queue
+from ..telemetry import (
+    CONTENT_TYPE,
+    http_request_seconds,
+    http_requests_in_progress,
+    registry,
+)
+
+__all__ = ['telemetry', 'instrument_blueprint']
+
+telemetry = Blueprint('telemetry', __name__)
+
+
+def _ssh_connections() -> dict:
+    stats = get_ssh_pool_stats()
+    return {('idle',): stats.idle, ('in_use',): stats.in_use}
+
+
+registry.gauge('wol_ssh_connections', "count of pooled ssh connections", ('state',), callback=_ssh_connections)
+registry.gauge('wol_job_queue_size', "count of queued background jobs", callback=job_queue.size)
+
+
+def instrument_blueprint(blueprint: Blueprint) -> None:
+    """count duration and running requests of the blueprint endpoints."""
+    @blueprint.before_request
+    def start_timer():
+        g.request_started = time.perf_counter()
+        http_requests_in_progress.inc(endpoint=request.endpoint)
+
+    @blueprint.after_request
+    def keep_status(response: Response) -> Response:
+        g.response_status = response.status_code
+        return response
+
+    @blueprint.teardown_request
+    def observe_duration(_error):
+        # streamed responses are finished here, and it's called again by the context of the stream
+        started = g.pop('request_started', None)
+        if started is None:
+            return
+        http_requests_in_progress.dec(endpoint=request.endpoint)
+        http_request_seconds.observe(time.perf_counter() - started, endpoint=request.endpoint,
+                                     method=request.method, status=g.get('response_status', 500))
+
+
+@telemetry.route('/metrics', methods=['GET'])
+def metrics():
+    """metrics of all workers in the prometheus text format."""
+    return Response(registry.expose(), content_type=CONTENT_TYPE)
@@ -4,24 +4,41 @@ entrypoint for launching dev server.
 """
 
 import logging
+import os
 import sys
+import tempfile
+from contextlib import nullcontext
+from typing import Optional
 
 from configargparse import ArgumentDefaultsHelpFormatter, ArgumentParser
 from environs import Env
 from flask import Flask, Response, jsonify
 from marshmallow import ValidationError
 
-from .views import core
+from .logic.async_ssh import async_ssh_client
+from .logic.core import SSH_BACKENDS, ssh_options, ssh_pool
+from .logic.jobs import job_queue
+from .logic.neighbors import DbNeighborTable, neighbor_scanner
+from .logic.sampler import SAMPLE_FIELDS, samplers
+from .logic.timeseries import TimeSeriesStore
+from .profiling import MODES, ProfilerMiddleware
+from .telemetry import registry
+from .views import core, jobs, telemetry
 
 try:
     from . import models
 except ImportError:
     models = None
 else:
+    from playhouse.pool import MaxConnectionsExceeded
+
+    from .logic.inventory import export_targets, import_targets, read_targets
+    from .logic.monitor import DbStatusCache, MemoryStatusCache, status_monitor
+    from .logic.scheduler import wakeup_scheduler
     from .views import crud, pages
 
 
-def create_app(no_db: bool = False):
+def create_app(no_db: bool = False, background: bool = True):
     env = Env()
     env.read_env()
 
@@ -30,21 +47,78 @@ def create_app(no_db: bool = False):
 
     app = Flask(__name__)
     app.register_blueprint(core, url_prefix='/api')
+    app.register_blueprint(jobs, url_prefix='/api')
+    app.register_blueprint(telemetry)
 
     with env.prefixed('WOL_'):
         logger.setLevel(env.log_level('LOG_LEVEL', logging.DEBUG))
+        ssh_options.backend = env.str('SSH_BACKEND', 'fabric', validate=lambda backend: backend in SSH_BACKENDS)
+        ssh_options.connect_timeout = env.float('SSH_CONNECT_TIMEOUT', 10)
+        ssh_options.command_timeout = env.float('SSH_COMMAND_TIMEOUT', 60)
+        ssh_pool.idle_timeout = async_ssh_client.idle_timeout = env.float('SSH_IDLE_TIMEOUT', 60)
+        ssh_pool.max_per_key = async_ssh_client.max_per_key = env.int('SSH_MAX_PER_HOST', 4)
+        job_queue.workers = env.int('JOB_WORKERS', 4)
+        job_queue.max_size = env.int('JOB_QUEUE_SIZE', 100)
+        job_queue.keep = env.float('JOB_KEEP', 300)
+        job_queue.app, job_queue.database = app, None
+        neighbor_scanner.stale_after = env.float('NEIGHBOR_STALE_AFTER', 300)
+        neighbor_scanner.chunk_size = env.int('SCAN_CHUNK_SIZE', 256)
+        neighbor_scanner.parallelism = env.int('SCAN_PARALLELISM', 8)
+        telemetry_dir = env.str('TELEMETRY_DIR', None)
+        if telemetry_dir and background:
+            registry.start_saving(telemetry_dir, env.float('TELEMETRY_INTERVAL', 1))
+        profile_mode = env.str('PROFILE', None, validate=lambda mode: mode in MODES)
+        if profile_mode:
+            app.wsgi_app = ProfilerMiddleware(
+                app.wsgi_app,
+                env.str('PROFILE_DIR', os.path.join(tempfile.gettempdir(), 'wol-profiles')),
+                mode=profile_mode,
+                all_requests=env.bool('PROFILE_ALL', False),
+                interval=env.float('PROFILE_INTERVAL', 0.005),
+            )
+        samplers.store = TimeSeriesStore(SAMPLE_FIELDS, memory_budget=env.int('METRICS_MEMORY', 16) * 2**20,
+                                         max_hosts=env.int('METRICS_MAX_HOSTS', 64))
         if not env('NO_DB', False) and not no_db and models:  # TODO: shit
-            app.config['DATABASE'] = env.str('DATABASE_URL', 'postgres://postgres@localhost:5432/wol')
+            app.config['DATABASE'] = models.make_database(
+                env.str('DATABASE_URL', 'postgres://postgres@localhost:5432/wol'),
+                pool=env.bool('DB_POOL', True),
+                max_connections=env.int('DB_MAX_CONNECTIONS', 20),
+                stale_timeout=env.float('DB_STALE_TIMEOUT', 300),
+                pool_timeout=env.float('DB_POOL_TIMEOUT', 10),
+                sqlite_wal=env.bool('SQLITE_WAL', True),
+                sqlite_busy_timeout=env.float('SQLITE_BUSY_TIMEOUT', 5),
+            )
             models.db.init_app(app)
+            job_queue.database = models.db.database
             app.register_blueprint(crud, url_prefix='/api')
             app.register_blueprint(pages)
 
+            cache_class = DbStatusCache if env.bool('STATUS_SHARED', False) else MemoryStatusCache
+            status_monitor.cache = cache_class(ttl=env.float('STATUS_TTL', 60))
+            status_monitor.interval = env.float('STATUS_INTERVAL', 0)
+            neighbor_scanner.table = DbNeighborTable()
+            wakeup_scheduler.sync_interval = env.float('SCHEDULER_SYNC_INTERVAL', 30)
+            wakeup_scheduler.rate = env.float('SCHEDULER_RATE', None)
+            if background:
+                status_monitor.start()
+                # one scheduler per deployment, otherwise wakeups are duplicated
+                if env.bool('SCHEDULER', False):
+                    wakeup_scheduler.start()
+            spill_interval = env.float('METRICS_SPILL_INTERVAL', 0)
+            if spill_interval and background:
+                samplers.store.start_spilling(spill_interval)
+
     @app.errorhandler(ValidationError)
     def handle_validation(error: ValidationError):
         response = jsonify(error.messages)
         response.status_code = 400
         return response
 
+    if models:
+        @app.errorhandler(MaxConnectionsExceeded)
+        def handle_pool_exhausted(_error: MaxConnectionsExceeded):
+            return {'error': 'too many database connections'}, 503, {'Retry-After': '1'}
+
     @app.errorhandler(NotImplementedError)
     def handle_not_implemented(_error: NotImplementedError):
         return Response(status=501)
@@ -54,6 +128,28 @@ def create_app(no_db: bool = False):
     # TODO: catch 404?
 
 
+def transfer_targets(command: str, path: str, format_: Optional[str], batch_size: int) -> None:
+    """import or export targets through the file."""
+    if not format_:
+        format_ = 'csv' if path.endswith('.csv') else 'json'
+    if command == 'export':
+        with (open(path, 'w', newline='') if path != '-' else nullcontext(sys.stdout)) as f:
+            f.writelines(export_targets(format_))
+        return
+
+    with (open(path, newline='') if path != '-' else nullcontext(sys.stdin)) as f:
+        try:
+            result = import_targets(read_targets(f, format_), batch_size)
+        except ValueError as e:
+            print(f"bad {format_}: {e}")
+            sys.exit(1)
+    for error in result['errors']:
+        print(f"row {error['row']}: {error['errors']}", file=sys.stderr)
+    print(f"created: {result['created']}, updated: {result['updated']}, failed: {result['failed']}")
+    if result['failed']:
+        sys.exit(1)
+
+
 def dev_server():
     parser = ArgumentParser(
         auto_env_var_prefix='WOL_',
@@ -65,23 +161,48 @@ def dev_server():
                         help="run in debug mode")
     parser.add_argument('--no-db', action='store_true', default=False,
                         help="do not use database and disable CRUD api")
-    parser.add_argument('command', choices=('run', 'initdb'), nargs='?', default='run')
+    parser.add_argument('--file', '-f', default='-', help="file for import and export, \"-\" - stdin/stdout")
+    parser.add_argument('--format', choices=('csv', 'json'),
+                        help="format of import and export. default - by the file extension or json")
+    parser.add_argument('--batch-size', type=int, default=500, help="count of targets in one insert of import")
+    parser.add_argument('command', choices=('run', 'initdb', 'migrate', 'monitor', 'scheduler', 'import', 'export'),
+                        nargs='?', default='run')
 
     args = parser.parse_args()
-    app = create_app(no_db=args.no_db)
+    app = create_app(no_db=args.no_db, background=args.command == 'run')
 
     if args.command == 'run':
         app.run(host=args.bind, port=args.port, debug=args.debug)
-    elif args.command == 'initdb':
-        if args.no_db:
-            print("incompatible command and \"--no-db\" argument")
+        return
+
+    if args.no_db:
+        print("incompatible command and \"--no-db\" argument")
+        sys.exit(1)
+    elif not models:
+        print("database deps is not installed (extra \"db\"")
+        sys.exit(1)
+
+    if args.command == 'initdb':
+        models.init_db()
+        print("db initialized")
+    elif args.command == 'migrate':
+        try:
+            applied = models.migrate_db()
+        except ValueError as e:
+            print(e)
             sys.exit(1)
-        elif not models:
-            print("database deps is not installed (extra \"db\"")
+        print("\n".join(applied) if applied else "db is up to date")
+    elif args.command in ('import', 'export'):
+        transfer_targets(args.command, args.file, args.format, args.batch_size)
+    elif args.command == 'monitor':
+        if not status_monitor.interval:
+            print("refresh interval is not set (\"WOL_STATUS_INTERVAL\")")
             sys.exit(1)
-        else:
-            models.init_db()
-            print("db initialized")
+        # statuses are useful for the web app only through the shared cache
+        status_monitor.cache = DbStatusCache(ttl=status_monitor.cache.ttl)
+        status_monitor.run()
+    elif args.command == 'scheduler':
+        wakeup_scheduler.run()
 
 
 if __name__ == '__main__':